@@ -5,21 +5,26 @@ Complete backend catalog management and OpenAI Image Edit API integration
 for professional house/garage exterior renovations.
 
 Usage:
-1. Run: python architectural_visualizer.py
+1. Run: python -m backend.architectural_visualizer (from the repository root)
 2. Follow prompts to select products and edit image
 """
 
 import os
 import base64
 import json
+import math
+import time
 # import importlib.util
-from PIL import Image
+import numpy as np
+from PIL import Image, ImageFilter, ImageOps
 from io import BytesIO
-from typing import Dict, List, Optional, Tuple, Any
+from typing import Dict, List, Optional, Tuple, Any, BinaryIO, Callable, Union
 from dataclasses import dataclass
 from openai import OpenAI
 # import requests
 
+from backend.bitmask import BitMask
+
 # =============================================================================
 # PRODUCT CATALOG
 # =============================================================================
@@ -280,7 +285,11 @@ def _resolve_product(pid: int) -> Optional[ResolvedProduct]:
         prompt=p.get("prompt", {}),
     )
 
-def validate_selection(selection: Dict[str, int]) -> Tuple[bool, str, Dict[str, ResolvedProduct]]:
+def validate_selection(
+    selection: Dict[str, int],
+    resolve: Optional[Callable[[int], Optional[ResolvedProduct]]] = None,
+) -> Tuple[bool, str, Dict[str, ResolvedProduct]]:
+    resolve = resolve or _resolve_product
     resolved = {}
     for key in selection.keys():
         if key not in UI_CATEGORIES:
@@ -289,7 +298,7 @@ def validate_selection(selection: Dict[str, int]) -> Tuple[bool, str, Dict[str,
         pid = selection.get(ui_cat)
         if pid is None:
             continue
-        rp = _resolve_product(pid)
+        rp = resolve(pid)
         if rp is None:
             return False, f"Invalid or non-editable product id {pid} for category '{ui_cat}'", {}
         if rp.ui_category != ui_cat:
@@ -333,32 +342,46 @@ def get_openai_client():
         _client = OpenAI()
     return _client
 
-def build_edit_prompt(products_json: Dict[str, Any]) -> str:
-    # SYSTEM INTENT
-    system_intent = (
-        "You are a professional architectural renovation AI specializing in house and garage exterior visualization. "
-        "You create realistic renovation previews by applying construction products to specific architectural regions."
-    )
-
-    # TASK INSTRUCTIONS
-    task_parts = []
-    if products_json.get("roof"):
-        roof = products_json["roof"]
-        attrs = roof["attributes"]
-        task_parts.append(f"Change the roof to {attrs['color']} {attrs['texture']} {attrs['finish']} {attrs['pattern_or_look']}. Apply only to roof surfaces.")
-    if products_json.get("siding"):
-        siding = products_json["siding"]
-        attrs = siding["attributes"]
-        task_parts.append(f"Change the siding/walls to {attrs['color']} {attrs['texture']} {attrs['finish']} {attrs['pattern_or_look']}. Apply only to wall/siding areas.")
-    if products_json.get("trim"):
-        trim = products_json["trim"]
-        attrs = trim["attributes"]
-        task_parts.append(f"Change the trim (fascia, edges, corners, rake, ridge) to {attrs['color']} {attrs['texture']} {attrs['finish']} {attrs['pattern_or_look']}. Apply only to trim regions.")
+# Anything an image can be handed over as: a file path, raw encoded bytes,
+# a file-like buffer or an already opened PIL image.
+ImageInput = Union[str, bytes, BinaryIO, Image.Image]
+
+def read_image_bytes(image: ImageInput) -> bytes:
+    """Return the encoded bytes of ``image`` without keeping any file open."""
+    if isinstance(image, bytes):
+        return image
+    if isinstance(image, Image.Image):
+        buffer = BytesIO()
+        image.save(buffer, format="PNG")
+        return buffer.getvalue()
+    if isinstance(image, str):
+        if not os.path.exists(image):
+            raise ValueError(f"Image file not found: {image}")
+        with open(image, "rb") as f:
+            return f.read()
+    if hasattr(image, "seek"):
+        image.seek(0)
+    return image.read()
+
+def as_upload(image_bytes: bytes, name: str) -> Tuple[str, bytes, str]:
+    """Wrap encoded image bytes as a (filename, content, mimetype) upload for the OpenAI SDK."""
+    fmt = (Image.open(BytesIO(image_bytes)).format or "PNG").lower()
+    ext = "jpg" if fmt == "jpeg" else fmt
+    return f"{name}.{ext}", image_bytes, f"image/{fmt}"
+
+EDIT_SYSTEM_INTENT = (
+    "You are a professional architectural renovation AI specializing in house and garage exterior visualization. "
+    "You create realistic renovation previews by applying construction products to specific architectural regions."
+)
 
-    task_instructions = " ".join(task_parts) if task_parts else "No changes requested."
+# Task sentence per visual category, filled from a product's attributes
+EDIT_TASK_TEMPLATES = {
+    "roof": "Change the roof to {color} {texture} {finish} {pattern_or_look}. Apply only to roof surfaces.",
+    "siding": "Change the siding/walls to {color} {texture} {finish} {pattern_or_look}. Apply only to wall/siding areas.",
+    "trim": "Change the trim (fascia, edges, corners, rake, ridge) to {color} {texture} {finish} {pattern_or_look}. Apply only to trim regions.",
+}
 
-    # STRICT RULES
-    strict_rules = (
+EDIT_RULES = (
     # "REGION LOCK RULE: "
     # "Treat the input image as a locked real photograph. "
     # "Only repaint pixels belonging to the specified architectural surfaces. "
@@ -392,13 +415,20 @@ def build_edit_prompt(products_json: Dict[str, Any]) -> str:
     "If any region is unclear or not visible, do not modify it."
 )
 
-    # Combine all parts
-    full_prompt = f"{system_intent}\n\nTASK: {task_instructions}\n\nRULES: {strict_rules}"
+def product_task(ui_category: str, attributes: Dict[str, Any]) -> str:
+    """The TASK sentence applying one product's attributes to its category."""
+    return EDIT_TASK_TEMPLATES[ui_category].format(**attributes)
 
-    # Logging for debugging
-    print(f"Generated prompt: {full_prompt}")
+def compose_edit_prompt(task_parts: List[str]) -> str:
+    task_instructions = " ".join(task_parts) if task_parts else "No changes requested."
+    return f"{EDIT_SYSTEM_INTENT}\n\nTASK: {task_instructions}\n\nRULES: {EDIT_RULES}"
 
-    return full_prompt
+def build_edit_prompt(products_json: Dict[str, Any]) -> str:
+    return compose_edit_prompt([
+        product_task(ui_category, products_json[ui_category]["attributes"])
+        for ui_category in EDIT_TASK_TEMPLATES
+        if products_json.get(ui_category)
+    ])
 
 # def edit_image(image_path: str, products_json: Dict[str, Any]) -> bytes:
     # if not os.path.exists(image_path):
@@ -417,40 +447,281 @@ def build_edit_prompt(products_json: Dict[str, Any]) -> str:
 
     # image_base64 = response.data[0].b64_json
     # return base64.b64decode(image_base64)
-def edit_image(image_path: str, products_json: Dict[str, Any]) -> bytes:
-    if not os.path.exists(image_path):
-        raise ValueError(f"Image file not found: {image_path}")
-
-    # 🔹 Read original image size
-    original_img = Image.open(image_path)
-    original_width, original_height = original_img.size
-
-    prompt = build_edit_prompt(products_json)
+def request_image_edit(image_bytes: bytes, prompt: str, mask_bytes: Optional[bytes] = None) -> bytes:
+    """Run one blocking gpt-image-1 edit call and return the decoded model output."""
     client = get_openai_client()
 
-    with open(image_path, "rb") as img_file, open("mask.png", "rb") as mask_file:
-        response = client.images.edit(
-            model="gpt-image-1",
-            prompt=prompt,
-            image=img_file,
-             mask=mask_file
-        )
+    extra = {}
+    if mask_bytes is not None:
+        extra["mask"] = as_upload(mask_bytes, "mask")
+
+    response = client.images.edit(
+        model="gpt-image-1",
+        prompt=prompt,
+        image=as_upload(image_bytes, "image"),
+        **extra
+    )
 
     image_base64 = response.data[0].b64_json
-    edited_bytes = base64.b64decode(image_base64)
+    return base64.b64decode(image_base64)
 
-    # 🔹 Resize back to original size (no AI look)
-    edited_img = Image.open(BytesIO(edited_bytes))
-    edited_img = edited_img.resize(
-        (original_width, original_height),
-        Image.LANCZOS
+def image_size(image_bytes: bytes) -> Tuple[int, int]:
+    """(width, height) of encoded image bytes; only the header is parsed."""
+    return Image.open(BytesIO(image_bytes)).size
+
+# Long side of the image actually sent to the model. gpt-image-1 works at
+# ~1024px, so anything bigger only makes the upload slower.
+MODEL_MAX_SIDE = 1024
+MODEL_JPEG_QUALITY = 90
+
+# EXIF orientations that rotate the image by 90 degrees (width/height swap)
+_TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+@dataclass
+class PreparedImage:
+    model_bytes: bytes              # upright, downscaled JPEG sent to OpenAI
+    model_size: Tuple[int, int]
+    original_size: Tuple[int, int]  # upright size of the full-resolution upload
+    original_bytes: int             # size of the upload as received
+
+    @property
+    def bytes_saved(self) -> int:
+        return max(0, self.original_bytes - len(self.model_bytes))
+
+def prepare_image(image_bytes: bytes) -> PreparedImage:
+    """
+    Normalize an upload for the model: apply EXIF orientation, downscale to
+    MODEL_MAX_SIDE and re-encode as a compact JPEG.
+
+    JPEGs are decoded at a reduced DCT scale (Image.draft), so a 24 MP phone
+    photo is never fully decoded just to be shrunk.
+    """
+    img = Image.open(BytesIO(image_bytes))
+    width, height = img.size
+    if img.getexif().get(0x0112) in _TRANSPOSED_ORIENTATIONS:
+        width, height = height, width
+
+    img.draft("RGB", (MODEL_MAX_SIDE, MODEL_MAX_SIDE))
+    img = ImageOps.exif_transpose(img)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    img.thumbnail((MODEL_MAX_SIDE, MODEL_MAX_SIDE), Image.LANCZOS)
+
+    buffer = BytesIO()
+    img.save(buffer, format="JPEG", quality=MODEL_JPEG_QUALITY, optimize=True)
+
+    return PreparedImage(
+        model_bytes=buffer.getvalue(),
+        model_size=img.size,
+        original_size=(width, height),
+        original_bytes=len(image_bytes),
     )
 
-    final_buffer = BytesIO()
-    edited_img.save(final_buffer, format="JPEG", quality=95)
+# Feather width of the mask edge, in model-resolution pixels
+MASK_FEATHER_RADIUS = 1.5
+FINAL_JPEG_QUALITY = 95
+PREVIEW_JPEG_QUALITY = 80
+
+# (PIL format, quality, progressive) of an encoding of the final render
+EncodeArgs = Tuple[str, int, bool]
+
+# Memory budget of the full-resolution stages (decode, composite, encode).
+# The decoded upload is the one full-size buffer (Pillow cannot decode or
+# encode a JPEG piecemeal); the composite works in strips of rows. The
+# server reserves each render's estimate (render_bytes) from the budget
+# before starting it (WorkerPools.render_memory), so concurrent renders
+# wait for each other instead of adding up past it; they stay at full
+# resolution as long as one render fits the whole budget. Only an upload
+# too big for it on its own is rendered at 1/2, 1/4, ... scale (JPEGs are
+# decoded at that scale), and the response says so (X-Render-Scale).
+#   VISUALIZER_RENDER_MEMORY_MB  memory of all the renders running at once in
+#                                one process (default 320; 0: no limit)
+#   VISUALIZER_STRIP_MB          working memory of one composite strip (default 8)
+
+# Peak bytes per output pixel: Pillow keeps RGB at 4 bytes, and the encoders
+# add their own buffers (progressive JPEG holds every DCT coefficient, WebP
+# an ARGB and a YUV copy) plus the encoded output
+DECODED_BYTES_PER_PIXEL = 4.0
+ENCODER_BYTES_PER_PIXEL = {"JPEG": 0.5, "PJPEG": 3.5, "WEBP": 6.5}
+
+DEFAULT_RENDER_ENCODINGS: Tuple[EncodeArgs, ...] = (("JPEG", FINAL_JPEG_QUALITY, False),)
+
+def strip_bytes() -> int:
+    return int(float(os.getenv("VISUALIZER_STRIP_MB", "8")) * 1024 * 1024)
+
+def render_memory_budget() -> int:
+    """VISUALIZER_RENDER_MEMORY_MB in bytes; 0 for no limit."""
+    return max(0, int(float(os.getenv("VISUALIZER_RENDER_MEMORY_MB", "320")) * 1024 * 1024))
+
+def _bytes_per_pixel(encodings: Tuple[EncodeArgs, ...]) -> float:
+    encoder = max(
+        ENCODER_BYTES_PER_PIXEL["PJPEG" if progressive else format]
+        for format, _, progressive in encodings
+    )
+    return DECODED_BYTES_PER_PIXEL + encoder
+
+def render_bytes(size: Tuple[int, int], encodings: Tuple[EncodeArgs, ...] = DEFAULT_RENDER_ENCODINGS) -> int:
+    """Estimated peak memory of rendering ``size`` (as rendered, i.e. after render_reduction) into ``encodings``."""
+    return int(size[0] * size[1] * _bytes_per_pixel(encodings)) + strip_bytes()
+
+def render_max_pixels(encodings: Tuple[EncodeArgs, ...] = DEFAULT_RENDER_ENCODINGS) -> int:
+    """Largest render (in pixels) that fits the whole memory budget when encoded as ``encodings``; 0 for no limit."""
+    budget = render_memory_budget()
+    if budget <= 0:
+        return 0
+    return max(1, int((budget - strip_bytes()) / _bytes_per_pixel(encodings)))
+
+def render_reduction(size: Tuple[int, int], encodings: Tuple[EncodeArgs, ...] = DEFAULT_RENDER_ENCODINGS) -> int:
+    """Power-of-two factor ``size`` is rendered down by to fit the budget; 1 for full resolution."""
+    return _reduction_factor(size, render_max_pixels(encodings))
+
+def reduced_size(size: Tuple[int, int], factor: int) -> Tuple[int, int]:
+    return (max(1, size[0] // factor), max(1, size[1] // factor))
+
+def _reduction_factor(size: Tuple[int, int], max_pixels: int) -> int:
+    """Smallest power of two that brings ``size`` within ``max_pixels`` (1 when there is no limit)."""
+    factor = 1
+    while max_pixels and (size[0] // factor) * (size[1] // factor) > max_pixels and factor < min(size):
+        factor *= 2
+    return factor
+
+def load_original(image_bytes: bytes, max_pixels: int = 0) -> Image.Image:
+    """
+    Decode the full-resolution upload, upright and in RGB. Above
+    ``max_pixels`` (see render_max_pixels) it is scaled down by a power of
+    two: JPEGs are decoded at a reduced DCT scale, other formats decoded and
+    then reduced.
+    """
+    img = Image.open(BytesIO(image_bytes))
+    factor = _reduction_factor(img.size, max_pixels)
+    if factor > 1:
+        target_width, target_height = reduced_size(img.size, factor)
+        img.draft("RGB", (target_width, target_height))
+        # draft only goes down to 1/8, and only for JPEG
+        remaining = img.width // target_width
+        if remaining > 1:
+            img = img.reduce(remaining)
+    # In place: exif_transpose otherwise copies even an upright image
+    ImageOps.exif_transpose(img, in_place=True)
+    return img if img.mode == "RGB" else img.convert("RGB")
+
+def composite_edit(original: Image.Image, edited_bytes: bytes, mask: BitMask) -> Image.Image:
+    """
+    Blend the model's edit onto the full-resolution original inside the mask.
+
+    Only the mask's bounding box is upscaled, a strip of rows at a time: the
+    edited pixels with LANCZOS, the feathered mask with BILINEAR. Everything
+    outside the mask keeps the original pixels untouched. ``mask`` is the
+    model-resolution mask the edit was requested with; ``original`` is
+    modified in place and returned.
+    """
+    model_size = mask.size
+    bbox = mask.bbox(math.ceil(3 * MASK_FEATHER_RADIUS))
+    if bbox is None:
+        return original
+
+    # The model may answer at a different aspect; bring it back to the
+    # frame the mask was drawn in.
+    edited_img = Image.open(BytesIO(edited_bytes)).convert("RGB")
+    if edited_img.size != model_size:
+        edited_img = edited_img.resize(model_size, Image.LANCZOS)
+
+    alpha = mask.to_alpha().filter(ImageFilter.GaussianBlur(MASK_FEATHER_RADIUS))
+
+    # Full-resolution box covering the mask bbox, and its exact source box
+    sx = original.width / model_size[0]
+    sy = original.height / model_size[1]
+    fx0, fy0 = math.floor(bbox[0] * sx), math.floor(bbox[1] * sy)
+    fx1 = min(original.width, math.ceil(bbox[2] * sx))
+    fy1 = min(original.height, math.ceil(bbox[3] * sy))
+    source_box = (fx0 / sx, fy0 / sy, fx1 / sx, fy1 / sy)
+
+    # Upscaled in strips of rows, so the extra memory stays within
+    # strip_bytes() however large the original (resize with a box samples
+    # the same source pixels as one big resize, so strips join seamlessly)
+    rows = max(16, strip_bytes() // (5 * (fx1 - fx0)))
+    for y0 in range(fy0, fy1, rows):
+        y1 = min(fy1, y0 + rows)
+        strip_box = (source_box[0], y0 / sy, source_box[2], y1 / sy)
+        strip_size = (fx1 - fx0, y1 - y0)
+        alpha_patch = alpha.resize(strip_size, Image.BILINEAR, box=strip_box)
+        if alpha_patch.getbbox() is None:
+            continue
+        edited_patch = edited_img.resize(strip_size, Image.LANCZOS, box=strip_box)
+        original.paste(edited_patch, (fx0, y0), alpha_patch)
+    return original
+
+def encode_image(img: Image.Image, format: str = "JPEG", quality: int = FINAL_JPEG_QUALITY,
+                 progressive: bool = False) -> bytes:
+    """Encode the final render; progressive JPEGs are also Huffman-optimized."""
+    buffer = BytesIO()
+    if format == "JPEG" and progressive:
+        img.save(buffer, format="JPEG", quality=quality, progressive=True, optimize=True)
+    elif format == "WEBP":
+        # method 2: about half the encode time of the default 4 for ~3% larger files
+        img.save(buffer, format="WEBP", quality=quality, method=2)
+    else:
+        img.save(buffer, format=format, quality=quality)
+    return buffer.getvalue()
+
+def transcode(image_bytes: bytes, format: str, quality: int, progressive: bool = False) -> bytes:
+    """Re-encode an already rendered edit (e.g. the cached JPEG) in another output encoding."""
+    img = load_original(image_bytes, render_max_pixels(((format, quality, progressive),)))
+    return encode_image(img, format, quality, progressive)
+
+def preview_edit(model_bytes: bytes, edited_bytes: bytes, mask: BitMask) -> bytes:
+    """
+    Quick low-resolution result: the edit composited onto the prepared
+    (model-size) image instead of the full-resolution upload. A few tens of
+    milliseconds, so it can be shown while the full composite is made.
+    """
+    img = Image.open(BytesIO(model_bytes)).convert("RGB")
+    return encode_image(composite_edit(img, edited_bytes, mask), "JPEG", PREVIEW_JPEG_QUALITY)
+
+def finish_edit(image_bytes: bytes, edited_bytes: bytes, mask_png: bytes) -> bytes:
+    """Composite the model output onto the full-resolution upload and encode the final JPEG."""
+    return timed_finish_edit(image_bytes, edited_bytes, BitMask.from_png(mask_png))[0][0]
+
+def timed_finish_edit(
+    image_bytes: bytes,
+    edited_bytes: bytes,
+    mask: BitMask,
+    encodings: Tuple[EncodeArgs, ...] = DEFAULT_RENDER_ENCODINGS,
+) -> Tuple[List[bytes], Dict[str, float]]:
+    """
+    finish_edit into each of ``encodings`` (the composite is done once),
+    plus the seconds spent decoding, compositing and encoding.
+    """
+    start = time.perf_counter()
+    original = load_original(image_bytes, render_max_pixels(encodings))
+    decoded = time.perf_counter()
+    composite = composite_edit(original, edited_bytes, mask)
+    blended = time.perf_counter()
+    outputs = [encode_image(composite, *args) for args in encodings]
+    encoded = time.perf_counter()
+    return outputs, {
+        "decode": decoded - start,
+        "blend": blended - decoded,
+        "encode": encoded - blended,
+    }
 
-    return final_buffer.getvalue()
+def edit_image(image: ImageInput, products_json: Dict[str, Any], mask: ImageInput) -> bytes:
+    """
+    Apply the selected products to ``image`` inside ``mask`` and return JPEG bytes.
 
+    Both the image and the RGBA mask are taken in memory (see ImageInput), so
+    concurrent requests never share files. The model sees the prepared
+    (downscaled) image; its edit is composited onto the full-resolution
+    original inside the mask.
+    """
+    image_bytes = read_image_bytes(image)
+    prepared = prepare_image(image_bytes)
+    mask_bytes = fit_mask(read_image_bytes(mask), prepared.model_size)
+
+    prompt = build_edit_prompt(products_json)
+    edited_bytes = request_image_edit(prepared.model_bytes, prompt, mask_bytes)
+
+    return finish_edit(image_bytes, edited_bytes, mask_bytes)
 
 def save_edited_image(image_bytes: bytes, output_path: str) -> None:
     with open(output_path, "wb") as f:
@@ -473,16 +744,22 @@ def preview_image(image_path: str) -> None:
         print(f"📁 Please manually open: {image_path}")
 
 
+# Mask instruction per visual region, in prompt order
+MASK_REGION_PROMPTS = {
+    "roof": "Highlight roof areas in solid white.",
+    "siding": "Highlight wall and siding areas in solid white.",
+    "trim": "Highlight trim, fascia, rake, ridge edges in solid white.",
+}
+
+def mask_regions(products_json: Dict[str, Any]) -> Tuple[str, ...]:
+    """The visual regions a mask for ``products_json`` has to cover."""
+    return tuple(region for region in MASK_REGION_PROMPTS if products_json.get(region))
+
 def build_mask_prompt(products_json: Dict[str, Any]) -> str:
-    parts = []
-    if products_json.get("roof"):
-        parts.append("Highlight roof areas in solid white.")
-    if products_json.get("siding"):
-        parts.append("Highlight wall and siding areas in solid white.")
-    if products_json.get("trim"):
-        parts.append("Highlight trim, fascia, rake, ridge edges in solid white.")
+    return build_region_mask_prompt(mask_regions(products_json))
 
-    task = " ".join(parts)
+def build_region_mask_prompt(regions: Tuple[str, ...]) -> str:
+    task = " ".join(MASK_REGION_PROMPTS[region] for region in regions)
 
     return (
         "Generate a black and white segmentation mask image. "
@@ -491,6 +768,28 @@ def build_mask_prompt(products_json: Dict[str, Any]) -> str:
         f"{task} "
         "No textures, no colors, no shading. Flat binary mask."
     )
+
+# Channel value above which a model mask pixel counts as "white" (editable)
+MASK_WHITE_THRESHOLD = 200
+
+def threshold_mask(mask_bytes: bytes, size: Tuple[int, int]) -> BitMask:
+    """
+    Turn the model's black/white mask output into the edit mask at ``size``.
+
+    Pixels with R, G and B all above MASK_WHITE_THRESHOLD are editable,
+    everything else locked. Thresholding runs on the model-sized image and
+    only the 1-bit result is resized with NEAREST, which gives exactly the
+    same pixels as resizing first.
+    """
+    rgb = np.asarray(Image.open(BytesIO(mask_bytes)).convert("RGB"))
+    editable = (rgb > MASK_WHITE_THRESHOLD).all(axis=2)
+    return BitMask.from_array(editable).resize(size)
+
+def binarize_mask(mask_bytes: bytes, size: Tuple[int, int]) -> Image.Image:
+    """threshold_mask as the RGBA edit mask image: opaque white where editable, transparent elsewhere."""
+    band = threshold_mask(mask_bytes, size).to_alpha()
+    return Image.merge("RGBA", (band, band, band, band))
+
 # def generate_and_save_mask(image_path: str, products_json: Dict[str, Any], mask_path: str) -> None:
     # client = get_openai_client()
     # prompt = build_mask_prompt(products_json)
@@ -510,39 +809,42 @@ def build_mask_prompt(products_json: Dict[str, Any]) -> str:
     #     f.write(mask_bytes)
 
     # print(f"🩶 Mask image saved to {mask_path}")
-def generate_and_save_mask(image_path: str, products_json: Dict[str, Any], mask_path: str) -> None:
-    client = get_openai_client()
-    prompt = build_mask_prompt(products_json)
+def finish_mask(raw_mask_bytes: bytes, size: Tuple[int, int]) -> bytes:
+    """Binarize the model's mask output at ``size`` and encode it as RGBA PNG bytes."""
+    return threshold_mask(raw_mask_bytes, size).to_png()
 
-    original_img = Image.open(image_path)
-    original_width, original_height = original_img.size
+def fit_mask(mask_png: bytes, size: Tuple[int, int]) -> bytes:
+    """Return ``mask_png`` resized (NEAREST) to ``size`` if it is not that size already."""
+    mask_img = Image.open(BytesIO(mask_png))
+    if mask_img.size == size:
+        return mask_png
 
-    with open(image_path, "rb") as img_file:
-        response = client.images.edit(
-            model="gpt-image-1",
-            prompt=prompt,
-            image=img_file
-        )
+    mask_buffer = BytesIO()
+    mask_img.resize(size, Image.NEAREST).save(mask_buffer, format="PNG")
+    return mask_buffer.getvalue()
 
-    mask_base64 = response.data[0].b64_json
-    mask_bytes = base64.b64decode(mask_base64)
+def generate_mask(image: ImageInput, products_json: Dict[str, Any]) -> bytes:
+    """
+    Ask the model for a segmentation mask of ``image`` and return it as RGBA PNG bytes.
 
-    # Convert to RGBA
-    mask_img = Image.open(BytesIO(mask_bytes)).convert("RGBA")
-    mask_img = mask_img.resize((original_width, original_height), Image.NEAREST)
+    The mask matches the prepared model input (see prepare_image), which is
+    the size images.edit expects it at.
+    """
+    prepared = prepare_image(read_image_bytes(image))
 
-    pixels = mask_img.load()
-    for y in range(mask_img.height):
-        for x in range(mask_img.width):
-            r, g, b, a = pixels[x, y]
-            if r > 200 and g > 200 and b > 200:
-                pixels[x, y] = (255, 255, 255, 255)  # editable
-            else:
-                pixels[x, y] = (0, 0, 0, 0)          # transparent lock
+    prompt = build_mask_prompt(products_json)
+    raw_mask_bytes = request_image_edit(prepared.model_bytes, prompt)
 
-    mask_img.save(mask_path, format="PNG")
-    print(f"🩶 Mask image saved to {mask_path} (RGBA)")
+    return finish_mask(raw_mask_bytes, prepared.model_size)
 
+def generate_and_save_mask(image: ImageInput, products_json: Dict[str, Any], mask_path: Optional[str] = None) -> bytes:
+    """generate_mask, optionally also writing the PNG to ``mask_path`` (CLI use)."""
+    mask_png = generate_mask(image, products_json)
+    if mask_path:
+        with open(mask_path, "wb") as f:
+            f.write(mask_png)
+        print(f"🩶 Mask image saved to {mask_path} (RGBA)")
+    return mask_png
 
 # =============================================================================
 # MAIN APPLICATION
@@ -597,10 +899,10 @@ def main():
     try:
         print("🩶 Generating automatic mask...")
         mask_path = "mask.png"
-        generate_and_save_mask(image_path, products_json, mask_path)
+        mask_png = generate_and_save_mask(image_path, products_json, mask_path)
 
         print("🎨 Editing image with OpenAI...")
-        edited_bytes = edit_image(image_path, products_json)
+        edited_bytes = edit_image(image_path, products_json, mask_png)
 
         output_path = "edited_sample.jpg"
         save_edited_image(edited_bytes, output_path)
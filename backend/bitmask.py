@@ -0,0 +1,224 @@
+"""
+Compact binary masks: one bit per pixel instead of an RGBA PNG.
+
+Region masks are plain editable / not-editable bitmaps, but used to travel
+through the pipeline as RGBA PNGs: 4 bytes per pixel once decoded and a
+PNG decode or encode at every hop (provider, cache, union, composite).
+BitMask keeps the rows packed 8 pixels to a byte in a NumPy array, the
+same layout as Pillow's mode "1", so it moves to and from Pillow without
+per-pixel work:
+
+- union (|), intersection (&) and difference (-) are bytewise on the
+  packed rows; dilate / erode shift whole packed rows
+- for the caches a mask is serialized as run lengths (a few KB for a
+  region mask) and read back with one np.repeat; PNG bytes cached before
+  BitMask existed are still read
+- it becomes the RGBA PNG images.edit expects only when it is sent
+  (to_png), and an alpha band only inside the composite (to_alpha)
+"""
+
+import struct
+from io import BytesIO
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+# Serialized form: magic, width, height, then little-endian uint32 run
+# lengths of alternating unset / set pixels in row-major order, starting
+# with an (possibly empty) unset run
+_MAGIC = b"BMR1"
+_HEADER = struct.Struct("<4sII")
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# Set bits per byte value
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+class BitMask:
+    __slots__ = ("bits", "size")
+
+    def __init__(self, bits: np.ndarray, size: Tuple[int, int]):
+        # (height, ceil(width / 8)) uint8, most significant bit first; the
+        # padding bits past ``width`` are always zero
+        self.bits = bits
+        self.size = size
+
+    # -------------------------------------------------------------------------
+    # Construction and conversion
+    # -------------------------------------------------------------------------
+
+    @classmethod
+    def empty(cls, size: Tuple[int, int]) -> "BitMask":
+        return cls(np.zeros((size[1], (size[0] + 7) // 8), dtype=np.uint8), size)
+
+    @classmethod
+    def from_array(cls, mask: np.ndarray) -> "BitMask":
+        """From a (height, width) boolean array."""
+        height, width = mask.shape
+        return cls(np.packbits(mask, axis=1), (width, height))
+
+    @classmethod
+    def from_image(cls, img: Image.Image) -> "BitMask":
+        """From a single-band image: set where the pixel is non-zero."""
+        if img.mode != "1":
+            img = img.point(lambda v: 255 if v else 0, mode="1")
+        width, height = img.size
+        bits = np.frombuffer(img.tobytes(), dtype=np.uint8).reshape(height, (width + 7) // 8)
+        return cls(bits.copy(), img.size)
+
+    @classmethod
+    def from_png(cls, png: bytes) -> "BitMask":
+        """From a mask PNG: its alpha channel when it has one (RGBA masks), else its luminance."""
+        img = Image.open(BytesIO(png))
+        if "A" in img.getbands():
+            return cls.from_image(img.getchannel("A"))
+        return cls.from_image(img.convert("L").point(lambda v: 255 if v >= 128 else 0))
+
+    @classmethod
+    def load(cls, data: bytes) -> "BitMask":
+        """Read to_bytes output, or a mask PNG (from caches written before BitMask)."""
+        if data.startswith(_PNG_SIGNATURE):
+            return cls.from_png(data)
+        magic, width, height = _HEADER.unpack_from(data)
+        if magic != _MAGIC:
+            raise ValueError("not a serialized BitMask")
+        runs = np.frombuffer(data, dtype="<u4", offset=_HEADER.size)
+        values = np.arange(runs.size, dtype=np.uint8) & 1
+        flat = np.repeat(values, runs)
+        if flat.size != width * height:
+            raise ValueError(f"BitMask runs cover {flat.size} pixels, expected {width}x{height}")
+        return cls.from_array(flat.reshape(height, width).astype(bool))
+
+    def to_bytes(self) -> bytes:
+        """Run-length serialization, for the caches."""
+        flat = self.to_array().ravel()
+        changes = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+        bounds = np.concatenate(([0], changes, [flat.size]))
+        runs = np.diff(bounds)
+        if flat.size and flat[0]:
+            runs = np.concatenate(([0], runs))
+        return _HEADER.pack(_MAGIC, *self.size) + runs.astype("<u4").tobytes()
+
+    def to_array(self) -> np.ndarray:
+        """(height, width) boolean array."""
+        return np.unpackbits(self.bits, axis=1, count=self.size[0]).astype(bool)
+
+    def to_image(self) -> Image.Image:
+        """Mode "1" image (no per-pixel conversion)."""
+        return Image.frombytes("1", self.size, self.bits.tobytes())
+
+    def to_alpha(self) -> Image.Image:
+        """Mode "L" band, 255 where set."""
+        return self.to_image().convert("L")
+
+    def to_png(self) -> bytes:
+        """The RGBA PNG images.edit takes: opaque white where set, transparent elsewhere."""
+        band = self.to_alpha()
+        buffer = BytesIO()
+        Image.merge("RGBA", (band, band, band, band)).save(buffer, format="PNG")
+        return buffer.getvalue()
+
+    # -------------------------------------------------------------------------
+    # Queries
+    # -------------------------------------------------------------------------
+
+    @property
+    def nbytes(self) -> int:
+        return self.bits.nbytes
+
+    def any(self) -> bool:
+        return bool(self.bits.any())
+
+    def count(self) -> int:
+        """Number of set pixels."""
+        return int(_POPCOUNT[self.bits].sum(dtype=np.int64))
+
+    def bbox(self, margin: int = 0) -> Optional[Tuple[int, int, int, int]]:
+        """Bounding box (x0, y0, x1, y1) of the set pixels, grown by ``margin``; None when empty."""
+        box = self.to_image().getbbox()
+        if box is None:
+            return None
+        width, height = self.size
+        return (
+            max(0, box[0] - margin),
+            max(0, box[1] - margin),
+            min(width, box[2] + margin),
+            min(height, box[3] + margin),
+        )
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, BitMask) and self.size == other.size and np.array_equal(self.bits, other.bits)
+
+    def __repr__(self) -> str:
+        return f"BitMask({self.size[0]}x{self.size[1]}, {self.count()} set)"
+
+    # -------------------------------------------------------------------------
+    # Set operations and morphology
+    # -------------------------------------------------------------------------
+
+    def _check(self, other: "BitMask") -> None:
+        if other.size != self.size:
+            raise ValueError(f"mask sizes differ: {self.size} and {other.size}")
+
+    def __or__(self, other: "BitMask") -> "BitMask":
+        self._check(other)
+        return BitMask(self.bits | other.bits, self.size)
+
+    def __and__(self, other: "BitMask") -> "BitMask":
+        self._check(other)
+        return BitMask(self.bits & other.bits, self.size)
+
+    def __sub__(self, other: "BitMask") -> "BitMask":
+        self._check(other)
+        return BitMask(self.bits & ~other.bits, self.size)
+
+    def __invert__(self) -> "BitMask":
+        return BitMask(~self.bits & self._row_mask(), self.size)
+
+    @classmethod
+    def union(cls, masks: Iterable["BitMask"]) -> "BitMask":
+        masks = list(masks)
+        if not masks:
+            raise ValueError("union of no masks")
+        bits = masks[0].bits.copy()
+        for mask in masks[1:]:
+            masks[0]._check(mask)
+            bits |= mask.bits
+        return cls(bits, masks[0].size)
+
+    def resize(self, size: Tuple[int, int]) -> "BitMask":
+        """Nearest-neighbour resize."""
+        if size == self.size:
+            return self
+        return BitMask.from_image(self.to_image().resize(size, Image.NEAREST))
+
+    def _row_mask(self) -> np.ndarray:
+        """Per-byte mask of the bits inside the image width (clears the row padding)."""
+        row = np.full(self.bits.shape[1], 0xFF, dtype=np.uint8)
+        spare = self.bits.shape[1] * 8 - self.size[0]
+        if spare:
+            row[-1] = (0xFF << spare) & 0xFF
+        return row
+
+    def dilate(self, radius: int = 1) -> "BitMask":
+        """Grow the set pixels by ``radius`` in every direction (a square structuring element)."""
+        bits = self.bits.copy()
+        for _ in range(radius):
+            # Horizontal: shift the packed rows one pixel each way, carrying
+            # bits across byte boundaries
+            right = bits >> 1
+            right[:, 1:] |= bits[:, :-1] << 7
+            left = bits << 1
+            left[:, :-1] |= bits[:, 1:] >> 7
+            bits = bits | right | left
+            # Vertical: whole rows
+            grown = bits.copy()
+            grown[1:] |= bits[:-1]
+            grown[:-1] |= bits[1:]
+            bits = grown
+        return BitMask(bits & self._row_mask(), self.size)
+
+    def erode(self, radius: int = 1) -> "BitMask":
+        """Shrink the set pixels by ``radius``; pixels outside the image count as set."""
+        return ~(~self).dilate(radius)
@@ -0,0 +1,369 @@
+"""
+Content-addressed caches for pipeline artifacts.
+
+A TieredCache stores encoded bytes (serialized BitMasks from
+BitMask.to_bytes, rendered images) under a string key in two tiers:
+
+- MemoryTier: an in-process LRU bounded by total bytes
+- DiskTier: an optional directory of files bounded by total bytes and a TTL
+- SqliteTier: instead of a directory, a table in the SQLite file shared by
+  the worker processes (backend.shared_state), same bounds
+
+Lookups check memory first, then disk (promoting disk hits into memory).
+Hit and miss counters are kept per tier for /health and metrics. Several
+processes may share one disk tier: every worker then reuses the masks and
+renders any of them produced.
+
+Each cache is configured through environment variables sharing a prefix
+(VISUALIZER_MASK_CACHE for masks, VISUALIZER_RESULT_CACHE for rendered
+results):
+    {prefix}_MB        memory budget in MB (masks 64, results 128; 0 disables)
+    {prefix}_DIR       directory for the disk tier (unset = the shared
+                       SQLite file when VISUALIZER_SHARED_DB is set, else
+                       memory only)
+    {prefix}_DISK_MB   disk budget in MB (masks 512, results 1024)
+    {prefix}_TTL       disk entry lifetime in seconds (default 7 days)
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+from backend.shared_state import SharedDB, get_shared_db
+
+MB = 1024 * 1024
+
+
+def image_digest(image_bytes: bytes) -> str:
+    """Stable content hash of encoded image bytes, used as the cache key base."""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def hinted_digest(digest: str, hints: Optional[Dict[str, Any]]) -> str:
+    """
+    Cache key base for image ``digest`` segmented with mask ``hints``.
+
+    Hints change the masks and so the render; without hints the plain
+    digest is returned, so unhinted requests share their cache entries.
+    """
+    if not hints:
+        return digest
+    encoded = json.dumps(hints, sort_keys=True, separators=(",", ":"))
+    return f"{digest}-{hashlib.sha256(encoded.encode()).hexdigest()[:16]}"
+
+
+def mask_cache_key(digest: str, regions: Iterable[str], provider: str = "openai") -> str:
+    """Key for ``provider``'s mask of image ``digest`` covering ``regions`` (order-insensitive)."""
+    return f"mask:{provider}:{digest}:{'+'.join(sorted(regions))}"
+
+
+def result_cache_key(digest: str, products_json: Dict[str, Any], encoding: str = "") -> str:
+    """
+    Key for the rendered edit of image ``digest`` with ``products_json``
+    applied, in output ``encoding`` (an OutputEncoding.cache_suffix; empty
+    for the default JPEG).
+    """
+    products = json.dumps(products_json, sort_keys=True, separators=(",", ":"))
+    key = f"result:{digest}:{hashlib.sha256(products.encode()).hexdigest()}"
+    return f"{key}:{encoding}" if encoding else key
+
+
+def etag_for_key(key: str) -> str:
+    """Strong HTTP entity tag for the artifact cached under ``key``."""
+    return '"' + hashlib.sha256(key.encode()).hexdigest()[:32] + '"'
+
+
+class MemoryTier:
+    """Thread-safe LRU of bytes values bounded by their total size."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: bytes) -> None:
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._entries[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class DiskTier:
+    """
+    Directory-backed store, one file per key.
+
+    Entries older than ``ttl`` seconds are treated as misses and removed.
+    When the directory grows past ``max_bytes`` the least recently used
+    files (by mtime, refreshed on every hit) are deleted.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, ttl: float):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.size = sum(size for _, size, _ in self._stat_entries())
+
+    def _path(self, key: str) -> str:
+        # Keys contain ':' and '+', hash them into safe, fixed-length names
+        return os.path.join(self.directory, hashlib.sha256(key.encode()).hexdigest())
+
+    def _scan(self):
+        with os.scandir(self.directory) as entries:
+            return [e for e in entries if e.is_file() and not e.name.endswith(".tmp")]
+
+    def _stat_entries(self) -> List[Tuple[float, int, str]]:
+        """(mtime, size, path) of every entry, oldest first."""
+        entries = []
+        for entry in self._scan():
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                # Evicted or replaced by another process since the scan
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        return entries
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            stat = os.stat(path)
+            if time.time() - stat.st_mtime > self.ttl:
+                self._remove(path, stat.st_size)
+                return None
+            with open(path, "rb") as f:
+                value = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted by another process just after the read; the value is still good
+            pass
+        return value
+
+    def put(self, key: str, value: bytes) -> None:
+        if len(value) > self.max_bytes:
+            return
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(value)
+        with self._lock:
+            try:
+                self.size -= os.stat(path).st_size
+            except FileNotFoundError:
+                pass
+            os.replace(tmp_path, path)
+            self.size += len(value)
+        if self.size > self.max_bytes:
+            self._evict()
+
+    def _remove(self, path: str, size: int) -> None:
+        with self._lock:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # Another process removed it first: its bytes are gone all the same
+                pass
+            self.size -= size
+
+    def _evict(self) -> None:
+        now = time.time()
+        entries = self._stat_entries()
+        # Other processes may write to the same directory: recount rather
+        # than trust this process's running total
+        with self._lock:
+            self.size = sum(size for _, size, _ in entries)
+        for mtime, size, path in entries:
+            if self.size <= self.max_bytes and now - mtime <= self.ttl:
+                break
+            self._remove(path, size)
+
+
+class SqliteTier:
+    """
+    Table in the shared SQLite database, one row per key.
+
+    Same policy as DiskTier: entries unused for ``ttl`` seconds are misses
+    and removed, and past ``max_bytes`` the least recently used rows are
+    deleted. The last use is refreshed at most every TOUCH_SECONDS, so most
+    hits are plain reads that never wait on another worker's write.
+    """
+
+    TOUCH_SECONDS = 60.0
+
+    def __init__(self, db: SharedDB, table: str, max_bytes: int, ttl: float):
+        self.db = db
+        self.table = table
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # size and used come before value so that scanning them does not
+        # read the value's overflow pages
+        db.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} "
+            "(key TEXT PRIMARY KEY, size INTEGER NOT NULL, used REAL NOT NULL, value BLOB NOT NULL)"
+        )
+        db.execute(f"CREATE INDEX IF NOT EXISTS {table}_used ON {table} (used)")
+
+    @property
+    def size(self) -> int:
+        return self.db.execute(f"SELECT COALESCE(SUM(size), 0) FROM {self.table}").fetchone()[0]
+
+    def get(self, key: str) -> Optional[bytes]:
+        row = self.db.execute(f"SELECT used, value FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        used, value = row
+        now = time.time()
+        if now - used > self.ttl:
+            self.db.execute(f"DELETE FROM {self.table} WHERE key = ? AND used = ?", (key, used))
+            return None
+        if now - used > self.TOUCH_SECONDS:
+            self.db.execute(f"UPDATE {self.table} SET used = ? WHERE key = ?", (now, key))
+        return value
+
+    def put(self, key: str, value: bytes) -> None:
+        if len(value) > self.max_bytes:
+            return
+        now = time.time()
+        with self.db.transaction() as db:
+            db.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, size, used, value) VALUES (?, ?, ?, ?)",
+                (key, len(value), now, value),
+            )
+            db.execute(f"DELETE FROM {self.table} WHERE used < ?", (now - self.ttl,))
+            excess = db.execute(f"SELECT COALESCE(SUM(size), 0) FROM {self.table}").fetchone()[0] - self.max_bytes
+            if excess <= 0:
+                return
+            evicted = []
+            for old_key, size in db.execute(f"SELECT key, size FROM {self.table} ORDER BY used"):
+                if excess <= 0:
+                    break
+                evicted.append((old_key,))
+                excess -= size
+            db.executemany(f"DELETE FROM {self.table} WHERE key = ?", evicted)
+
+
+class TieredCache:
+    def __init__(self, name: str, memory: Optional[MemoryTier], disk: Optional[Union[DiskTier, SqliteTier]] = None):
+        self.name = name
+        self.memory = memory
+        self.disk = disk
+        # get() runs on the I/O pool: counters are updated under the lock
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        if self.memory is not None:
+            value = self.memory.get(key)
+            if value is not None:
+                with self._lock:
+                    self.memory_hits += 1
+                return value
+        if self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                if self.memory is not None:
+                    self.memory.put(key, value)
+                return value
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, value: bytes) -> None:
+        if self.memory is not None:
+            self.memory.put(key, value)
+        if self.disk is not None:
+            self.disk.put(key, value)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            memory_hits, disk_hits, misses = self.memory_hits, self.disk_hits, self.misses
+        lookups = memory_hits + disk_hits + misses
+        stats = {
+            "memory_hits": memory_hits,
+            "disk_hits": disk_hits,
+            "misses": misses,
+            "hit_rate": round((lookups - misses) / lookups, 4) if lookups else 0.0,
+        }
+        if self.memory is not None:
+            stats["memory_entries"] = len(self.memory)
+            stats["memory_bytes"] = self.memory.size
+        if self.disk is not None:
+            stats["disk_bytes"] = self.disk.size
+        return stats
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+def cache_from_env(name: str, prefix: str, memory_mb: float, disk_mb: float, ttl: float) -> TieredCache:
+    """Build a TieredCache from ``{prefix}_MB``, ``_DIR``, ``_DISK_MB`` and ``_TTL`` variables."""
+    memory_bytes = int(_env_float(f"{prefix}_MB", memory_mb) * MB)
+    memory = MemoryTier(memory_bytes) if memory_bytes > 0 else None
+
+    disk = None
+    directory = os.getenv(f"{prefix}_DIR")
+    shared_db = get_shared_db()
+    max_bytes = int(_env_float(f"{prefix}_DISK_MB", disk_mb) * MB)
+    ttl = _env_float(f"{prefix}_TTL", ttl)
+    if directory:
+        disk = DiskTier(directory, max_bytes=max_bytes, ttl=ttl)
+    elif shared_db is not None:
+        disk = SqliteTier(shared_db, f"cache_{name}", max_bytes=max_bytes, ttl=ttl)
+    return TieredCache(name, memory, disk)
+
+
+# Process-wide mask cache (lazy loading)
+_mask_cache = None
+
+def get_mask_cache() -> TieredCache:
+    global _mask_cache
+    if _mask_cache is None:
+        _mask_cache = cache_from_env(
+            "masks", "VISUALIZER_MASK_CACHE", memory_mb=64, disk_mb=512, ttl=7 * 24 * 3600
+        )
+    return _mask_cache
+
+
+# Process-wide rendered result cache (lazy loading)
+_result_cache = None
+
+def get_result_cache() -> TieredCache:
+    global _result_cache
+    if _result_cache is None:
+        _result_cache = cache_from_env(
+            "results", "VISUALIZER_RESULT_CACHE", memory_mb=128, disk_mb=1024, ttl=7 * 24 * 3600
+        )
+    return _result_cache
@@ -0,0 +1,162 @@
+"""
+Indexed, pre-validated view of PRODUCT_CATALOG for the request path.
+
+Built once at import:
+
+- every product is checked (known category, required prompt attributes,
+  a colour the local recolour engine knows, no two editable products
+  sharing a name within a UI category); a broken
+  catalog raises CatalogError at startup instead of failing requests
+- editable products are indexed by id and by (UI category, name), so a
+  frontend selection such as {"roof": {"product_name": "Classic Panel"}}
+  resolves with one lookup; the same name in another category (siding's
+  "Classic Panel") is simply a different key
+- each product's products-JSON entry and edit-prompt TASK sentence are
+  rendered once
+
+Turning a selection into a prompt is then lookups and a join.
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from backend.architectural_visualizer import (
+    _CATEGORY_UI_MAP,
+    _resolve_product,
+    build_backend_products_json,
+    compose_edit_prompt,
+    EDIT_TASK_TEMPLATES,
+    PRODUCT_CATALOG,
+    product_task,
+    ResolvedProduct,
+    validate_selection,
+)
+from backend.logs import get_logger
+from backend.recolor import colour_for, UnknownColour
+
+logger = get_logger("catalog")
+
+PROMPT_ATTRIBUTES = ("color", "texture", "finish", "look")
+
+
+class CatalogError(ValueError):
+    """Raised at load time when PRODUCT_CATALOG is inconsistent."""
+
+
+def catalog_problems(products: Dict[int, Dict[str, Any]]) -> List[str]:
+    """Every inconsistency in ``products``; empty when the catalog is usable."""
+    problems = []
+    names: Dict[Tuple[str, str], int] = {}
+    for pid, p in products.items():
+        if not isinstance(pid, int):
+            problems.append(f"product id {pid!r} is not an integer")
+        if not p.get("name"):
+            problems.append(f"product {pid} has no name")
+            continue
+        ui_category = _CATEGORY_UI_MAP.get(p.get("category", ""))
+        if ui_category is None:
+            problems.append(f"product {pid} ({p['name']}) has unknown category {p.get('category')!r}")
+            continue
+        if not p.get("editable", False):
+            continue
+        missing = [a for a in PROMPT_ATTRIBUTES if not p.get("prompt", {}).get(a)]
+        if missing:
+            problems.append(f"product {pid} ({p['name']}) is missing prompt attributes: {', '.join(missing)}")
+        elif ui_category != "hardware":
+            try:
+                colour_for(p["prompt"]["color"])
+            except UnknownColour as e:
+                problems.append(f"product {pid} ({p['name']}) has a colour the local renderer cannot paint: {e}")
+        key = (ui_category, _name_key(p["name"]))
+        if key in names:
+            problems.append(f"products {names[key]} and {pid} are both named {p['name']!r} in '{ui_category}'")
+        names[key] = pid
+    return problems
+
+
+def _name_key(name: str) -> str:
+    return " ".join(name.split()).casefold()
+
+
+class Catalog:
+    def __init__(self, products: Dict[int, Dict[str, Any]]):
+        problems = catalog_problems(products)
+        if problems:
+            raise CatalogError("Invalid product catalog:\n- " + "\n- ".join(problems))
+
+        self.products: Dict[int, ResolvedProduct] = {}
+        self.by_name: Dict[Tuple[str, str], int] = {}
+        self.by_plain_name: Dict[str, int] = {}
+        self.entries: Dict[int, Dict[str, Any]] = {}
+        self.tasks: Dict[int, str] = {}
+        for pid in products:
+            rp = _resolve_product(pid)
+            if rp is None:
+                continue
+            self.products[pid] = rp
+            self.by_name[(rp.ui_category, _name_key(rp.name))] = pid
+            self.by_plain_name.setdefault(_name_key(rp.name), pid)
+            # Shared by every request that selects the product: read-only
+            self.entries[pid] = build_backend_products_json({rp.ui_category: rp})[rp.ui_category]
+            if rp.ui_category in EDIT_TASK_TEMPLATES:
+                self.tasks[pid] = product_task(rp.ui_category, self.entries[pid]["attributes"])
+
+    def product_id(self, ui_category: str, name: str) -> Optional[int]:
+        """
+        Id of the product called ``name`` in ``ui_category``; failing that, of
+        a product with that name in any category, so validation can report
+        the category mismatch instead of the product silently vanishing.
+        """
+        key = _name_key(name)
+        pid = self.by_name.get((ui_category, key))
+        return pid if pid is not None else self.by_plain_name.get(key)
+
+    def resolve_frontend_selection(self, user_selections: Dict[str, Any]) -> Dict[str, int]:
+        """
+        Frontend selections -> backend format (category -> ID).
+
+            {"roof": {"product_name": "Legacy Panel", ...}, "trim": {...}}
+            -> {"roof": 6, "trim": 1}
+
+        Entries without a product_name are skipped; unknown names are
+        skipped with a warning (the selection is validated afterwards).
+        """
+        backend_selection = {}
+        for category, item_data in user_selections.items():
+            if not isinstance(item_data, dict) or "product_name" not in item_data:
+                continue
+            p_name = str(item_data["product_name"])
+            p_id = self.product_id(category, p_name)
+            if p_id is not None:
+                backend_selection[category] = p_id
+            else:
+                logger.warning("unmapped frontend product", extra={"product_name": p_name, "category": category})
+        return backend_selection
+
+    def products_json(self, selection: Dict[str, int]) -> Tuple[bool, str, Dict[str, Any]]:
+        """validate_selection + build_backend_products_json from the prebuilt entries."""
+        ok, msg, resolved = validate_selection(selection, resolve=self.products.get)
+        if not ok:
+            return ok, msg, {}
+        payload = {"roof": None, "siding": None, "trim": None, "hardware": None}
+        for ui_category, rp in resolved.items():
+            payload[ui_category] = self.entries[rp.id]
+        return ok, msg, payload
+
+    def edit_prompt(self, products_json: Dict[str, Any]) -> str:
+        """build_edit_prompt from the prerendered TASK sentences."""
+        task_parts = []
+        for ui_category in EDIT_TASK_TEMPLATES:
+            entry = products_json.get(ui_category)
+            if not entry:
+                continue
+            pid = entry.get("product_id")
+            if entry is self.entries.get(pid):
+                task_parts.append(self.tasks[pid])
+            else:
+                # Not one of our entries (hand-built products JSON): render it
+                task_parts.append(product_task(ui_category, entry["attributes"]))
+        return compose_edit_prompt(task_parts)
+
+
+# Built (and validated) once, at import
+CATALOG = Catalog(PRODUCT_CATALOG)
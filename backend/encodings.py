@@ -0,0 +1,109 @@
+"""
+Output encodings of rendered edits and their negotiation.
+
+A render can be delivered as baseline JPEG (the historical output),
+progressive JPEG or WebP, at one of three quality tiers. The client picks
+with query parameters, ?format=webp&quality=standard; without them the
+format follows the Accept header (image/webp when listed) and the tier
+follows Save-Data ("on" selects "low"). Neither present keeps the old
+response: baseline JPEG at quality 95.
+
+Each encoding has its own result-cache key and ETag, so a variant is
+encoded once and then served from the cache. AVIF is not offered: the
+Pillow we ship cannot encode it. etag_matches answers conditional
+requests for renders and static files alike.
+"""
+
+from typing import Dict, NamedTuple, Optional
+
+FORMATS = ("jpeg", "pjpeg", "webp")
+QUALITY_TIERS = ("high", "standard", "low")
+
+# Encoder quality per format and tier; WebP reaches the same look lower
+_QUALITY: Dict[str, Dict[str, int]] = {
+    "jpeg": {"high": 95, "standard": 85, "low": 70},
+    "pjpeg": {"high": 95, "standard": 85, "low": 70},
+    "webp": {"high": 90, "standard": 80, "low": 65},
+}
+
+_MEDIA_TYPES = {"jpeg": "image/jpeg", "pjpeg": "image/jpeg", "webp": "image/webp"}
+
+
+class OutputEncoding(NamedTuple):
+    format: str      # one of FORMATS
+    quality: str     # one of QUALITY_TIERS
+
+    @property
+    def media_type(self) -> str:
+        return _MEDIA_TYPES[self.format]
+
+    @property
+    def pil_args(self) -> tuple:
+        """(PIL format, quality, progressive) for encode_image."""
+        quality = _QUALITY[self.format][self.quality]
+        if self.format == "webp":
+            return ("WEBP", quality, False)
+        return ("JPEG", quality, self.format == "pjpeg")
+
+    @property
+    def cache_suffix(self) -> str:
+        """Appended to result cache keys; empty for the default so old keys and ETags stay valid."""
+        return "" if self == DEFAULT_ENCODING else f"{self.format}-{self.quality}"
+
+
+DEFAULT_ENCODING = OutputEncoding("jpeg", "high")
+
+
+class EncodingRejected(ValueError):
+    """An explicitly requested format or quality tier that is not offered."""
+
+
+def _accepts_webp(accept: str) -> bool:
+    for item in accept.split(","):
+        media_type, _, params = item.strip().partition(";")
+        if media_type.strip().lower() != "image/webp":
+            continue
+        q = params.replace(" ", "").lower().partition("q=")[2]
+        try:
+            return not q or float(q) > 0
+        except ValueError:
+            return True
+    return False
+
+
+def negotiate_encoding(
+    format: Optional[str] = None,
+    quality: Optional[str] = None,
+    accept: Optional[str] = None,
+    save_data: Optional[str] = None,
+) -> OutputEncoding:
+    """Output encoding from the query parameters, falling back to the Accept and Save-Data headers."""
+    if format:
+        format = format.lower()
+        if format not in FORMATS:
+            raise EncodingRejected(f"format must be one of {', '.join(FORMATS)}")
+    else:
+        format = "webp" if accept and _accepts_webp(accept) else DEFAULT_ENCODING.format
+
+    if quality:
+        quality = quality.lower()
+        if quality not in QUALITY_TIERS:
+            raise EncodingRejected(f"quality must be one of {', '.join(QUALITY_TIERS)}")
+    else:
+        quality = "low" if (save_data or "").strip().lower() == "on" else DEFAULT_ENCODING.quality
+
+    return OutputEncoding(format, quality)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match comparison (weak, as RFC 9110 specifies for it)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if (tag[2:] if tag.startswith("W/") else tag) == opaque:
+            return True
+    return False
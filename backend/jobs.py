@@ -0,0 +1,555 @@
+"""
+Job scheduler for edits that outlive a single HTTP request.
+
+POST /jobs queues an edit and returns at once with a job id. A fixed set
+of worker tasks takes jobs from a bounded priority queue; every stage the
+pipeline reaches is appended to the job's event list, which clients
+follow over Server-Sent Events (GET /jobs/{id}/events) before fetching
+the finished image (GET /jobs/{id}/result). As soon as the model's edit
+arrives, a low-resolution preview is published ("preview" event, GET
+/jobs/{id}/preview) while the full-resolution composite is made. Queued
+or running jobs can be cancelled (DELETE /jobs/{id}).
+
+Finished jobs are kept for VISUALIZER_JOB_TTL seconds so the result can
+be fetched, then dropped.
+
+Jobs run in the process they were submitted to. With several worker
+processes and VISUALIZER_SHARED_DB set, every job is also mirrored into
+the shared SQLite file (SharedJobStore): the status, events, preview and
+result are written there, in order, by a background writer, so any
+worker can answer for a job another one runs (RemoteJob): status and
+result reads, SSE by polling for new events, and cancellation as a flag
+the running worker picks up.
+
+On shutdown the scheduler stops taking jobs and waits up to
+VISUALIZER_DRAIN_SECONDS for the queued and running ones to finish
+before cancelling the rest.
+
+Configuration (environment variables):
+    VISUALIZER_JOB_WORKERS     jobs running at once (default 4)
+    VISUALIZER_JOB_QUEUE       jobs allowed to wait (default 64)
+    VISUALIZER_JOB_TTL         seconds a finished job is kept (default 900)
+    VISUALIZER_DRAIN_SECONDS   seconds shutdown waits for unfinished jobs (default 30)
+"""
+
+import asyncio
+import itertools
+import json
+import os
+import socket
+import time
+import uuid
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from backend.logs import get_logger
+from backend.shared_state import SharedDB, get_shared_db
+
+logger = get_logger("jobs")
+
+# Lower runs first
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+
+TERMINAL_STATUSES = ("done", "failed", "cancelled")
+
+
+class JobQueueFull(Exception):
+    """Raised when a job is submitted while the wait queue is full (or the scheduler is draining)."""
+
+
+class JobFailed(Exception):
+    """The failure of a job run by another worker process, as it was recorded."""
+
+    def __init__(self, detail: str, status_code: Optional[int]):
+        super().__init__(detail)
+        self.status_code = status_code or 500
+
+
+class Job:
+    def __init__(self, priority: str):
+        self.id = uuid.uuid4().hex
+        self.priority = priority
+        self.status = "queued"
+        self.stage: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.events: List[Dict[str, Any]] = []
+        self.result: Optional[bytes] = None
+        self.preview: Optional[bytes] = None
+        self.media_type = "image/jpeg"
+        self.headers: Dict[str, str] = {}
+        self.error: Optional[BaseException] = None
+        # HTTP status the error maps to (set by the runner), for other workers to report
+        self.error_status: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self._store: Optional["SharedJobStore"] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in TERMINAL_STATUSES
+
+    def progress(self, stage: str) -> None:
+        """Record that the job reached ``stage`` (called from the pipeline)."""
+        self.stage = stage
+        self._publish({"type": "progress", "stage": stage})
+
+    def set_preview(self, image: bytes) -> None:
+        """Keep the low-resolution JPEG preview and tell followers it is ready."""
+        self.preview = image
+        self._publish({"type": "preview"})
+
+    def _set_status(self, status: str, **extra: Any) -> None:
+        self.status = status
+        if self.finished:
+            self.finished_at = time.time()
+        self._publish({"type": "status", "status": status, **extra})
+
+    def _publish(self, event: Dict[str, Any]) -> None:
+        event = {"job_id": self.id, "seq": len(self.events), "at": round(time.time(), 3), **event}
+        self.events.append(event)
+        if self._store is not None:
+            self._store.record(self, event)
+        # Wake every follower, then start a fresh event for the next change
+        self._wakeup.set()
+        self._wakeup = asyncio.Event()
+
+    async def follow(self, keepalive: float = 15.0) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """
+        Yield every event from the first one until the job finishes.
+
+        Yields None when nothing happened for ``keepalive`` seconds, so SSE
+        streams can send a comment to keep proxies from closing them.
+        """
+        index = 0
+        while True:
+            while index < len(self.events):
+                yield self.events[index]
+                index += 1
+            if self.finished:
+                return
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=keepalive)
+            except asyncio.TimeoutError:
+                yield None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "stage": self.stage,
+            "priority": self.priority,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "error": str(self.error) if self.error else None,
+        }
+
+
+class RemoteJob:
+    """
+    A job running in another worker process, read from the SharedJobStore.
+
+    Has the attributes and methods of Job that the endpoints use; the
+    preview and result are only read when asked for.
+    """
+
+    def __init__(self, store: "SharedJobStore", row: Tuple):
+        self._store = store
+        (self.id, self.priority, self.status, self.stage, self.created_at, self.finished_at,
+         error, self.error_status, self.media_type, headers) = row
+        self.headers: Dict[str, str] = json.loads(headers)
+        self.error = JobFailed(error, self.error_status) if error else None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in TERMINAL_STATUSES
+
+    @property
+    def preview(self) -> Optional[bytes]:
+        return self._store.blob(self.id, "preview")
+
+    @property
+    def result(self) -> Optional[bytes]:
+        return self._store.blob(self.id, "result")
+
+    async def follow(self, keepalive: float = 15.0) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """As Job.follow, polling the store every SharedJobStore.POLL_SECONDS."""
+        after = -1
+        quiet_since = time.monotonic()
+        while True:
+            status, events = await asyncio.to_thread(self._store.events_after, self.id, after)
+            for event in events:
+                yield event
+                after = event["seq"]
+            if status is None or status in TERMINAL_STATUSES:
+                return
+            if events:
+                quiet_since = time.monotonic()
+            elif time.monotonic() - quiet_since >= keepalive:
+                quiet_since = time.monotonic()
+                yield None
+            await asyncio.sleep(self._store.POLL_SECONDS)
+
+    to_dict = Job.to_dict
+
+
+class SharedJobStore:
+    """
+    Jobs mirrored into the shared SQLite file.
+
+    record() only queues the job's state and the event; a writer task
+    commits the queue in batches off the event loop, in order, so a reader
+    that sees a job finished also sees every event and the result.
+    """
+
+    POLL_SECONDS = 0.25
+    # Unfinished rows this old belong to a worker that died
+    ORPHAN_SECONDS = 3600.0
+
+    _COLUMNS = ("id, priority, status, stage, created_at, finished_at, "
+                "error, error_status, media_type, headers")
+
+    def __init__(self, db: SharedDB, ttl: float):
+        self.db = db
+        self.ttl = ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, owner TEXT NOT NULL, "
+            "priority TEXT NOT NULL, status TEXT NOT NULL, stage TEXT, created_at REAL NOT NULL, "
+            "finished_at REAL, error TEXT, error_status INTEGER, media_type TEXT NOT NULL, "
+            "headers TEXT NOT NULL, cancel_requested INTEGER NOT NULL DEFAULT 0, preview BLOB, result BLOB)"
+        )
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS job_events (job_id TEXT NOT NULL, seq INTEGER NOT NULL, "
+            "event TEXT NOT NULL, PRIMARY KEY (job_id, seq))"
+        )
+        self._pending: List[Tuple] = []
+        self._flushed: List[asyncio.Future] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._writer: Optional[asyncio.Task] = None
+        self._purged_at = 0.0
+
+    # -------------------------------------------------------------------------
+    # Owner side: write
+    # -------------------------------------------------------------------------
+
+    def _start(self) -> None:
+        if self._writer is None:
+            self._wakeup = asyncio.Event()
+            self._writer = asyncio.get_running_loop().create_task(self._write_loop())
+
+    def record(self, job: Job, event: Dict[str, Any]) -> None:
+        self._start()
+        row = (job.id, self.owner, job.priority, job.status, job.stage, job.created_at, job.finished_at,
+               str(job.error) if job.error else None, job.error_status, job.media_type, json.dumps(job.headers))
+        preview = job.preview if event["type"] == "preview" else None
+        result = job.result if job.status == "done" else None
+        self._pending.append((row, preview, result, job.id, event["seq"], json.dumps(event)))
+        self._wakeup.set()
+
+    async def flush(self) -> None:
+        """Wait until everything recorded so far is committed."""
+        if self._writer is None:
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._flushed.append(waiter)
+        self._wakeup.set()
+        await waiter
+
+    async def _write_loop(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            pending, self._pending = self._pending, []
+            flushed, self._flushed = self._flushed, []
+            try:
+                if pending:
+                    await asyncio.to_thread(self._write, pending)
+            except Exception:
+                logger.exception("job store write failed", extra={"records": len(pending)})
+            for waiter in flushed:
+                if not waiter.done():
+                    waiter.set_result(None)
+
+    def _write(self, pending: List[Tuple]) -> None:
+        now = time.time()
+        with self.db.transaction() as db:
+            for row, preview, result, job_id, seq, event in pending:
+                db.execute(
+                    f"INSERT INTO jobs (owner, {self._COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (id) DO UPDATE SET status = excluded.status, stage = excluded.stage, "
+                    "finished_at = excluded.finished_at, error = excluded.error, "
+                    "error_status = excluded.error_status, media_type = excluded.media_type, "
+                    "headers = excluded.headers",
+                    (row[1], row[0], *row[2:]),
+                )
+                if preview is not None:
+                    db.execute("UPDATE jobs SET preview = ? WHERE id = ?", (preview, job_id))
+                if result is not None:
+                    db.execute("UPDATE jobs SET result = ? WHERE id = ?", (result, job_id))
+                db.execute("INSERT OR REPLACE INTO job_events (job_id, seq, event) VALUES (?, ?, ?)",
+                           (job_id, seq, event))
+            if now - self._purged_at >= 60:
+                self._purged_at = now
+                expired = db.execute(
+                    "SELECT id FROM jobs WHERE finished_at < ? OR (finished_at IS NULL AND created_at < ?)",
+                    (now - self.ttl, now - self.ORPHAN_SECONDS),
+                ).fetchall()
+                db.executemany("DELETE FROM job_events WHERE job_id = ?", expired)
+                db.executemany("DELETE FROM jobs WHERE id = ?", expired)
+
+    def cancel_requests(self, job_ids: List[str]) -> List[str]:
+        """Which of ``job_ids`` another worker was asked to cancel."""
+        placeholders = ",".join("?" * len(job_ids))
+        rows = self.db.execute(
+            f"SELECT id FROM jobs WHERE cancel_requested = 1 AND id IN ({placeholders})", tuple(job_ids)
+        ).fetchall()
+        return [job_id for job_id, in rows]
+
+    async def close(self) -> None:
+        await self.flush()
+        if self._writer is not None:
+            self._writer.cancel()
+            await asyncio.gather(self._writer, return_exceptions=True)
+            self._writer = None
+
+    # -------------------------------------------------------------------------
+    # Any worker: read
+    # -------------------------------------------------------------------------
+
+    def load(self, job_id: str) -> Optional[RemoteJob]:
+        row = self.db.execute(f"SELECT {self._COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return RemoteJob(self, row) if row is not None else None
+
+    def blob(self, job_id: str, column: str) -> Optional[bytes]:
+        row = self.db.execute(f"SELECT {column} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row[0] if row is not None else None
+
+    def events_after(self, job_id: str, seq: int) -> Tuple[Optional[str], List[Dict[str, Any]]]:
+        """(status, events after ``seq``); None when the job is gone."""
+        # Status first: a finished status is committed with the last
+        # events, so reading events afterwards cannot miss any
+        row = self.db.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        rows = self.db.execute(
+            "SELECT event FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq", (job_id, seq)
+        ).fetchall()
+        return (row[0] if row else None), [json.loads(event) for event, in rows]
+
+    def request_cancel(self, job_id: str) -> Optional[RemoteJob]:
+        self.db.execute(
+            f"UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status NOT IN {TERMINAL_STATUSES}", (job_id,)
+        )
+        return self.load(job_id)
+
+
+JobRunner = Callable[[Job], Awaitable[bytes]]
+
+
+class JobScheduler:
+    # How often the owner checks the shared store for cancel requests
+    CANCEL_POLL_SECONDS = 0.5
+
+    def __init__(self, workers: int = 4, max_queue: int = 64, ttl: float = 900.0,
+                 drain_seconds: float = 30.0, store: Optional[SharedJobStore] = None):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.ttl = ttl
+        self.drain_seconds = drain_seconds
+        self.store = store
+        self.draining = False
+        self._jobs: Dict[str, Job] = {}
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._runners: Dict[str, JobRunner] = {}
+        self._worker_tasks: List[asyncio.Task] = []
+        self._seq = itertools.count()
+        # Counters
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.rejected = 0
+
+    @classmethod
+    def from_env(cls) -> "JobScheduler":
+        ttl = float(os.getenv("VISUALIZER_JOB_TTL", "900"))
+        shared_db = get_shared_db()
+        return cls(
+            workers=int(os.getenv("VISUALIZER_JOB_WORKERS", "4")),
+            max_queue=int(os.getenv("VISUALIZER_JOB_QUEUE", "64")),
+            ttl=ttl,
+            drain_seconds=float(os.getenv("VISUALIZER_DRAIN_SECONDS", "30")),
+            store=SharedJobStore(shared_db, ttl) if shared_db is not None else None,
+        )
+
+    def _start(self) -> None:
+        if self._queue is None:
+            loop = asyncio.get_running_loop()
+            self._queue = asyncio.PriorityQueue(maxsize=self.max_queue)
+            self._worker_tasks = [loop.create_task(self._work()) for _ in range(self.workers)]
+            if self.store is not None:
+                self._worker_tasks.append(loop.create_task(self._watch_cancel_requests()))
+
+    def submit(self, runner: JobRunner, priority: str = "normal") -> Job:
+        """Queue ``runner(job)``; its return value becomes the job result."""
+        if priority not in PRIORITIES:
+            raise ValueError(f"priority must be one of {', '.join(PRIORITIES)}")
+        if self.draining:
+            self.rejected += 1
+            raise JobQueueFull("Server is shutting down; try again shortly")
+        self._start()
+        self._purge()
+
+        job = Job(priority)
+        job._store = self.store
+        try:
+            self._queue.put_nowait((PRIORITIES[priority], next(self._seq), job))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise JobQueueFull(f"{self._queue.qsize()} jobs already queued; try again shortly")
+
+        self._jobs[job.id] = job
+        self._runners[job.id] = runner
+        self.submitted += 1
+        job._set_status("queued", position=self._queue.qsize())
+        return job
+
+    async def published(self, job: Job) -> None:
+        """Wait until other worker processes can see ``job`` (at once without a shared store)."""
+        if self.store is not None:
+            await self.store.flush()
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """
+        The job, or when another worker process runs it, a RemoteJob
+        snapshot. Reads the shared store then: call it off the event loop.
+        """
+        job = self._jobs.get(job_id)
+        if job is None and self.store is not None:
+            return self.store.load(job_id)
+        return job
+
+    def request_cancel(self, job_id: str) -> Optional[RemoteJob]:
+        """
+        Ask the worker process running ``job_id`` to cancel it (it does when
+        it next polls). Writes to the shared store: call it off the event loop.
+        """
+        if self.store is None:
+            return None
+        return self.store.request_cancel(job_id)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """Cancel a job of this process (on the event loop); None for jobs it does not run."""
+        job = self._jobs.get(job_id)
+        if job is None or job.finished:
+            return job
+        if job._task is not None:
+            job._task.cancel()
+        else:
+            # Still queued: the worker skips it when it comes up
+            self._runners.pop(job.id, None)
+            self.cancelled += 1
+            job._set_status("cancelled")
+        return job
+
+    async def _work(self) -> None:
+        while True:
+            _, _, job = await self._queue.get()
+            try:
+                runner = self._runners.pop(job.id, None)
+                if runner is None or job.finished:
+                    continue
+                await self._run(job, runner)
+            finally:
+                self._queue.task_done()
+
+    async def _watch_cancel_requests(self) -> None:
+        while True:
+            await asyncio.sleep(self.CANCEL_POLL_SECONDS)
+            job_ids = [job.id for job in self._jobs.values() if not job.finished]
+            if not job_ids:
+                continue
+            try:
+                requested = await asyncio.to_thread(self.store.cancel_requests, job_ids)
+            except Exception:
+                logger.exception("reading cancel requests failed")
+                continue
+            for job_id in requested:
+                self.cancel(job_id)
+
+    async def _run(self, job: Job, runner: JobRunner) -> None:
+        job._set_status("running")
+        job._task = asyncio.get_running_loop().create_task(runner(job))
+        await asyncio.wait({job._task})
+
+        if job._task.cancelled():
+            self.cancelled += 1
+            job._set_status("cancelled")
+        elif job._task.exception() is not None:
+            self.failed += 1
+            job.error = job._task.exception()
+            job._set_status("failed", error=str(job.error))
+        else:
+            self.completed += 1
+            job.result = job._task.result()
+            job._set_status("done")
+        job._task = None
+
+    def _purge(self) -> None:
+        cutoff = time.time() - self.ttl
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished and job.finished_at < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def stats(self) -> Dict[str, Any]:
+        running = sum(1 for job in self._jobs.values() if job.status == "running")
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue": self.max_queue,
+            "running": running,
+            "workers": self.workers,
+            "retained": len(self._jobs),
+            "shared": self.store is not None,
+            "draining": self.draining,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "rejected": self.rejected,
+        }
+
+    async def shutdown(self) -> None:
+        """Refuse new jobs, give unfinished ones drain_seconds to finish, then cancel the rest."""
+        self.draining = True
+        if self._queue is not None:
+            unfinished = sum(1 for job in self._jobs.values() if not job.finished)
+            if unfinished:
+                logger.info("draining jobs", extra={"unfinished": unfinished, "seconds": self.drain_seconds})
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout=self.drain_seconds)
+            except asyncio.TimeoutError:
+                pass
+        for job in list(self._jobs.values()):
+            if not job.finished:
+                self.cancel(job.id)
+        if self._queue is not None:
+            # Let the cancelled jobs record their status
+            await self._queue.join()
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        self._queue = None
+        if self.store is not None:
+            await self.store.close()
+
+
+# Process-wide scheduler (lazy loading)
+_scheduler = None
+
+def get_job_scheduler() -> JobScheduler:
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = JobScheduler.from_env()
+    return _scheduler
@@ -0,0 +1,178 @@
+"""
+Logging for the server: levels, per-request correlation ids, sampling of
+verbose payloads and JSON output, without blocking the event loop.
+
+Records are put on an in-memory queue (QueueHandler) and formatted and
+written by a background thread (QueueListener), so a log call on the
+request path costs an enqueue; calls below the configured level cost a
+level check. Every record carries the id of the request it was logged
+for (set per request by the HTTP middleware, or per job), and anything
+passed through ``extra`` becomes a field of the JSON object.
+
+Verbose payloads (selections, prompts) are logged at DEBUG and sampled:
+``log_sampled`` only emits a fraction of them, so turning DEBUG on under
+load does not flood the output.
+
+Configuration (environment variables):
+    VISUALIZER_LOG_LEVEL        DEBUG, INFO (default), WARNING, ...
+    VISUALIZER_LOG_FORMAT       "json" (default) or "text"
+    VISUALIZER_LOG_SAMPLE_RATE  fraction of sampled payload logs kept (default 0.1)
+"""
+
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import uuid
+from typing import Any, Optional
+
+LOGGER_NAME = "visualizer"
+
+# Attributes every LogRecord has; anything else came in through ``extra``
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id"}
+
+_request_id: contextvars.ContextVar[str] = contextvars.ContextVar("request_id", default="-")
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger under the app's namespace, e.g. get_logger("pipeline")."""
+    return logging.getLogger(f"{LOGGER_NAME}.{name}")
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+# Client-supplied ids (X-Request-ID) are used as-is only when they look like ids
+_VALID_REQUEST_ID = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+
+def bind_request_id(request_id: Optional[str] = None) -> str:
+    """Make ``request_id`` (or a new one) the correlation id of the current context."""
+    if not request_id or not _VALID_REQUEST_ID.match(request_id):
+        request_id = new_request_id()
+    _request_id.set(request_id)
+    return request_id
+
+
+def current_request_id() -> str:
+    return _request_id.get()
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = _request_id.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        # Queued records carry the traceback already formatted (QueueHandler.prepare)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        elif record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class RecordQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that keeps the traceback apart from the message.
+
+    The stdlib prepare() folds the formatted traceback into ``msg`` and
+    drops ``exc_info``, so the JSON output lost its ``exc`` field. Here the
+    message is merged with its args as usual, and the traceback is kept as
+    ``exc_text``, which both formatters emit (logging.Formatter appends it).
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            # Tracebacks hold frames; not safe to keep past this thread
+            record.exc_info = None
+        return record
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = {k: v for k, v in vars(record).items() if k not in _RECORD_FIELDS}
+        if fields:
+            # On the message line, ahead of any traceback
+            head, newline, traceback = line.partition("\n")
+            line = head + " " + " ".join(f"{k}={v}" for k, v in fields.items()) + newline + traceback
+        return line
+
+
+def log_sampled(logger: logging.Logger, msg: str, *args: Any, **fields: Any) -> None:
+    """DEBUG log of a verbose payload, kept for VISUALIZER_LOG_SAMPLE_RATE of calls."""
+    if logger.isEnabledFor(logging.DEBUG) and random.random() < _sample_rate:
+        logger.debug(msg, *args, extra=fields)
+
+
+_sample_rate = 0.1
+_listener: Optional[logging.handlers.QueueListener] = None
+_handler: Optional[logging.Handler] = None
+
+
+def configure_logging() -> None:
+    """Install the queue handler on the app logger (idempotent) and start the writer thread."""
+    global _listener, _handler, _sample_rate
+    if _listener is not None:
+        return
+
+    level = os.getenv("VISUALIZER_LOG_LEVEL", "INFO").upper()
+    fmt = os.getenv("VISUALIZER_LOG_FORMAT", "json")
+    if fmt not in ("json", "text"):
+        raise ValueError(f"VISUALIZER_LOG_FORMAT must be 'json' or 'text', got {fmt!r}")
+    _sample_rate = float(os.getenv("VISUALIZER_LOG_SAMPLE_RATE", "0.1"))
+
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+
+    records: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    handler = RecordQueueHandler(records)
+    # The id is read from the caller's context, so it is attached before queueing
+    handler.addFilter(RequestIdFilter())
+
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(level)
+    logger.addHandler(handler)
+    logger.propagate = False
+
+    _handler = handler
+    _listener = logging.handlers.QueueListener(records, stream, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging() -> None:
+    """Flush queued records and stop the writer thread."""
+    global _listener, _handler
+    if _listener is not None:
+        logging.getLogger(LOGGER_NAME).removeHandler(_handler)
+        _listener.stop()
+        _listener = _handler = None
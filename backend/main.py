@@ -1,24 +1,86 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Header, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, FileResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import Response, StreamingResponse
 import json
 import os
-import io
-import shutil
+import time
 import uuid
-from typing import Dict, Any
+import zipfile
+import openai
+from contextlib import asynccontextmanager
+from typing import Dict, Any, List, Optional
 
 # Import existing backend logic
-from backend.architectural_visualizer import (
-    PRODUCT_CATALOG,
-    validate_selection,
-    build_backend_products_json,
-    edit_image,
-    generate_and_save_mask
+from backend.architectural_visualizer import MASK_REGION_PROMPTS, PRODUCT_CATALOG
+from backend.catalog import CATALOG
+from backend.workers import get_worker_pools, PipelineBusy
+from backend.cache import (
+    get_mask_cache,
+    get_result_cache,
+    hinted_digest,
+    image_digest,
+    result_cache_key,
+    etag_for_key
 )
+from backend.encodings import EncodingRejected, etag_matches, negotiate_encoding
+from backend.static_assets import get_static_index
+from backend.masks import MaskHints
+from backend.pipeline import (
+    edit_flights,
+    get_mask_providers,
+    local_cache_suffix,
+    run_batch,
+    run_edit,
+    run_local_render,
+    upload_stats
+)
+from backend.uploads import read_upload, UploadLimitMiddleware, UploadRejected
+from backend.openai_client import (
+    CircuitOpen,
+    DeadlineExceeded,
+    async_image_client_stats,
+    close_async_image_client
+)
+from backend.jobs import get_job_scheduler, JobFailed, JobQueueFull, PRIORITIES
+from backend.metrics import (
+    REGISTRY,
+    render_metrics,
+    REQUEST_SECONDS,
+    REQUESTS_IN_FLIGHT,
+    server_timing_enabled,
+    server_timing_header,
+    span,
+    start_request_timing,
+)
+from backend.logs import (
+    bind_request_id,
+    configure_logging,
+    current_request_id,
+    get_logger,
+    log_sampled,
+    shutdown_logging
+)
+
+logger = get_logger("api")
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    configure_logging()
+    get_static_index()
+    # Opens VISUALIZER_SHARED_DB, if set, so a bad path fails at startup
+    get_job_scheduler()
+    yield
+    await get_job_scheduler().shutdown()
+    await close_async_image_client()
+    get_worker_pools().shutdown()
+    shutdown_logging()
+
+
+app = FastAPI(lifespan=lifespan)
+
+# Refuse oversized uploads before Starlette spools them
+app.add_middleware(UploadLimitMiddleware)
 
 # Enable CORS for frontend
 app.add_middleware(
@@ -28,99 +90,144 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# -----------------------------------------------------------------------------
-# STATIC FILES SERVING (Frontend Integration)
-# -----------------------------------------------------------------------------
-# Mount the static directory (built frontend) to /static
-# We explicitly check if directory exists to avoid crashes during development if not built yet
-STATIC_DIR = os.path.join(os.path.dirname(__file__), "static")
-
-if os.path.isdir(STATIC_DIR):
-    app.mount("/assets", StaticFiles(directory=os.path.join(STATIC_DIR, "assets")), name="assets")
-
-# Serve index.html for root path and any other path (SPA routing)
-# We will define this at the END of the file to avoid conflicts.
-
-
-
-# -----------------------------------------------------------------------------
-# PRODUCT MAPPING LAYER
-# -----------------------------------------------------------------------------
-# Maps Frontend "Product Name" -> Backend Product ID
-FRONTEND_TO_BACKEND_MAP = {
-    # Trim
-    "Ridge Cap": 1,
-    "Rake & Corner": 2,  # Maps to "Rake Corner"
-    "J Channel": 3,      # Maps to "J-Channel"
-    "Corner Trim": 4,    # Map to "Rake Corner" (best fit)
-    # "Fascia Board": 4,   # Map to "Metal Trim" (best fit)
-
-    # Roofing
-    "Leakguard Panel": 5,
-    "Legacy Panel": 6,
-    "Classic Panel": 7,  # Ambiguity: Frontend has Classic Panel in both lists.
-                         # Context usually handles it, but unique names preferred.
-                         # If in "Roofing" category, it maps to 7.
-    "Standing Seam": 8,  # Maps to "Standing Seam Panel"
-
-    # Siding (Check `architectural_visualizer.py` IDs 9-12)
-    # 9: Wood Grain (Light), 10: Wood Grain (Dark), 11: Board & Batten (Grey), 12: Concealed Fastener
-    "Board & Batten": 11,
-    "Concealed Fastener Board & Batten": 12,
-    "Traditional Panel": 9, # Correctly maps to "Traditional Panel" (Light Wood) in backend
-    # "Classic Panel" (Siding) -> handled in logic by checking category?
-}
-
-def resolve_frontend_selection(user_selections: Dict[str, Any]) -> Dict[str, int]:
+@app.middleware("http")
+async def correlate_request(request: Request, call_next):
     """
-    Translates frontend selections (names/structure) to backend format (category -> ID).
-    Expected Frontend user_selections structure:
-    {
-       "roof": { "product_name": "Legacy Panel", ... },
-       "siding": { "product_name": "Board & Batten", ... },
-       "trim": { "product_name": "Ridge Cap", ... }
-    }
+    Tag every log record of the request (and its response) with one id, and
+    time it: latency histogram by route template, in-flight gauge, and the
+    stage spans as a Server-Timing header when enabled.
     """
-    backend_selection = {}
-
-    for category, item_data in user_selections.items():
-        # Frontend sends lowercase categories: 'roof', 'siding', 'trim'
-        # item_data is dict with 'product_name'
-        if not item_data or 'product_name' not in item_data:
-            continue
-
-        p_name = item_data['product_name']
-        p_id = FRONTEND_TO_BACKEND_MAP.get(p_name)
-
-        # Special handling for "Classic Panel" which appears in both keys
-        if p_name == "Classic Panel":
-            if category == "roof":
-                p_id = 7
-            elif category == "siding":
-                p_id = 10 # Mapping Siding Classic Panel to Classic Panel (Dark Wood - ID 10)
-
-        if p_id:
-            backend_selection[category] = p_id
-        else:
-            print(f"⚠️ Warning: Could not map frontend product '{p_name}' in category '{category}'")
-
-    return backend_selection
+    request_id = bind_request_id(request.headers.get("x-request-id"))
+    timings = start_request_timing()
+    start = time.perf_counter()
+    status = 500
+    REQUESTS_IN_FLIGHT.inc()
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        REQUESTS_IN_FLIGHT.dec()
+        route = request.scope.get("route")
+        REQUEST_SECONDS.observe(
+            time.perf_counter() - start,
+            method=request.method,
+            # The template, not the raw path, so /jobs/{job_id} is one series
+            route=getattr(route, "path", "unmatched"),
+            status=str(status),
+        )
+    response.headers["X-Request-ID"] = request_id
+    if server_timing_enabled() and timings:
+        response.headers["Server-Timing"] = server_timing_header(timings)
+    return response
 
 # -----------------------------------------------------------------------------
 # ENDPOINTS
 # -----------------------------------------------------------------------------
 
 @app.api_route("/", methods=["GET", "HEAD"])
-def home():
-    index_path = os.path.join("static", "index.html")
-    if os.path.exists(index_path):
-        return FileResponse(index_path)
-    return {"status": "Backend running, but frontend not built. Run render-build.sh"}
+def home(request: Request):
+    if get_static_index().index_html is None:
+        return {"status": "Backend running, but frontend not built. Run render-build.sh"}
+    return serve_static(request, "/")
 
 
 @app.get("/health")
 def health():
-    return {"status": "ok"}
+    return {
+        "status": "ok",
+        "workers": get_worker_pools().stats(),
+        "mask_cache": get_mask_cache().stats(),
+        "result_cache": get_result_cache().stats(),
+        "uploads": upload_stats,
+        "coalescing": edit_flights.stats(),
+        "openai": async_image_client_stats(),
+        "jobs": get_job_scheduler().stats(),
+        "mask_provider": get_mask_providers()[0].name,
+        "static": get_static_index().stats(),
+    }
+
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus text exposition of latencies, gauges and the /health counters."""
+    return Response(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def collect_component_stats():
+    """Pool, cache, upload, OpenAI client and job counters, read at scrape time."""
+    pools = get_worker_pools().stats()
+    collected = [
+        ("visualizer_pipeline_in_flight", "gauge", "Edits holding a pipeline slot.",
+         [({}, pools["in_flight"])]),
+        ("visualizer_pipeline_queued", "gauge", "Edits waiting for a pipeline slot.",
+         [({}, pools["queued"])]),
+        ("visualizer_pool_pending", "gauge", "Tasks submitted to the worker pools and not yet finished.",
+         [({"pool": "io"}, pools["io_pending"]), ({"pool": "cpu"}, pools["cpu_pending"])]),
+        ("visualizer_pipeline_completed_total", "counter", "Edits that released their pipeline slot.",
+         [({}, pools["completed"])]),
+        ("visualizer_pipeline_rejected_total", "counter", "Edits rejected because the slot queue was full.",
+         [({}, pools["rejected"])]),
+        ("visualizer_render_memory_reserved_bytes", "gauge", "Render memory budget held by running renders.",
+         [({}, get_worker_pools().memory_reserved)]),
+    ]
+
+    hits, misses, cache_bytes = [], [], []
+    for name, cache in (("mask", get_mask_cache()), ("result", get_result_cache())):
+        stats = cache.stats()
+        hits += [({"cache": name, "tier": "memory"}, stats["memory_hits"]),
+                 ({"cache": name, "tier": "disk"}, stats["disk_hits"])]
+        misses.append(({"cache": name}, stats["misses"]))
+        for tier in ("memory", "disk"):
+            if f"{tier}_bytes" in stats:
+                cache_bytes.append(({"cache": name, "tier": tier}, stats[f"{tier}_bytes"]))
+    collected += [
+        ("visualizer_cache_hits_total", "counter", "Cache lookups served, by tier.", hits),
+        ("visualizer_cache_misses_total", "counter", "Cache lookups that missed every tier.", misses),
+        ("visualizer_cache_bytes", "gauge", "Bytes held by each cache tier.", cache_bytes),
+        ("visualizer_upload_original_bytes_total", "counter", "Bytes of uploaded photos.",
+         [({}, upload_stats["original_bytes"])]),
+        ("visualizer_upload_model_bytes_total", "counter", "Bytes of the downscaled images sent to the model.",
+         [({}, upload_stats["model_bytes"])]),
+    ]
+
+    flights = edit_flights.stats()
+    collected += [
+        ("visualizer_edits_total", "counter",
+         "Uncached edits, by whether they rendered or joined an identical edit in flight.",
+         [({"outcome": "computed"}, flights["computed"]), ({"outcome": "coalesced"}, flights["coalesced"])]),
+        ("visualizer_edits_in_flight", "gauge", "Distinct edits rendering.",
+         [({}, flights["in_flight"])]),
+    ]
+
+    openai_stats = async_image_client_stats()
+    if openai_stats:
+        collected += [
+            ("visualizer_openai_calls_total", "counter", "Image edit calls made to OpenAI (excluding retries).",
+             [({}, openai_stats["calls"])]),
+            ("visualizer_openai_retries_total", "counter", "Retried OpenAI attempts.",
+             [({}, openai_stats["retries"])]),
+            ("visualizer_openai_failed_total", "counter", "OpenAI calls that failed after retries.",
+             [({}, openai_stats["failed"])]),
+            ("visualizer_openai_rejected_total", "counter", "Calls failed fast by the open circuit breaker.",
+             [({}, openai_stats["rejected_by_breaker"])]),
+            ("visualizer_openai_errors_total", "counter", "OpenAI errors by exception type.",
+             [({"type": name}, count) for name, count in openai_stats["errors"].items()]),
+            ("visualizer_openai_breaker_state", "gauge", "1 for the circuit breaker's current state.",
+             [({"state": openai_stats["breaker"]}, 1)]),
+        ]
+
+    jobs = get_job_scheduler().stats()
+    collected += [
+        ("visualizer_jobs", "gauge", "Jobs by status.",
+         [({"status": "queued"}, jobs["queued"]), ({"status": "running"}, jobs["running"])]),
+        ("visualizer_jobs_total", "counter", "Jobs by outcome.",
+         [({"outcome": outcome}, jobs[outcome])
+          for outcome in ("submitted", "completed", "failed", "cancelled", "rejected")]),
+    ]
+    return collected
+
+
+REGISTRY.add_collector(collect_component_stats)
 
 @app.post("/analyze-exterior")
 async def analyze_exterior_endpoint(
@@ -140,87 +247,417 @@ async def analyze_exterior_endpoint(
         # }
     }
 
+def resolve_products_json(user_selections: str) -> Dict[str, Any]:
+    """Frontend user_selections JSON -> validated products JSON (HTTP 400 on bad input)."""
+    # 2. Parse selections & Resolve IDs
+    try:
+        selections_dict = json.loads(user_selections)
+    except json.JSONDecodeError as e:
+        raise HTTPException(status_code=400, detail=f"user_selections is not valid JSON: {e}")
+    return resolve_selections_dict(selections_dict)
+
+def resolve_selections_dict(selections_dict: Dict[str, Any]) -> Dict[str, Any]:
+    if not isinstance(selections_dict, dict):
+        raise HTTPException(status_code=400, detail="Selections must be a JSON object.")
+    backend_selection_ids = CATALOG.resolve_frontend_selection(selections_dict)
+    log_sampled(logger, "resolved selection", selections=selections_dict, product_ids=backend_selection_ids)
+
+    if not backend_selection_ids:
+         raise HTTPException(status_code=400, detail="No valid products selected.")
+
+    # 3. Validate & Build Products JSON (using existing backend logic)
+    ok, msg, products_json = CATALOG.products_json(backend_selection_ids)
+    if not ok:
+        raise HTTPException(status_code=400, detail=f"Selection validation failed: {msg}")
+
+    return products_json
+
+def parse_mask_hints(mask_hints: str) -> Optional[MaskHints]:
+    """
+    Optional mask hints: JSON {"roof": [[x, y], ...], ...} with points in
+    0..1 image coordinates (HTTP 400 on bad input).
+    """
+    if not mask_hints:
+        return None
+    try:
+        raw = json.loads(mask_hints)
+    except json.JSONDecodeError as e:
+        raise HTTPException(status_code=400, detail=f"mask_hints is not valid JSON: {e}")
+    if not isinstance(raw, dict):
+        raise HTTPException(status_code=400, detail="mask_hints must be a JSON object.")
+
+    hints = {}
+    for region, points in raw.items():
+        if region not in MASK_REGION_PROMPTS:
+            raise HTTPException(status_code=400, detail=f"mask_hints: unknown region {region!r}.")
+        try:
+            hints[region] = [(float(x), float(y)) for x, y in points]
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail=f"mask_hints: {region} must be a list of [x, y] points.")
+        if not all(0 <= v <= 1 for point in hints[region] for v in point):
+            raise HTTPException(status_code=400, detail="mask_hints: points must be within 0..1.")
+    return hints or None
+
+def to_http_error(e: BaseException, log: bool = True) -> HTTPException:
+    """Map a pipeline failure to the HTTP error the client should see (logging unexpected ones)."""
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, JobFailed):
+        return HTTPException(status_code=e.status_code, detail=str(e))
+    if isinstance(e, UploadRejected):
+        return HTTPException(status_code=e.status_code, detail=e.detail)
+    if isinstance(e, EncodingRejected):
+        return HTTPException(status_code=400, detail=str(e))
+    if isinstance(e, (PipelineBusy, CircuitOpen, JobQueueFull)):
+        return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    if isinstance(e, DeadlineExceeded):
+        return HTTPException(status_code=504, detail=str(e))
+    if isinstance(e, openai.APIError):
+        if log:
+            logger.warning("openai error", extra={"error": str(e)})
+        return HTTPException(status_code=502, detail=str(e))
+    if log:
+        logger.error("edit failed", exc_info=e)
+    return HTTPException(status_code=500, detail=str(e))
+
+def render_scale_headers(result) -> Dict[str, str]:
+    """X-Render-Scale (e.g. "1/2") when the render was reduced to fit the render memory budget."""
+    return {"X-Render-Scale": f"1/{result.scale}"} if result.scale > 1 else {}
+
+EDIT_ENGINES = ("ai", "local")
+
 @app.post("/edit-image")
 async def edit_image_api(
     file: UploadFile = File(...),
     analysis_results: str = Form(default="{}"), # Not used by current backend logic
-    user_selections: str = Form(...)
+    user_selections: str = Form(...),
+    mask_hints: str = Form(default=""),
+    format: Optional[str] = Query(default=None),
+    quality: Optional[str] = Query(default=None),
+    engine: str = Query(default="ai"),
+    accept: Optional[str] = Header(default=None),
+    save_data: Optional[str] = Header(default=None),
+    if_none_match: Optional[str] = Header(default=None)
 ):
-    temp_input_path = f"temp_{uuid.uuid4()}.jpg"
-    temp_mask_path = f"mask_{uuid.uuid4()}.png"
-
+    """
+    Render the selection onto the photo. ``engine=local`` skips the model:
+    the regions are recoloured locally in well under a second, an instant
+    preview to show while the model render (the default, ``engine=ai``) runs.
+    """
+    if engine not in EDIT_ENGINES:
+        raise HTTPException(status_code=400, detail=f"engine must be one of {', '.join(EDIT_ENGINES)}")
     try:
-        # 1. Save uploaded file
-        with open(temp_input_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-
-        # 2. Parse selections & Resolve IDs
-        selections_dict = json.loads(user_selections)
-        print(f"📥 Received Selections: {selections_dict}")
-
-        backend_selection_ids = resolve_frontend_selection(selections_dict)
-        print(f"🔄 Mapped to Backend IDs: {backend_selection_ids}")
-
-        if not backend_selection_ids:
-             raise HTTPException(status_code=400, detail="No valid products selected.")
-
-        # 3. Validate & Build Products JSON (using existing backend logic)
-        ok, msg, resolved = validate_selection(backend_selection_ids)
-        if not ok:
-            raise HTTPException(status_code=400, detail=f"Selection validation failed: {msg}")
-
-        products_json = build_backend_products_json(resolved)
-
-        # 4. Generate Mask (Using existing AI Logic)
-        print("🤖 Generating mask...")
-        generate_and_save_mask(temp_input_path, products_json, temp_mask_path)
-        
-        # Ensure 'mask.png' exists for edit_image if it hardcodes it (it does in line 431)
-        # We need to temporarily rename or copy our mask to 'mask.png' if function isn't flexible
-        # Checking architectural_visualizer.py line 431: open("mask.png", "rb")
-        # I must overwrite "mask.png" in CWD or patch the function.
-        # Since strict rule "Do NOT rewrite architectural_visualizer logic", I must put the file where it expects.
-        if os.path.exists("mask.png"):
-             os.remove("mask.png")
-        shutil.copy(temp_mask_path, "mask.png")
-
-        # 5. Edit Image (Using existing AI Logic)
-        print("🎨 Editing image...")
-        output_image_bytes = edit_image(temp_input_path, products_json)
+        # Output encoding: ?format=&quality=, else Accept / Save-Data
+        encoding = negotiate_encoding(format, quality, accept, save_data)
+
+        # 1. Read uploaded file (size/type checked while streaming, then
+        #    kept in memory for the whole request)
+        with span("upload"):
+            image_bytes = await read_upload(file)
+
+        products_json = resolve_products_json(user_selections)
+        hints = parse_mask_hints(mask_hints)
+
+        # Identical image + products always map to the same render, so the
+        # ETag can be answered before doing any work.
+        digest = await get_worker_pools().run_io(image_digest, image_bytes)
+        suffix = local_cache_suffix(encoding) if engine == "local" else encoding.cache_suffix
+        etag = etag_for_key(result_cache_key(hinted_digest(digest, hints), products_json, suffix))
+        cache_headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Accept, Save-Data"}
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=cache_headers)
+
+        # 4. Generate Mask & 5. Edit Image (blocking stages run on the
+        #    worker pools, masks and finished renders are cached)
+        if engine == "local":
+            output_image_bytes = await run_local_render(image_bytes, products_json, digest, hints, encoding)
+        else:
+            result = await run_edit(
+                image_bytes, products_json, digest, hints=hints, encoding=encoding
+            )
+            output_image_bytes = result.image
+            if result.fell_back:
+                # Not the render the ETag names (and not cached): nothing to revalidate
+                cache_headers = {"Cache-Control": "no-store", "Vary": "Accept, Save-Data"}
+            cache_headers.update(render_scale_headers(result))
 
         # 6. Return Result
+        return Response(
+            content=output_image_bytes,
+            media_type=encoding.media_type,
+            headers=cache_headers
+        )
+
+    except Exception as e:
+        raise to_http_error(e)
+
+# -----------------------------------------------------------------------------
+# BATCH EDITS (many product variants for one photo)
+# -----------------------------------------------------------------------------
+
+BATCH_MAX_VARIANTS = int(os.getenv("VISUALIZER_BATCH_MAX", "8"))
+BATCH_CONCURRENCY = int(os.getenv("VISUALIZER_BATCH_CONCURRENCY", "4"))
+
+def _variant_name(index: int) -> str:
+    return f"variant-{index + 1}.jpg"
+
+def _error_json(e: Exception) -> bytes:
+    error = to_http_error(e)
+    return json.dumps({"status_code": error.status_code, "detail": error.detail}).encode()
+
+async def _multipart_stream(results, boundary: str):
+    async for index, result in results:
+        if isinstance(result, Exception):
+            headers = "Content-Type: application/json\r\n"
+            body = _error_json(result)
+        else:
+            headers = (
+                "Content-Type: image/jpeg\r\n"
+                f'Content-Disposition: attachment; filename="{_variant_name(index)}"\r\n'
+            )
+            body = result
+        yield (
+            f"--{boundary}\r\n{headers}X-Variant-Index: {index}\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n"
+        ).encode() + body + b"\r\n"
+    yield f"--{boundary}--\r\n".encode()
+
+class _ChunkSink:
+    """Write-only, unseekable file object; zipfile then streams with data descriptors."""
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+async def _zip_stream(results):
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED) as archive:
+        async for index, result in results:
+            if isinstance(result, Exception):
+                archive.writestr(f"variant-{index + 1}.error.json", _error_json(result))
+            else:
+                archive.writestr(_variant_name(index), result)
+            yield sink.drain()
+    yield sink.drain()
+
+@app.post("/edit-image/batch")
+async def edit_image_batch_api(
+    file: UploadFile = File(...),
+    analysis_results: str = Form(default="{}"), # Not used by current backend logic
+    selections: str = Form(...),
+    mask_hints: str = Form(default=""),
+    format: str = Form(default="multipart")
+):
+    """
+    Render several product selections for one photo.
+
+    ``selections`` is a JSON list of user_selections objects (same shape as
+    /edit-image). Results stream back as each variant finishes, either as
+    multipart/mixed parts (X-Variant-Index tells which selection a part is
+    for) or as entries of a zip archive (``format=zip``). A failed variant
+    becomes a JSON error part instead of failing the whole batch.
+    """
+    if format not in ("multipart", "zip"):
+        raise HTTPException(status_code=400, detail="format must be 'multipart' or 'zip'")
+    try:
+        try:
+            selections_list = json.loads(selections)
+        except json.JSONDecodeError as e:
+            raise HTTPException(status_code=400, detail=f"selections is not valid JSON: {e}")
+        if not isinstance(selections_list, list) or not selections_list:
+            raise HTTPException(status_code=400, detail="selections must be a non-empty JSON list.")
+        if len(selections_list) > BATCH_MAX_VARIANTS:
+            raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_VARIANTS} variants per batch.")
+
+        products_list = []
+        for index, selections_dict in enumerate(selections_list):
+            try:
+                products_list.append(resolve_selections_dict(selections_dict))
+            except HTTPException as e:
+                raise HTTPException(status_code=400, detail=f"Variant {index + 1}: {e.detail}")
+        hints = parse_mask_hints(mask_hints)
+
+        with span("upload"):
+            image_bytes = await read_upload(file)
+    except Exception as e:
+        raise to_http_error(e)
+
+    results = run_batch(image_bytes, products_list, BATCH_CONCURRENCY, hints=hints)
+    if format == "zip":
         return StreamingResponse(
-            io.BytesIO(output_image_bytes),
-            media_type="image/jpeg"
+            _zip_stream(results),
+            media_type="application/zip",
+            headers={"Content-Disposition": 'attachment; filename="variants.zip"'}
         )
+    boundary = uuid.uuid4().hex
+    return StreamingResponse(
+        _multipart_stream(results, boundary),
+        media_type=f"multipart/mixed; boundary={boundary}"
+    )
+
+# -----------------------------------------------------------------------------
+# EDIT JOBS (submit, follow progress over SSE, fetch result)
+# -----------------------------------------------------------------------------
 
+@app.post("/jobs", status_code=202)
+async def submit_edit_job(
+    file: UploadFile = File(...),
+    analysis_results: str = Form(default="{}"), # Not used by current backend logic
+    user_selections: str = Form(...),
+    mask_hints: str = Form(default=""),
+    priority: str = Form(default="normal"),
+    format: Optional[str] = Query(default=None),
+    quality: Optional[str] = Query(default=None),
+    accept: Optional[str] = Header(default=None),
+    save_data: Optional[str] = Header(default=None)
+):
+    """Queue an edit and return its job id immediately; the result is encoded as negotiated here."""
+    if priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"priority must be one of {', '.join(PRIORITIES)}")
+    try:
+        encoding = negotiate_encoding(format, quality, accept, save_data)
+        with span("upload"):
+            image_bytes = await read_upload(file)
+        products_json = resolve_products_json(user_selections)
+        hints = parse_mask_hints(mask_hints)
+
+        request_id = current_request_id()
+
+        async def run(job):
+            # Jobs run on scheduler tasks: keep the submitting request's id
+            bind_request_id(request_id)
+            digest = await get_worker_pools().run_io(image_digest, image_bytes)
+            result_key = result_cache_key(hinted_digest(digest, hints), products_json, encoding.cache_suffix)
+            job.headers = {"ETag": etag_for_key(result_key)}
+            try:
+                result = await run_edit(
+                    image_bytes, products_json, digest,
+                    progress=job.progress, hints=hints, encoding=encoding, preview=job.set_preview,
+                )
+            except Exception as e:
+                # Logged here, with the job's request id; recorded for the
+                # worker that serves the result, which may not be this one
+                job.error_status = to_http_error(e).status_code
+                raise
+            if result.fell_back:
+                job.headers = {"Cache-Control": "no-store"}
+            job.headers.update(render_scale_headers(result))
+            return result.image
+
+        scheduler = get_job_scheduler()
+        job = scheduler.submit(run, priority)
+        job.media_type = encoding.media_type
+        job.progress("upload")
+        await scheduler.published(job)
     except Exception as e:
-        print(f"❌ Error: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+        raise to_http_error(e)
 
-    finally:
-        # Cleanup
-        if os.path.exists(temp_input_path):
-            os.remove(temp_input_path)
-        if os.path.exists(temp_mask_path):
-            os.remove(temp_mask_path)
-        # Optional: keep or delete standard 'mask.png'
+    return {
+        **job.to_dict(),
+        "status_url": f"/jobs/{job.id}",
+        "events_url": f"/jobs/{job.id}/events",
+        "preview_url": f"/jobs/{job.id}/preview",
+        "result_url": f"/jobs/{job.id}/result",
+    }
+
+def _get_job(job_id: str):
+    job = get_job_scheduler().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired.")
+    return job
+
+@app.get("/jobs/{job_id}")
+def get_edit_job(job_id: str):
+    return _get_job(job_id).to_dict()
+
+@app.get("/jobs/{job_id}/events")
+async def edit_job_events(job_id: str):
+    """Server-Sent Events: one event per status change / pipeline stage, until the job ends."""
+    # The lookup may read the shared store (VISUALIZER_SHARED_DB)
+    job = await get_worker_pools().run_io(_get_job, job_id)
+
+    async def stream():
+        async for event in job.follow():
+            if event is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield f"event: {event['type']}\nid: {event['seq']}\ndata: {json.dumps(event)}\n\n"
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/jobs/{job_id}/result")
+def get_edit_job_result(job_id: str):
+    job = _get_job(job_id)
+    if job.status == "done":
+        return Response(content=job.result, media_type=job.media_type, headers=job.headers)
+    if job.status == "failed":
+        raise to_http_error(job.error, log=False)
+    if job.status == "cancelled":
+        raise HTTPException(status_code=410, detail="Job was cancelled.")
+    raise HTTPException(status_code=409, detail=f"Job is {job.status}; result not ready yet.")
+
+@app.get("/jobs/{job_id}/preview")
+def get_edit_job_preview(job_id: str):
+    """Low-resolution JPEG of the edit, available before the result (not for cached results)."""
+    job = _get_job(job_id)
+    if job.preview is not None:
+        return Response(content=job.preview, media_type="image/jpeg", headers={"Cache-Control": "private, no-cache"})
+    if job.finished:
+        raise HTTPException(status_code=404, detail="This job produced no preview.")
+    raise HTTPException(status_code=409, detail=f"Job is {job.status}; preview not ready yet.")
+
+@app.delete("/jobs/{job_id}")
+async def cancel_edit_job(job_id: str):
+    scheduler = get_job_scheduler()
+    # This process's jobs are cancelled on the event loop (their task and
+    # followers live there); another worker's through the shared store, off it
+    job = scheduler.cancel(job_id)
+    if job is None:
+        job = await get_worker_pools().run_io(scheduler.request_cancel, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired.")
+    return job.to_dict()
 
 # -----------------------------------------------------------------------------
 # SPA CATCH-ALL ROUTE (MUST BE LAST)
 # -----------------------------------------------------------------------------
-@app.get("/{full_path:path}")
-async def catch_all(full_path: str):
-    # This matches any path not matched by specific API routes above.
-    # Try to find a static file first (in case it wasn't in /assets)
-    potential_file_path = os.path.join(STATIC_DIR, full_path)
-    if os.path.isfile(potential_file_path):
-        return FileResponse(potential_file_path)
-        
-    # Otherwise return index.html for client-side routing
-    index_path = os.path.join(STATIC_DIR, "index.html")
-    if os.path.exists(index_path):
-        return FileResponse(index_path)
-    
-    return {"error": "Frontend not found"}
-
+# The built frontend is indexed and precompressed in memory at startup
+# (backend.static_assets). This catch-all is defined last so the API
+# routes above take precedence.
+
+def serve_static(request: Request, path: str) -> Response:
+    asset = get_static_index().resolve(path)
+    if asset is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    encoding, body, etag = asset.representation(request.headers.get("accept-encoding"))
+    headers = {"ETag": etag, "Cache-Control": asset.cache_control, "Vary": "Accept-Encoding"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    if request.method == "HEAD":
+        headers["Content-Length"] = str(len(body))
+        body = b""
+    return Response(content=body, media_type=asset.media_type, headers=headers)
+
+@app.api_route("/{full_path:path}", methods=["GET", "HEAD"])
+def catch_all(request: Request, full_path: str):
+    # Any path not matched by the API routes above: a static file, or
+    # index.html for client-side routing
+    if not get_static_index().assets:
+        return {"error": "Frontend not found"}
+    return serve_static(request, full_path)
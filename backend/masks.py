@@ -0,0 +1,102 @@
+"""
+Mask providers: where the per-region edit masks come from.
+
+- "openai": asks gpt-image-1 for a black/white segmentation mask of each
+  region (one call per region, run concurrently)
+- "local": classical colour/position segmentation on the CPU pool
+  (backend.segmentation); no network, deterministic, well under a second
+
+Every provider returns BitMasks at the prepared model size, keyed by
+region, so the pipeline caches and unions them the same way. Optional
+hints (user scribbles: 0..1 image points per region) steer the local
+provider; the OpenAI provider ignores them.
+
+Configuration (environment variables):
+    VISUALIZER_MASK_PROVIDER   "openai" (default) or "local"
+    VISUALIZER_MASK_FALLBACK   provider used when the configured one fails
+                               upstream, e.g. "local" (default: none)
+"""
+
+import asyncio
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import openai
+
+from backend.architectural_visualizer import (
+    build_region_mask_prompt,
+    PreparedImage,
+    threshold_mask,
+)
+from backend.bitmask import BitMask
+from backend.logs import get_logger
+from backend.metrics import span
+from backend.openai_client import CircuitOpen, DeadlineExceeded
+from backend.segmentation import segment_house
+from backend.workers import get_worker_pools
+
+logger = get_logger("masks")
+
+MASK_PROVIDERS = ("openai", "local")
+
+# Failures of the provider's upstream that the fallback provider may cover
+FALLBACK_ERRORS = (CircuitOpen, DeadlineExceeded, openai.APIError)
+
+# Region -> scribble points in 0..1 image coordinates
+MaskHints = Dict[str, List[Tuple[float, float]]]
+
+# call_model(prompt, image_bytes, mask, stage=...) -> edited image bytes
+ModelCall = Callable[..., Awaitable[bytes]]
+
+
+class MaskProvider(ABC):
+    name = "base"
+    # Whether hints change the masks (and so must be part of their cache key)
+    uses_hints = False
+
+    @abstractmethod
+    async def region_masks(
+        self, prepared: PreparedImage, regions: Tuple[str, ...], hints: Optional[MaskHints] = None
+    ) -> Dict[str, BitMask]:
+        """Mask per region in ``regions``, at ``prepared.model_size``."""
+
+
+class OpenAIMaskProvider(MaskProvider):
+    name = "openai"
+
+    def __init__(self, call_model: ModelCall):
+        self.call_model = call_model
+
+    async def _region_mask(self, prepared: PreparedImage, region: str) -> BitMask:
+        logger.debug("generating mask", extra={"provider": self.name, "region": region})
+        raw_mask = await self.call_model(
+            build_region_mask_prompt((region,)), prepared.model_bytes, stage="mask.model"
+        )
+        with span("mask.binarize"):
+            return await get_worker_pools().run_cpu(threshold_mask, raw_mask, prepared.model_size)
+
+    async def region_masks(
+        self, prepared: PreparedImage, regions: Tuple[str, ...], hints: Optional[MaskHints] = None
+    ) -> Dict[str, BitMask]:
+        masks = await asyncio.gather(*(self._region_mask(prepared, region) for region in regions))
+        return dict(zip(regions, masks))
+
+
+class LocalMaskProvider(MaskProvider):
+    name = "local"
+    uses_hints = True
+
+    async def region_masks(
+        self, prepared: PreparedImage, regions: Tuple[str, ...], hints: Optional[MaskHints] = None
+    ) -> Dict[str, BitMask]:
+        logger.debug("generating mask", extra={"provider": self.name, "regions": list(regions)})
+        with span("mask.local"):
+            return await get_worker_pools().run_cpu(segment_house, prepared.model_bytes, tuple(regions), hints)
+
+
+def create_mask_provider(name: str, call_model: ModelCall) -> MaskProvider:
+    if name == "openai":
+        return OpenAIMaskProvider(call_model)
+    if name == "local":
+        return LocalMaskProvider()
+    raise ValueError(f"Unknown mask provider {name!r}; use one of {', '.join(MASK_PROVIDERS)}")
@@ -0,0 +1,376 @@
+"""
+Async gpt-image-1 client used by the server pipeline.
+
+Wraps openai.AsyncOpenAI with:
+
+- a pooled keep-alive httpx connection pool shared by all requests
+- a per-attempt timeout and an overall deadline per call
+- retries with full-jitter exponential backoff on 429, 5xx and
+  connection errors (honouring Retry-After)
+- a circuit breaker that fails fast after repeated failures, so a dead
+  upstream does not tie up every pipeline slot for the full deadline
+- an optional requests-per-minute token bucket in front of every attempt;
+  with VISUALIZER_SHARED_DB it is kept in the shared SQLite file, so the
+  limit holds for all worker processes together rather than each
+
+The SDK's own retries are disabled; this module owns the retry budget.
+Point OPENAI_BASE_URL at a local stub (python -m benchmarks.stub_openai)
+to exercise it without the real API.
+
+Configuration (environment variables):
+    VISUALIZER_OPENAI_MAX_CONNECTIONS   pooled connections (default 20)
+    VISUALIZER_OPENAI_TIMEOUT           seconds per attempt (default 120)
+    VISUALIZER_OPENAI_DEADLINE          seconds per call, retries included (default 240)
+    VISUALIZER_OPENAI_RETRIES           retries after the first attempt (default 3)
+    VISUALIZER_OPENAI_BREAKER_FAILURES  consecutive failures that open the breaker (default 5)
+    VISUALIZER_OPENAI_BREAKER_RESET     seconds the breaker stays open (default 30)
+    VISUALIZER_OPENAI_RPM               attempts per minute across all workers (default 0, unlimited)
+    VISUALIZER_OPENAI_BURST             attempts allowed at once under the RPM limit
+                                        (default 10 seconds' worth, at least 1)
+"""
+
+import asyncio
+import base64
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+import openai
+
+from backend.architectural_visualizer import as_upload
+from backend.shared_state import SharedDB, get_shared_db
+
+# Errors worth another attempt; anything else (400, 401, ...) fails at once
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.InternalServerError,
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+)
+
+
+class CircuitOpen(Exception):
+    """Raised without calling upstream while the circuit breaker is open."""
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a call and its retries do not finish within the deadline."""
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure breaker: closed -> open after ``failure_threshold``
+    failures, half-open (one trial call) after ``reset_timeout`` seconds,
+    closed again on the first success.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def before_call(self) -> bool:
+        """Raise CircuitOpen, or let the call through; True when it is the half-open trial."""
+        state = self.state
+        if state == "open" or (state == "half_open" and self._trial_in_flight):
+            raise CircuitOpen("OpenAI is failing repeatedly; not sending requests for now")
+        if state == "half_open":
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def release_trial(self) -> None:
+        """The trial call ended without an outcome (cancelled, ...): let another one through."""
+        self._trial_in_flight = False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._trial_in_flight or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self._trial_in_flight = False
+
+
+class RateLimiter:
+    """
+    Token bucket: ``per_minute`` tokens a minute, holding at most ``burst``.
+
+    reserve() always takes a token and returns how long to wait before
+    using it; the bucket goes negative while callers are waiting, so they
+    are served in the order they asked. With a SharedDB the bucket is a row
+    in it, updated in one transaction per reservation, and the limit is
+    shared by every process using that file.
+    """
+
+    def __init__(self, per_minute: float, burst: float, db: Optional[SharedDB] = None, name: str = "openai"):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.db = db
+        self.name = name
+        self._lock = threading.Lock()
+        self._tokens = burst
+        self._updated = time.time()
+        if db is not None:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limits "
+                "(name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+
+    def _take(self, tokens: float, updated: float, now: float) -> Tuple[float, float]:
+        tokens = min(self.burst, tokens + max(0.0, now - updated) * self.rate) - 1
+        return tokens, max(0.0, -tokens / self.rate)
+
+    def reserve(self) -> float:
+        """Take a token; seconds to wait before it may be used."""
+        # Wall-clock time, as the shared bucket is compared across processes
+        now = time.time()
+        if self.db is None:
+            with self._lock:
+                self._tokens, wait = self._take(self._tokens, self._updated, now)
+                self._updated = now
+            return wait
+        with self.db.transaction() as db:
+            row = db.execute("SELECT tokens, updated FROM rate_limits WHERE name = ?", (self.name,)).fetchone()
+            tokens, wait = self._take(*(row or (self.burst, now)), now)
+            db.execute("INSERT OR REPLACE INTO rate_limits (name, tokens, updated) VALUES (?, ?, ?)",
+                       (self.name, tokens, now))
+        return wait
+
+    async def reserve_async(self) -> float:
+        if self.db is None:
+            return self.reserve()
+        # The transaction may wait for another process's write
+        return await asyncio.to_thread(self.reserve)
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class AsyncImageClient:
+    def __init__(
+        self,
+        max_connections: int = 20,
+        timeout: float = 120.0,
+        deadline: float = 240.0,
+        retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_cap: float = 8.0,
+        breaker: Optional[CircuitBreaker] = None,
+        limiter: Optional[RateLimiter] = None,
+        base_url: Optional[str] = None,
+    ):
+        self.timeout = timeout
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.breaker = breaker or CircuitBreaker(failure_threshold=5, reset_timeout=30.0)
+        self.limiter = limiter
+
+        self._http = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=60.0,
+            ),
+            timeout=httpx.Timeout(timeout, connect=10.0),
+        )
+        self._client = openai.AsyncOpenAI(
+            base_url=base_url or os.getenv("OPENAI_BASE_URL") or None,
+            http_client=self._http,
+            max_retries=0,
+            timeout=timeout,
+        )
+
+        # Counters
+        self.calls = 0
+        self.retried = 0
+        self.failed = 0
+        self.rejected = 0
+        self.throttled = 0
+        self.throttled_seconds = 0.0
+        self.errors_by_type: Dict[str, int] = {}
+
+    @classmethod
+    def from_env(cls) -> "AsyncImageClient":
+        def env(name: str, default: float) -> float:
+            value = os.getenv(name)
+            return float(value) if value else default
+
+        limiter = None
+        per_minute = env("VISUALIZER_OPENAI_RPM", 0)
+        if per_minute > 0:
+            limiter = RateLimiter(
+                per_minute,
+                burst=env("VISUALIZER_OPENAI_BURST", max(1.0, per_minute / 6)),
+                db=get_shared_db(),
+            )
+        return cls(
+            max_connections=int(env("VISUALIZER_OPENAI_MAX_CONNECTIONS", 20)),
+            timeout=env("VISUALIZER_OPENAI_TIMEOUT", 120),
+            deadline=env("VISUALIZER_OPENAI_DEADLINE", 240),
+            retries=int(env("VISUALIZER_OPENAI_RETRIES", 3)),
+            breaker=CircuitBreaker(
+                failure_threshold=int(env("VISUALIZER_OPENAI_BREAKER_FAILURES", 5)),
+                reset_timeout=env("VISUALIZER_OPENAI_BREAKER_RESET", 30),
+            ),
+            limiter=limiter,
+        )
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            return min(retry_after, self.backoff_cap)
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    async def _throttle(self, give_up_at: float) -> None:
+        """Wait for the rate limiter's go-ahead, or fail if it comes after the deadline."""
+        if self.limiter is None:
+            return
+        wait = await self.limiter.reserve_async()
+        if wait <= 0:
+            return
+        if time.monotonic() + wait >= give_up_at:
+            self.failed += 1
+            raise DeadlineExceeded(
+                f"OpenAI rate limit: next request allowed in {wait:.0f}s, after the {self.deadline:g}s deadline"
+            )
+        self.throttled += 1
+        self.throttled_seconds += wait
+        await asyncio.sleep(wait)
+
+    async def _attempt(self, image_bytes: bytes, prompt: str, mask_bytes: Optional[bytes]) -> bytes:
+        extra = {}
+        if mask_bytes is not None:
+            extra["mask"] = as_upload(mask_bytes, "mask")
+
+        response = await self._client.images.edit(
+            model="gpt-image-1",
+            prompt=prompt,
+            image=as_upload(image_bytes, "image"),
+            **extra
+        )
+        return base64.b64decode(response.data[0].b64_json)
+
+    async def edit(self, image_bytes: bytes, prompt: str, mask_bytes: Optional[bytes] = None) -> bytes:
+        """Async equivalent of request_image_edit with retries, deadline and breaker."""
+        try:
+            trial = self.breaker.before_call()
+        except CircuitOpen:
+            self.rejected += 1
+            raise
+
+        self.calls += 1
+        try:
+            return await self._edit_with_retries(image_bytes, prompt, mask_bytes)
+        finally:
+            # Success and upstream failures already settled the trial; any
+            # other exit (cancellation, the rate limit's deadline, a bug)
+            # must not leave the breaker waiting on it for good
+            if trial:
+                self.breaker.release_trial()
+
+    async def _edit_with_retries(self, image_bytes: bytes, prompt: str, mask_bytes: Optional[bytes]) -> bytes:
+        give_up_at = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            await self._throttle(give_up_at)
+            remaining = give_up_at - time.monotonic()
+            try:
+                result = await asyncio.wait_for(
+                    self._attempt(image_bytes, prompt, mask_bytes),
+                    timeout=max(0.0, min(remaining, self.timeout)),
+                )
+            except (asyncio.TimeoutError, *RETRYABLE_ERRORS) as e:
+                name = "AttemptTimeout" if isinstance(e, asyncio.TimeoutError) else type(e).__name__
+                self._record_error(name)
+                delay = self._backoff(attempt, e)
+                if attempt >= self.retries or time.monotonic() + delay >= give_up_at:
+                    self.failed += 1
+                    self.breaker.record_failure()
+                    if time.monotonic() >= give_up_at:
+                        raise DeadlineExceeded(
+                            f"OpenAI image edit did not finish within {self.deadline:g}s"
+                        ) from e
+                    if isinstance(e, asyncio.TimeoutError):
+                        raise DeadlineExceeded(f"OpenAI image edit timed out after {attempt + 1} attempts") from e
+                    raise
+                attempt += 1
+                self.retried += 1
+                await asyncio.sleep(delay)
+            except openai.APIStatusError as e:
+                # Client errors (400, 401, ...) are not the upstream failing:
+                # fail the call, but do not count it towards the breaker.
+                self._record_error(type(e).__name__)
+                self.failed += 1
+                self.breaker.record_success()
+                raise
+            else:
+                self.breaker.record_success()
+                return result
+
+    def _record_error(self, name: str) -> None:
+        self.errors_by_type[name] = self.errors_by_type.get(name, 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "retries": self.retried,
+            "failed": self.failed,
+            "rejected_by_breaker": self.rejected,
+            "throttled": self.throttled,
+            "throttled_seconds": round(self.throttled_seconds, 3),
+            "breaker": self.breaker.state,
+            "errors": dict(self.errors_by_type),
+        }
+
+    async def close(self) -> None:
+        await self._http.aclose()
+
+
+# Process-wide async client (lazy loading)
+_async_client = None
+
+def get_async_image_client() -> AsyncImageClient:
+    global _async_client
+    if _async_client is None:
+        if not os.getenv("OPENAI_API_KEY"):
+            raise ValueError("OPENAI_API_KEY environment variable not set")
+        _async_client = AsyncImageClient.from_env()
+    return _async_client
+
+
+def async_image_client_stats() -> Dict[str, Any]:
+    """Client stats for /health, without creating the client as a side effect."""
+    return _async_client.stats() if _async_client is not None else {}
+
+
+async def close_async_image_client() -> None:
+    global _async_client
+    if _async_client is not None:
+        await _async_client.close()
+        _async_client = None
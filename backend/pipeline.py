@@ -0,0 +1,499 @@
+"""
+Async orchestration of the /edit-image pipeline.
+
+Stages run on the worker pools from backend.workers. Masks come from the
+configured mask provider (backend.masks: the model, or local
+segmentation) and are cached per provider and region (roof, siding,
+trim), then unioned for whatever combination a request selects, so a
+mask made for {roof} is reused when the user later asks for {roof, trim};
+only the missing regions are requested. Masks are 1-bit BitMasks
+(run-length encoded in the cache); only the one sent to images.edit is
+turned into an RGBA PNG.
+
+Finished renders are cached by (image hash, products JSON, output
+encoding), so repeating an identical edit never reaches OpenAI; renders
+made on the fallback provider's masks are not cached, so one upstream
+outage does not pin a degraded render for a week. Identical
+edits arriving while the first is still rendering join it instead of
+starting their own (backend.singleflight, edit_flights). A render
+is always kept as the default JPEG too: another encoding of it is then
+transcoded from that instead of rendered again.
+
+A local render (run_local_render) skips the model altogether: the
+selected regions are repainted by backend.recolor on masks from local
+segmentation, in well under a second, as an instant preview.
+
+A batch (run_batch) renders several selections for one photo: the upload
+is prepared and every region mask fetched once, then the edits fan out
+concurrently.
+
+Uploads are prepared once per request (EXIF orientation, downscale to the
+model's working resolution, compact JPEG); model calls and masks use the
+prepared image, and the edit is composited back onto the full-resolution
+original only inside the mask. Composites and transcodes reserve their
+memory from the render memory budget first (WorkerPools.render_memory_reserved);
+an upload too large for the whole budget is rendered at a reduced scale,
+which EditResult.scale reports.
+"""
+
+import asyncio
+import os
+import time
+from typing import Any, AsyncIterator, Callable, Dict, List, NamedTuple, Optional, Tuple, Union
+
+from backend.architectural_visualizer import (
+    image_size,
+    mask_regions,
+    prepare_image,
+    PreparedImage,
+    preview_edit,
+    reduced_size,
+    render_bytes,
+    render_reduction,
+    timed_finish_edit,
+    transcode,
+)
+from backend.bitmask import BitMask
+from backend.cache import (
+    get_mask_cache,
+    get_result_cache,
+    hinted_digest,
+    image_digest,
+    mask_cache_key,
+    result_cache_key,
+)
+from backend.catalog import CATALOG
+from backend.encodings import DEFAULT_ENCODING, OutputEncoding
+from backend.logs import get_logger
+from backend.masks import create_mask_provider, FALLBACK_ERRORS, LocalMaskProvider, MaskHints, MaskProvider
+from backend.metrics import record, span
+from backend.openai_client import get_async_image_client
+from backend.recolor import render_recolor
+from backend.singleflight import Flight, SingleFlight
+from backend.workers import get_worker_pools
+
+logger = get_logger("pipeline")
+
+# Running totals for the upload preparation stage, reported on /health
+upload_stats = {
+    "requests": 0,
+    "original_bytes": 0,
+    "model_bytes": 0,
+    "model_call_seconds": 0.0,
+}
+
+# In-flight model and local renders by result cache key, reported on /health
+edit_flights = SingleFlight()
+
+
+async def call_model(
+    prompt: str, model_bytes: bytes, mask: Optional[BitMask] = None, stage: str = "model"
+) -> bytes:
+    """One gpt-image-1 edit through the pooled async client, timing the upload + model round trip as ``stage``."""
+    mask_png = None
+    if mask is not None:
+        # images.edit takes the mask as an RGBA PNG; nothing else needs one
+        with span("mask.encode"):
+            mask_png = await get_worker_pools().run_cpu(mask.to_png)
+    start = time.perf_counter()
+    try:
+        with span(stage):
+            return await get_async_image_client().edit(model_bytes, prompt, mask_png)
+    finally:
+        elapsed = time.perf_counter() - start
+        upload_stats["model_call_seconds"] += elapsed
+        sent = len(model_bytes) + (len(mask_png) if mask_png else 0)
+        logger.info("model call", extra={"sent_bytes": sent, "ms": round(elapsed * 1000)})
+
+
+async def prepare_upload(image_bytes: bytes) -> PreparedImage:
+    """prepare_image on the CPU pool, recording how much upload it saved."""
+    with span("prepare"):
+        prepared = await get_worker_pools().run_cpu(prepare_image, image_bytes)
+
+    upload_stats["requests"] += 1
+    upload_stats["original_bytes"] += prepared.original_bytes
+    upload_stats["model_bytes"] += len(prepared.model_bytes)
+    logger.debug("prepared upload", extra={
+        "original_size": prepared.original_size,
+        "original_bytes": prepared.original_bytes,
+        "model_size": prepared.model_size,
+        "model_bytes": len(prepared.model_bytes),
+    })
+    return prepared
+
+
+# Mask providers (lazy loading): the configured one and the optional fallback
+_mask_providers = None
+
+def get_mask_providers() -> Tuple[MaskProvider, Optional[MaskProvider]]:
+    global _mask_providers
+    if _mask_providers is None:
+        primary = create_mask_provider(os.getenv("VISUALIZER_MASK_PROVIDER", "openai"), call_model)
+        fallback_name = os.getenv("VISUALIZER_MASK_FALLBACK")
+        fallback = create_mask_provider(fallback_name, call_model) if fallback_name else None
+        _mask_providers = (primary, fallback)
+    return _mask_providers
+
+
+# Local renders always segment locally, whatever the configured provider
+_local_mask_providers = (LocalMaskProvider(), None)
+
+
+def provider_mask_key(provider: MaskProvider, digest: str, region: str, hints: Optional[MaskHints]) -> str:
+    """Mask cache key of ``provider``'s mask of ``region`` for image ``digest``."""
+    if provider.uses_hints:
+        digest = hinted_digest(digest, hints)
+    return mask_cache_key(digest, (region,), provider.name)
+
+
+async def region_masks(
+    prepared: PreparedImage,
+    digest: str,
+    regions: Tuple[str, ...],
+    hints: Optional[MaskHints] = None,
+    providers: Optional[Tuple[MaskProvider, Optional[MaskProvider]]] = None,
+) -> Tuple[Dict[str, BitMask], bool]:
+    """
+    Mask (at the prepared model size) per region, from the cache or the
+    mask provider; missing regions are produced in one provider call.
+    ``digest`` is the image_digest of the upload; only a provider that
+    uses ``hints`` keys its masks by the hinted digest, so hints never cost
+    a model call for masks already cached. ``providers`` (provider,
+    fallback) overrides the configured ones. Also returns whether the
+    fallback provider had to make any of them.
+    """
+    pools = get_worker_pools()
+    mask_cache = get_mask_cache()
+    provider, fallback = providers or get_mask_providers()
+
+    with span("mask.cache"):
+        cached = await asyncio.gather(*(
+            pools.run_io(mask_cache.get, provider_mask_key(provider, digest, region, hints))
+            for region in regions
+        ))
+    masks = {region: BitMask.load(data) for region, data in zip(regions, cached) if data is not None}
+    if masks:
+        logger.debug("mask cache hit", extra={"regions": list(masks), "provider": provider.name})
+
+    missing = tuple(region for region in regions if region not in masks)
+    if not missing:
+        return masks, False
+
+    fell_back = False
+    try:
+        with span("mask"):
+            fresh = await provider.region_masks(prepared, missing, hints)
+    except FALLBACK_ERRORS as e:
+        if fallback is None:
+            raise
+        logger.warning(
+            "mask provider failed, falling back",
+            extra={"provider": provider.name, "fallback": fallback.name, "error": str(e)},
+        )
+        provider = fallback
+        fell_back = True
+        with span("mask"):
+            fresh = await fallback.region_masks(prepared, missing, hints)
+
+    for region, mask in fresh.items():
+        await pools.run_io(mask_cache.put, provider_mask_key(provider, digest, region, hints), mask.to_bytes())
+    masks.update(fresh)
+    return masks, fell_back
+
+
+async def build_mask(
+    prepared: PreparedImage,
+    digest: str,
+    regions: Tuple[str, ...],
+    hints: Optional[MaskHints] = None,
+) -> Tuple[BitMask, bool]:
+    """Union of the per-region masks for ``regions``, and whether the fallback provider made any."""
+    masks, fell_back = await region_masks(prepared, digest, regions, hints)
+    with span("mask.union"):
+        return BitMask.union(masks[region] for region in regions), fell_back
+
+
+# Called with each stage name ("mask", "edit", "composite") as it starts
+ProgressCallback = Callable[[str], None]
+
+
+def _no_progress(stage: str) -> None:
+    pass
+
+
+# Called with a low-resolution JPEG of the result before the full composite
+PreviewCallback = Callable[[bytes], None]
+
+
+class EditResult(NamedTuple):
+    image: bytes
+    # Made on the fallback provider's masks: not cached, and not to be
+    # given the ETag of the normal render
+    fell_back: bool = False
+    # The render is 1/scale of the upload's width and height (memory budget)
+    scale: int = 1
+
+
+def render_scale(image_bytes: bytes, output: bytes) -> int:
+    """Factor ``output`` was rendered down from the upload ``image_bytes`` by (1: full resolution)."""
+    # Longest sides, which EXIF orientation does not change
+    return max(1, round(max(image_size(image_bytes)) / max(image_size(output))))
+
+
+async def run_edit(
+    image_bytes: bytes,
+    products_json: Dict[str, Any],
+    digest: Optional[str] = None,
+    progress: Optional[ProgressCallback] = None,
+    hints: Optional[MaskHints] = None,
+    encoding: OutputEncoding = DEFAULT_ENCODING,
+    preview: Optional[PreviewCallback] = None,
+) -> EditResult:
+    """
+    Full edit of ``image_bytes`` for a validated selection; returns the
+    render in ``encoding``.
+
+    ``digest`` is the image_digest of ``image_bytes`` when the caller
+    already computed it (e.g. for an ETag); renders are cached under its
+    hinted_digest with ``hints``, masks as region_masks says. ``progress`` is told
+    about each stage; ``hints`` are passed to the mask provider. ``preview``
+    gets a low-resolution composite as soon as the model's edit arrives
+    (not for results served from the cache, nor when joining an identical
+    edit that started without anyone asking for one). A render reduced to
+    fit the memory budget comes back with its ``scale``.
+    """
+    progress = progress or _no_progress
+    pools = get_worker_pools()
+    if digest is None:
+        digest = await pools.run_io(image_digest, image_bytes)
+
+    result_cache = get_result_cache()
+    result_key = result_cache_key(hinted_digest(digest, hints), products_json, encoding.cache_suffix)
+    with span("result.cache"):
+        cached = await pools.run_io(result_cache.get, result_key)
+    if cached is not None:
+        logger.info("result cache hit", extra={"encoding": encoding.cache_suffix or "default"})
+        return EditResult(cached, scale=render_scale(image_bytes, cached))
+
+    if encoding != DEFAULT_ENCODING:
+        rendered = await pools.run_io(result_cache.get, result_cache_key(hinted_digest(digest, hints), products_json))
+        if rendered is not None:
+            size = image_size(rendered)
+            factor = render_reduction(size, (encoding.pil_args,))
+            async with pools.render_memory_reserved(render_bytes(reduced_size(size, factor), (encoding.pil_args,))):
+                with span("transcode"):
+                    output = await pools.run_cpu(transcode, rendered, *encoding.pil_args)
+            await pools.run_io(result_cache.put, result_key, output)
+            return EditResult(output, scale=render_scale(image_bytes, output))
+
+    return await edit_flights.run(
+        result_key,
+        lambda flight: _render_edit(image_bytes, products_json, digest, hints, encoding, flight),
+        progress=progress,
+        preview=preview,
+    )
+
+
+async def _render_edit(
+    image_bytes: bytes,
+    products_json: Dict[str, Any],
+    digest: str,
+    hints: Optional[MaskHints],
+    encoding: OutputEncoding,
+    flight: Flight,
+) -> EditResult:
+    """The uncached part of run_edit, run once for every caller of ``flight``."""
+    pools = get_worker_pools()
+    async with pools.slot():
+        prepared = await prepare_upload(image_bytes)
+
+        flight.progress("mask")
+        mask, fell_back = await build_mask(prepared, digest, mask_regions(products_json), hints)
+
+        outputs = await render_with_mask(
+            image_bytes, prepared, products_json, mask, flight.progress, encoding,
+            flight.preview if flight.wants_preview else None,
+        )
+
+    if fell_back:
+        logger.warning("render used fallback masks; not cached")
+    else:
+        result_cache = get_result_cache()
+        for enc, output in outputs.items():
+            await pools.run_io(
+                result_cache.put, result_cache_key(hinted_digest(digest, hints), products_json, enc.cache_suffix), output
+            )
+    output = outputs[encoding]
+    return EditResult(output, fell_back, render_scale(image_bytes, output))
+
+
+def local_cache_suffix(encoding: OutputEncoding) -> str:
+    """Result cache key suffix of a local render, which never shares a key with a model render."""
+    return f"local-{encoding.format}-{encoding.quality}"
+
+
+async def run_local_render(
+    image_bytes: bytes,
+    products_json: Dict[str, Any],
+    digest: Optional[str] = None,
+    hints: Optional[MaskHints] = None,
+    encoding: OutputEncoding = DEFAULT_ENCODING,
+) -> bytes:
+    """
+    Instant preview of a validated selection: the regions are recoloured
+    locally (no model call) on locally segmented masks, at up to
+    LOCAL_RENDER_SIDE pixels. Cached apart from the model renders;
+    ``digest`` as for run_edit.
+    """
+    pools = get_worker_pools()
+    if digest is None:
+        digest = await pools.run_io(image_digest, image_bytes)
+
+    result_cache = get_result_cache()
+    result_key = result_cache_key(hinted_digest(digest, hints), products_json, local_cache_suffix(encoding))
+    with span("result.cache"):
+        cached = await pools.run_io(result_cache.get, result_key)
+    if cached is not None:
+        return cached
+
+    async def render(flight: Flight) -> bytes:
+        async with pools.slot():
+            prepared = await prepare_upload(image_bytes)
+            regions = mask_regions(products_json)
+            masks, _ = await region_masks(prepared, digest, regions, hints, providers=_local_mask_providers)
+            layers = [(masks[region], products_json[region]) for region in regions]
+            with span("recolor"):
+                output, timings = await pools.run_cpu(render_recolor, image_bytes, layers, encoding.pil_args)
+        for step, seconds in timings.items():
+            record(f"recolor.{step}", seconds)
+
+        await pools.run_io(result_cache.put, result_key, output)
+        return output
+
+    return await edit_flights.run(result_key, render)
+
+
+async def render_with_mask(
+    image_bytes: bytes,
+    prepared: PreparedImage,
+    products_json: Dict[str, Any],
+    mask: BitMask,
+    progress: ProgressCallback = _no_progress,
+    encoding: OutputEncoding = DEFAULT_ENCODING,
+    preview: Optional[PreviewCallback] = None,
+) -> Dict[OutputEncoding, bytes]:
+    """
+    The edit call and full-resolution composite, once the mask is known.
+    The composite is encoded as the default JPEG and, if different, as
+    ``encoding``. With ``preview``, a model-resolution composite is made
+    alongside the full one and handed over as soon as it is ready.
+    """
+    progress("edit")
+    edited = await call_model(
+        CATALOG.edit_prompt(products_json), prepared.model_bytes, mask, stage="edit.model"
+    )
+
+    progress("composite")
+    pools = get_worker_pools()
+    encodings = tuple(dict.fromkeys((DEFAULT_ENCODING, encoding)))
+    pil_encodings = tuple(enc.pil_args for enc in encodings)
+    factor = render_reduction(prepared.original_size, pil_encodings)
+    if factor > 1:
+        logger.warning("upload too large for the render memory budget; rendering at reduced scale", extra={
+            "original_size": prepared.original_size, "scale": f"1/{factor}",
+        })
+    async with pools.render_memory_reserved(
+        render_bytes(reduced_size(prepared.original_size, factor), pil_encodings)
+    ):
+        with span("composite"):
+            full = asyncio.ensure_future(pools.run_cpu(
+                timed_finish_edit, image_bytes, edited, mask, pil_encodings
+            ))
+            try:
+                if preview is not None:
+                    try:
+                        with span("preview"):
+                            preview(await pools.run_cpu(preview_edit, prepared.model_bytes, edited, mask))
+                    except Exception as e:
+                        # Only a courtesy: the full result is still on its way
+                        logger.warning("preview failed", extra={"error": str(e)})
+                outputs, timings = await full
+            finally:
+                full.cancel()
+    for step, seconds in timings.items():
+        record(f"composite.{step}", seconds)
+    return dict(zip(encodings, outputs))
+
+
+# A batch result: the rendered JPEG, or the exception that variant failed with
+BatchResult = Tuple[int, Union[bytes, Exception]]
+
+
+async def run_batch(
+    image_bytes: bytes,
+    products_list: List[Dict[str, Any]],
+    concurrency: int,
+    digest: Optional[str] = None,
+    hints: Optional[MaskHints] = None,
+) -> AsyncIterator[BatchResult]:
+    """
+    Render every selection in ``products_list`` for one photo, yielding
+    (index, result) pairs in completion order.
+
+    Cached renders are yielded first. For the rest, the upload is prepared
+    and each needed region mask fetched once, then at most ``concurrency``
+    edits run at a time, each holding a pipeline slot. A failing variant
+    yields its exception instead of aborting the batch. ``digest`` as for
+    run_edit.
+    """
+    pools = get_worker_pools()
+    result_cache = get_result_cache()
+    if digest is None:
+        digest = await pools.run_io(image_digest, image_bytes)
+    result_digest = hinted_digest(digest, hints)
+
+    pending: List[int] = []
+    for index, products_json in enumerate(products_list):
+        cached = await pools.run_io(result_cache.get, result_cache_key(result_digest, products_json))
+        if cached is not None:
+            yield index, cached
+        else:
+            pending.append(index)
+    if not pending:
+        return
+
+    # Shared stages: one prepared upload, one fetch per region
+    try:
+        async with pools.slot():
+            prepared = await prepare_upload(image_bytes)
+            regions = tuple(sorted({r for i in pending for r in mask_regions(products_list[i])}))
+            region_bits, fell_back = await region_masks(prepared, digest, regions, hints)
+    except Exception as e:
+        for index in pending:
+            yield index, e
+        return
+
+    limit = asyncio.Semaphore(concurrency)
+
+    async def render(index: int) -> BatchResult:
+        products_json = products_list[index]
+        try:
+            async with limit, pools.slot():
+                with span("mask.union"):
+                    mask = BitMask.union(region_bits[r] for r in mask_regions(products_json))
+                outputs = await render_with_mask(image_bytes, prepared, products_json, mask)
+            output = outputs[DEFAULT_ENCODING]
+            if not fell_back:
+                await pools.run_io(result_cache.put, result_cache_key(result_digest, products_json), output)
+            return index, output
+        except Exception as e:
+            return index, e
+
+    tasks = [asyncio.ensure_future(render(index)) for index in pending]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,373 @@
+"""
+Local recolouring of masked regions: an instant, deterministic preview of
+a product without a model call.
+
+For each selected product, the pixels inside its region mask are repainted
+in the product's colour while keeping the photo's shading:
+
+1. the catalog colour phrase ("dark green", "light golden oak honey wood
+   tone") is mapped to a colour in OKLab, a perceptual colour space, from
+   a small palette plus "dark"/"light" modifiers
+2. per pixel, perceptual lightness is taken from the photo (OKLab L of its
+   luminance), normalised by the region's mean and scaled onto the target
+   lightness, so shadows, highlights and texture in the photo survive; the
+   finish (matte, satin, gloss) sets how much of that contrast is kept
+3. a procedural surface pattern derived from the texture / look phrases
+   (ribs, standing seams, board and batten, wood grain) modulates the
+   lightness
+4. the result is converted back to sRGB and blended into the photo through
+   the feathered mask
+
+Everything is vectorised NumPy over the pixels the mask touches; the random
+parts (wood grain) are seeded by product id, so a render is reproducible.
+The model edit remains the high quality render; this is the preview.
+
+Configuration (environment variables):
+    VISUALIZER_LOCAL_RENDER_SIDE   long side, in pixels, of local renders;
+                                   larger uploads are downscaled (default 1600)
+"""
+
+import math
+import os
+import re
+import time
+from io import BytesIO
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageFilter, ImageOps
+
+from backend.architectural_visualizer import encode_image, EncodeArgs, MASK_FEATHER_RADIUS
+from backend.bitmask import BitMask
+
+# =============================================================================
+# COLOUR
+# =============================================================================
+
+# sRGB colours of the words used in the catalog, with their weight when
+# several appear in one phrase ("dark brown woodgrain with reddish undertone")
+PALETTE: Dict[str, Tuple[Tuple[int, int, int], float]] = {
+    "charcoal black": ((43, 44, 46), 1.0),
+    "charcoal": ((54, 56, 59), 1.0),
+    "black": ((30, 30, 32), 1.0),
+    "maroon brick red": ((110, 38, 34), 1.0),
+    "brick red": ((123, 45, 38), 1.0),
+    "maroon": ((107, 33, 37), 1.0),
+    "rust red": ((139, 58, 36), 1.0),
+    "red": ((155, 45, 39), 1.0),
+    "reddish": ((138, 59, 46), 0.3),
+    "green": ((52, 98, 64), 1.0),
+    "grey": ((154, 157, 160), 1.0),
+    "gray": ((154, 157, 160), 1.0),
+    "silver": ((184, 187, 191), 1.0),
+    "white": ((238, 238, 234), 1.0),
+    "golden oak": ((176, 122, 62), 1.0),
+    "honey": ((192, 138, 69), 1.0),
+    "oak": ((168, 122, 72), 1.0),
+    "brown": ((96, 62, 42), 1.0),
+    "tan": ((190, 160, 120), 1.0),
+    "blue": ((52, 82, 128), 1.0),
+}
+
+# OKLab lightness change for the modifiers
+DARK_SHIFT = -0.12
+LIGHT_SHIFT = 0.10
+
+
+class UnknownColour(ValueError):
+    """A colour phrase with no palette word in it."""
+
+
+def srgb_to_linear(c: np.ndarray) -> np.ndarray:
+    return np.where(c <= 0.04045, c / 12.92, ((c + 0.055) / 1.055) ** 2.4)
+
+
+def _linear_to_srgb_lut(size: int = 4096) -> np.ndarray:
+    x = np.linspace(0, 1, size)
+    srgb = np.where(x <= 0.0031308, 12.92 * x, 1.055 * x ** (1 / 2.4) - 0.055)
+    return np.round(srgb * 255).astype(np.uint8)
+
+
+# Linear light -> 8-bit sRGB by table lookup (a pow per pixel is the slow part)
+_LINEAR_TO_SRGB = _linear_to_srgb_lut()
+
+# Linear 8-bit sRGB -> linear light
+_SRGB_TO_LINEAR = srgb_to_linear(np.arange(256) / 255.0).astype(np.float32)
+
+_RGB_TO_LMS = np.array([
+    [0.4122214708, 0.5363325363, 0.0514459929],
+    [0.2119034982, 0.6806995451, 0.1073969566],
+    [0.0883024619, 0.2817188376, 0.6299787005],
+])
+_LMS_TO_LAB = np.array([
+    [0.2104542553, 0.7936177850, -0.0040720468],
+    [1.9779984951, -2.4285922050, 0.4505937099],
+    [0.0259040371, 0.7827717662, -0.8086757660],
+])
+_LAB_TO_LMS = np.linalg.inv(_LMS_TO_LAB)
+_LMS_TO_RGB = np.linalg.inv(_RGB_TO_LMS)
+
+# Rec. 709 luminance contribution of each 8-bit sRGB channel value
+_LUMA_R, _LUMA_G, _LUMA_B = (w * _SRGB_TO_LINEAR for w in np.array([0.2126, 0.7152, 0.0722], dtype=np.float32))
+
+
+def rgb_to_oklab(rgb: Tuple[int, int, int]) -> np.ndarray:
+    linear = srgb_to_linear(np.asarray(rgb, dtype=np.float64) / 255.0)
+    return _LMS_TO_LAB @ np.cbrt(_RGB_TO_LMS @ linear)
+
+
+def colour_for(phrase: str) -> np.ndarray:
+    """OKLab colour of a catalog colour phrase, e.g. "dark charcoal black"."""
+    text = " " + " ".join(re.findall(r"[a-z]+", phrase.lower())) + " "
+    total, weights = np.zeros(3), 0.0
+    # Longest names first, each match consumed so "brick red" is not also "red"
+    for name in sorted(PALETTE, key=len, reverse=True):
+        token = f" {name} "
+        while token in text:
+            rgb, weight = PALETTE[name]
+            total += weight * rgb_to_oklab(rgb)
+            weights += weight
+            text = text.replace(token, " ", 1)
+    if not weights:
+        raise UnknownColour(f"no known colour in {phrase!r}")
+    lab = total / weights
+    if " dark " in f" {phrase.lower()} ":
+        lab[0] += DARK_SHIFT
+    if " light " in f" {phrase.lower()} ":
+        lab[0] += LIGHT_SHIFT
+    lab[0] = float(np.clip(lab[0], 0.05, 0.97))
+    return lab
+
+
+# =============================================================================
+# SURFACE PATTERNS
+# =============================================================================
+
+# Fraction of the photo's lightness contrast kept, by finish keyword
+FINISH_CONTRAST = (("gloss", 1.1), ("satin", 0.95), ("sheen", 0.95), ("matte", 0.8))
+DEFAULT_CONTRAST = 0.9
+
+# Pattern periods as a fraction of the image width
+RIB_PERIOD = 1 / 60
+SEAM_PERIOD = 1 / 30
+BATTEN_PERIOD = 1 / 40
+GRAIN_PERIOD = 1 / 350
+
+
+class Surface:
+    """Finish and procedural patterns (name -> amplitude) of one product."""
+
+    def __init__(self, contrast: float, patterns: Dict[str, float]):
+        self.contrast = contrast
+        self.patterns = patterns
+
+    @classmethod
+    def from_attributes(cls, attributes: Dict[str, Any]) -> "Surface":
+        finish = (attributes.get("finish") or "").lower()
+        contrast = next((c for word, c in FINISH_CONTRAST if word in finish), DEFAULT_CONTRAST)
+
+        text = " ".join(str(attributes.get(k) or "") for k in ("texture", "pattern_or_look")).lower()
+        strength = 1.5 if ("deep" in text or "detailed" in text) else 0.5 if "subtle" in text else 1.0
+        patterns = {}
+        if "batten" in text:
+            patterns["batten"] = 0.12
+        if "seam" in text:
+            patterns["seam"] = 0.10
+        elif "rib" in text:
+            patterns["rib"] = 0.10 * strength
+        if "grain" in text or "wood" in text:
+            # "subtle grain" on board and batten should stay subtle
+            patterns["grain"] = 0.07 * strength
+        return cls(contrast, patterns)
+
+
+def _phase(x: np.ndarray, period: float) -> np.ndarray:
+    return (x % period) / period
+
+
+def _rib(phase: np.ndarray) -> np.ndarray:
+    # Lit leading flank, flat crown, shaded trailing flank
+    return (np.where(phase < 0.04, 1.0, 0.0) + np.where((phase >= 0.04) & (phase < 0.10), 0.3, 0.0)
+            - np.where((phase >= 0.10) & (phase < 0.14), 1.0, 0.0))
+
+
+def _seam(phase: np.ndarray) -> np.ndarray:
+    return np.where(phase < 0.015, 1.0, 0.0) - np.where((phase >= 0.015) & (phase < 0.035), 1.0, 0.0)
+
+
+def _batten(phase: np.ndarray) -> np.ndarray:
+    # A raised strip casting a shadow on the board next to it
+    return np.where(phase < 0.12, 0.4, 0.0) - np.where((phase >= 0.12) & (phase < 0.16), 1.0, 0.0)
+
+
+def _smooth_noise(shape: Tuple[int, int], cells: Tuple[int, int], rng: np.random.Generator) -> np.ndarray:
+    """Value noise in -1..1: a small random grid upscaled bicubically to ``shape`` (h, w)."""
+    grid = rng.uniform(-1, 1, size=(cells[1], cells[0])).astype(np.float32)
+    return np.asarray(Image.fromarray(grid, mode="F").resize((shape[1], shape[0]), Image.BICUBIC))
+
+
+def _grain(x: np.ndarray, pixels: np.ndarray, shape: Tuple[int, int], period: float,
+           rng: np.random.Generator) -> np.ndarray:
+    # Vertical grain lines, bent by low-frequency noise along the boards
+    warp = _smooth_noise(shape, (max(2, shape[1] // 200), max(2, shape[0] // 60)), rng).ravel()[pixels]
+    lines = np.sin(2 * np.pi * (x / period + 2.5 * warp))
+    streaks = _smooth_noise(shape, (max(2, shape[1] // 8), max(2, shape[0] // 200)), rng).ravel()[pixels]
+    return 0.7 * lines * (0.6 + 0.4 * streaks) + 0.3 * streaks
+
+
+def pattern_field(surface: Surface, box: Tuple[int, int, int, int], image_width: int,
+                  seed: int, pixels: np.ndarray) -> Optional[np.ndarray]:
+    """
+    Lightness modulation (around 0) of ``surface`` at ``pixels``, flat
+    indices into ``box`` (x0, y0, x1, y1).
+    """
+    if not surface.patterns:
+        return None
+    x0, y0, x1, y1 = box
+    shape = (y1 - y0, x1 - x0)
+    x = (pixels % shape[1] + x0).astype(np.float32)
+    field = np.zeros(len(pixels), dtype=np.float32)
+    for name, amplitude in surface.patterns.items():
+        if name == "rib":
+            field += amplitude * _rib(_phase(x, max(6.0, image_width * RIB_PERIOD)))
+        elif name == "seam":
+            field += amplitude * _seam(_phase(x, max(8.0, image_width * SEAM_PERIOD)))
+        elif name == "batten":
+            field += amplitude * _batten(_phase(x, max(8.0, image_width * BATTEN_PERIOD)))
+        elif name == "grain":
+            rng = np.random.default_rng(seed)
+            field += amplitude * _grain(x, pixels, shape, max(2.0, image_width * GRAIN_PERIOD), rng)
+    return field
+
+
+# =============================================================================
+# RECOLOURING
+# =============================================================================
+
+# Limits of the photo's relative lightness, so specular spots or deep
+# shadows do not blow out on a much darker or lighter target
+SHADING_RANGE = (0.3, 2.2)
+
+
+def _mask_alpha(mask: BitMask, size: Tuple[int, int]) -> Tuple[Optional[Image.Image], Tuple[int, int, int, int]]:
+    """
+    Feathered alpha of ``mask`` scaled to image ``size``, cut to the box
+    (x0, y0, x1, y1) it covers there; (None, ...) for an empty mask.
+    """
+    alpha = mask.to_alpha().filter(ImageFilter.GaussianBlur(MASK_FEATHER_RADIUS))
+    bbox = alpha.getbbox()
+    if bbox is None:
+        return None, (0, 0, 0, 0)
+    # Only the part of the mask that has pixels is upscaled
+    sx, sy = size[0] / alpha.width, size[1] / alpha.height
+    x0, y0 = math.floor(bbox[0] * sx), math.floor(bbox[1] * sy)
+    x1, y1 = min(size[0], math.ceil(bbox[2] * sx)), min(size[1], math.ceil(bbox[3] * sy))
+    source = (x0 / sx, y0 / sy, x1 / sx, y1 / sy)
+    return alpha.resize((x1 - x0, y1 - y0), Image.BILINEAR, box=source), (x0, y0, x1, y1)
+
+
+def recolor_region(img: Image.Image, mask: BitMask, colour: np.ndarray, surface: Surface,
+                   seed: int = 0) -> Image.Image:
+    """Repaint the pixels of ``img`` inside ``mask`` in OKLab ``colour`` (in place)."""
+    alpha_patch, box = _mask_alpha(mask, img.size)
+    if alpha_patch is None:
+        return img
+
+    # Only the pixels the mask touches are computed (flat indices into the box)
+    patch = np.array(img.crop(box))
+    weight = np.asarray(alpha_patch).ravel()
+    pixels = np.flatnonzero(weight)
+    rgb = patch.reshape(-1, 3)[pixels]
+    weight = weight[pixels].astype(np.float32)
+
+    # Perceptual lightness of the photo (OKLab L of a grey of the same luminance)
+    luminance = _LUMA_R[rgb[:, 0]] + _LUMA_G[rgb[:, 1]] + _LUMA_B[rgb[:, 2]]
+    lightness = np.cbrt(luminance)
+    mean = float(np.dot(lightness, weight) / max(weight.sum(), 1e-6))
+    shading = np.clip(lightness / np.float32(max(mean, 1e-3)), *SHADING_RANGE)
+    if surface.contrast != 1.0:
+        shading **= np.float32(surface.contrast)
+
+    target_l = shading
+    target_l *= np.float32(colour[0])
+    field = pattern_field(surface, box, img.width, seed, pixels)
+    if field is not None:
+        target_l *= 1.0 + field
+    np.clip(target_l, 0.0, 1.0, out=target_l)
+
+    # OKLab -> linear sRGB, a channel at a time (a and b are constant over
+    # the region, so each cone response is a cubed affine function of L)
+    lms_offset = _LAB_TO_LMS[:, 1:] @ colour[1:]
+    cones = []
+    for row, offset in zip(_LAB_TO_LMS[:, 0], lms_offset):
+        cone = target_l * np.float32(row)
+        cone += np.float32(offset)
+        cones.append(cone * cone * cone)
+    top = len(_LINEAR_TO_SRGB) - 1
+    painted = patch.reshape(-1, 3)
+    for channel, weights in enumerate(_LMS_TO_RGB * top):
+        linear = cones[0] * np.float32(weights[0])
+        linear += cones[1] * np.float32(weights[1])
+        linear += cones[2] * np.float32(weights[2])
+        np.clip(linear, 0, top, out=linear)
+        painted[pixels, channel] = _LINEAR_TO_SRGB[linear.astype(np.uint16)]
+
+    img.paste(Image.fromarray(patch), box[:2], alpha_patch)
+    return img
+
+
+def recolor_layer_args(entry: Dict[str, Any]) -> Tuple[np.ndarray, Surface, int]:
+    """(OKLab colour, surface, seed) for a products-JSON entry."""
+    attributes = entry["attributes"]
+    return colour_for(attributes["color"]), Surface.from_attributes(attributes), int(entry.get("product_id") or 0)
+
+
+def recolor(img: Image.Image, layers: List[Tuple[BitMask, Dict[str, Any]]]) -> Image.Image:
+    """Apply each (mask, products-JSON entry) layer to ``img`` in order (in place)."""
+    for mask, entry in layers:
+        colour, surface, seed = recolor_layer_args(entry)
+        recolor_region(img, mask, colour, surface, seed)
+    return img
+
+
+# A preview does not need every pixel of a 24 MP photo
+LOCAL_RENDER_SIDE = int(os.getenv("VISUALIZER_LOCAL_RENDER_SIDE", "1600"))
+
+
+def load_scaled(image_bytes: bytes, max_side: int = LOCAL_RENDER_SIDE) -> Image.Image:
+    """Decode the upload upright and in RGB with its long side at most ``max_side``."""
+    img = Image.open(BytesIO(image_bytes))
+    # draft keeps both sides at least the requested size: ask for the
+    # scaled-down shape, not a max_side square
+    scale = min(1.0, max_side / max(img.size))
+    img.draft("RGB", (math.ceil(img.width * scale), math.ceil(img.height * scale)))
+    img = ImageOps.exif_transpose(img)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    if max(img.size) > max_side:
+        img.thumbnail((max_side, max_side), Image.BICUBIC)
+    return img
+
+
+def render_recolor(
+    image_bytes: bytes,
+    layers: List[Tuple[BitMask, Dict[str, Any]]],
+    encoding: EncodeArgs,
+    max_side: int = LOCAL_RENDER_SIDE,
+) -> Tuple[bytes, Dict[str, float]]:
+    """
+    recolor the (downscaled) upload and encode it, plus the seconds spent
+    decoding, painting and encoding.
+    """
+    start = time.perf_counter()
+    img = load_scaled(image_bytes, max_side)
+    decoded = time.perf_counter()
+    recolor(img, layers)
+    painted = time.perf_counter()
+    output = encode_image(img, *encoding)
+    encoded = time.perf_counter()
+    return output, {
+        "decode": decoded - start,
+        "paint": painted - decoded,
+        "encode": encoded - painted,
+    }
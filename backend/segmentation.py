@@ -0,0 +1,257 @@
+"""
+Classical segmentation of house photos into roof, siding and trim masks.
+
+Runs with NumPy and Pillow only (no model, no network) and is
+deterministic, so it is both a cheap stand-in for the model's
+segmentation masks and a fallback when OpenAI is unavailable.
+
+On a small working copy of the image:
+
+1. pixels are clustered (k-means) on colour (YCbCr, chroma weighted up)
+   plus position, so clusters follow surfaces rather than single colours
+2. sky is the bright / blue clusters connected to the top border, ground
+   the clusters connected to the bottom border that sit low in the frame,
+   and vegetation any strongly green pixel
+3. what remains is the building; per column, its clusters are split by
+   how high they sit within the building's vertical extent: upper
+   clusters are roof, lower ones siding
+4. trim is a thin band along the roof outline (eaves, rakes, ridge)
+
+Optional hints (user scribbles) are points per region in 0..1 image
+coordinates. From each point, similar-coloured pixels are grown up to the
+nearest edge, and that surface is forced into the region.
+
+The masks are cleaned with small morphological filters, upscaled to the
+input size and returned as BitMasks, like the other mask providers.
+"""
+
+from io import BytesIO
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+from backend.bitmask import BitMask
+
+# Long side of the working copy the clustering runs on
+WORK_SIDE = 192
+CLUSTERS = 10
+KMEANS_ITERATIONS = 10
+
+# Feature weights: chroma separates materials better than brightness;
+# position keeps clusters spatially coherent
+LUMA_WEIGHT = 1.0
+CHROMA_WEIGHT = 2.0
+ROW_WEIGHT = 0.6
+COLUMN_WEIGHT = 0.2
+
+# Largest per-channel YCbCr difference for two clusters to count as the
+# same surface (sky split by the position features, for example)
+SIMILAR_COLOUR = 0.05
+
+# Building clusters whose mean relative height is above this are roof
+ROOF_SPLIT = 0.42
+
+# Narrowest blob (working pixels) kept as part of the building
+MIN_BUILDING_WIDTH = 9
+
+# Hint region growing: largest per-channel YCbCr step from the hinted
+# colour, and the FIND_EDGES response that stops growth
+HINT_COLOUR = 0.05
+HINT_EDGE = 30
+
+# Trim band thickness, as a fraction of the working image height
+TRIM_FRACTION = 0.012
+
+Hints = Dict[str, List[Tuple[float, float]]]
+
+
+def _working_image(image_bytes: bytes) -> Tuple[Image.Image, Tuple[int, int]]:
+    img = Image.open(BytesIO(image_bytes))
+    size = img.size
+    img.draft("RGB", (WORK_SIDE, WORK_SIDE))
+    img = img.convert("RGB")
+    img.thumbnail((WORK_SIDE, WORK_SIDE), Image.BILINEAR)
+    # Flatten texture (shingle lines, siding grooves) before clustering
+    return img.filter(ImageFilter.MedianFilter(5)), size
+
+
+def _features(img: Image.Image) -> np.ndarray:
+    ycc = np.asarray(img.convert("YCbCr"), dtype=np.float32) / 255.0
+    height, width = ycc.shape[:2]
+    rows, cols = np.mgrid[0:height, 0:width].astype(np.float32)
+    return np.stack([
+        ycc[..., 0] * LUMA_WEIGHT,
+        ycc[..., 1] * CHROMA_WEIGHT,
+        ycc[..., 2] * CHROMA_WEIGHT,
+        rows / height * ROW_WEIGHT,
+        cols / width * COLUMN_WEIGHT,
+    ], axis=-1).reshape(-1, 5)
+
+
+def kmeans(points: np.ndarray, k: int, iterations: int) -> np.ndarray:
+    """Cluster label per point; deterministic (farthest-point initialisation)."""
+    centers = [points.mean(axis=0)]
+    for _ in range(1, k):
+        distances = np.min([((points - c) ** 2).sum(axis=1) for c in centers], axis=0)
+        centers.append(points[int(distances.argmax())])
+    centers = np.array(centers)
+
+    for _ in range(iterations):
+        distances = ((points[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+        labels = distances.argmin(axis=1)
+        for i in range(k):
+            members = points[labels == i]
+            if len(members):
+                centers[i] = members.mean(axis=0)
+    return labels
+
+
+def _filter(mask: np.ndarray, image_filter: ImageFilter.Filter) -> np.ndarray:
+    band = Image.fromarray(mask.astype(np.uint8) * 255)
+    return np.asarray(band.filter(image_filter)) > 127
+
+
+def dilate(mask: np.ndarray, size: int = 3) -> np.ndarray:
+    return _filter(mask, ImageFilter.MaxFilter(size))
+
+
+def erode(mask: np.ndarray, size: int = 3) -> np.ndarray:
+    return _filter(mask, ImageFilter.MinFilter(size))
+
+
+def clean(mask: np.ndarray, size: int = 3) -> np.ndarray:
+    """Morphological open then close: drop specks, fill pinholes."""
+    return erode(dilate(dilate(erode(mask, size), size), size), size)
+
+
+def connected_to(candidates: np.ndarray, seed: np.ndarray) -> np.ndarray:
+    """Pixels of ``candidates`` 8-connected to ``seed`` (grown by repeated dilation)."""
+    reached = candidates & seed
+    while True:
+        grown = dilate(reached) & candidates
+        if (grown == reached).all():
+            return reached
+        reached = grown
+
+
+def _hint_masks(img: Image.Image, hints: Optional[Hints]) -> Dict[str, np.ndarray]:
+    """
+    Per hinted region, the pixels grown from its points: connected, within
+    HINT_COLOUR of the colour under the point, and not crossing an edge.
+    """
+    width, height = img.size
+    ycc = np.asarray(img.convert("YCbCr"), dtype=np.float32) / 255.0
+    edges = np.asarray(img.convert("L").filter(ImageFilter.FIND_EDGES)) > HINT_EDGE
+
+    grown: Dict[str, np.ndarray] = {}
+    for region, points in (hints or {}).items():
+        for x, y in points:
+            row = min(height - 1, max(0, int(y * height)))
+            col = min(width - 1, max(0, int(x * width)))
+            similar = (np.abs(ycc - ycc[row, col]).max(axis=2) < HINT_COLOUR) & ~edges
+            seed = np.zeros_like(similar)
+            seed[row, col] = True
+            similar[row, col] = True
+            mask = connected_to(similar, seed)
+            grown[region] = grown[region] | mask if region in grown else mask
+    return grown
+
+
+def _relative_height(building: np.ndarray) -> np.ndarray:
+    """Per building pixel, 0 at the building's top in its column and 1 at its bottom."""
+    height = building.shape[0]
+    rows = np.arange(height, dtype=np.float32)[:, None]
+    has_building = building.any(axis=0)
+    top = np.where(has_building, building.argmax(axis=0), 0)
+    bottom = np.where(has_building, height - 1 - building[::-1].argmax(axis=0), 0)
+    extent = np.maximum(bottom - top, 1).astype(np.float32)
+    return (rows - top) / extent
+
+
+def _building(img: Image.Image, labels: np.ndarray) -> np.ndarray:
+    """Boolean mask of everything that is not sky, ground or vegetation."""
+    height = labels.shape[0]
+    ycc = np.asarray(img.convert("YCbCr"), dtype=np.float32) / 255.0
+    rgb = np.asarray(img, dtype=np.float32) / 255.0
+
+    top_rows = np.zeros_like(labels, dtype=bool)
+    top_rows[0] = True
+    bottom_rows = np.zeros_like(labels, dtype=bool)
+    bottom_rows[-1] = True
+    row_fraction = np.broadcast_to(
+        np.arange(height, dtype=np.float32)[:, None] / height, labels.shape
+    )
+
+    present = [i for i in range(labels.max() + 1) if (labels == i).any()]
+    colour = {i: ycc[labels == i].mean(axis=0) for i in present}
+    mean_row = {i: row_fraction[labels == i].mean() for i in present}
+
+    def similar(i: int, seeds: List[int]) -> bool:
+        return any(np.abs(colour[i] - colour[j]).max() < SIMILAR_COLOUR for j in seeds)
+
+    # Sky seeds: bright or blue clusters along the top border; ground seeds:
+    # clusters along the bottom border that sit low in the frame
+    sky_seeds = [
+        i for i in present
+        if (labels[0] == i).mean() > 0.1 and (colour[i][0] > 0.55 or colour[i][1] > 0.53)
+    ]
+    ground_seeds = [i for i in present if (labels[-1] == i).mean() > 0.1 and mean_row[i] > 0.7]
+
+    sky_like = np.isin(labels, [i for i in present if similar(i, sky_seeds)])
+    ground_like = np.isin(labels, [
+        i for i in present if mean_row[i] > 0.5 and similar(i, ground_seeds)
+    ])
+
+    sky = connected_to(sky_like, top_rows)
+    ground = connected_to(ground_like, bottom_rows)
+    green = (rgb[..., 1] > rgb[..., 0] * 1.08) & (rgb[..., 1] > rgb[..., 2] * 1.08)
+    building = clean(~sky & ~ground & ~green)
+    # Drop specks (gaps in foliage, bright clouds): keep only what is
+    # connected to a part of the building too wide to be noise
+    return connected_to(building, erode(building, MIN_BUILDING_WIDTH))
+
+
+def _split_building(labels: np.ndarray, building: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """(roof, siding): building clusters sitting high in the building are roof."""
+    relative = _relative_height(building)
+    roof = np.zeros_like(building)
+    for i in range(labels.max() + 1):
+        members = (labels == i) & building
+        if members.any() and relative[members].mean() < ROOF_SPLIT:
+            roof |= members
+    return roof, building & ~roof
+
+
+def _trim(roof: np.ndarray) -> np.ndarray:
+    thickness = 2 * max(1, int(round(roof.shape[0] * TRIM_FRACTION / 2))) + 1
+    return dilate(roof, thickness) & ~erode(roof, thickness)
+
+
+def _upscale(mask: np.ndarray, size: Tuple[int, int]) -> BitMask:
+    band = Image.fromarray(mask.astype(np.uint8) * 255)
+    if band.size != size:
+        band = band.resize(size, Image.BILINEAR).point(lambda v: 255 if v >= 128 else 0)
+    return BitMask.from_image(band)
+
+
+def segment_house(
+    image_bytes: bytes, regions: Tuple[str, ...], hints: Optional[Hints] = None
+) -> Dict[str, BitMask]:
+    """Mask per requested region, at the size of ``image_bytes``."""
+    img, size = _working_image(image_bytes)
+    labels = kmeans(_features(img), CLUSTERS, KMEANS_ITERATIONS).reshape(img.size[1], img.size[0])
+    roof, siding = _split_building(labels, _building(img, labels))
+
+    # Hinted surfaces win over the heuristics, even outside the building
+    hinted = _hint_masks(img, hints)
+    if "roof" in hinted:
+        roof, siding = roof | hinted["roof"], siding & ~hinted["roof"]
+    if "siding" in hinted:
+        roof, siding = roof & ~hinted["siding"], siding | hinted["siding"]
+
+    roof, siding = clean(roof), clean(siding & ~roof, 5)
+    masks = {"roof": roof, "siding": siding}
+    if "trim" in regions:
+        masks["trim"] = _trim(roof) | hinted.get("trim", False)
+    return {region: _upscale(masks[region], size) for region in regions}
@@ -0,0 +1,101 @@
+"""
+State shared by the worker processes of one deployment.
+
+The server can run as several processes on one box (uvicorn --workers N,
+or gunicorn with uvicorn workers); requests land on any of them. What has
+to agree across processes goes through one SQLite file in WAL mode:
+
+- the disk tier of the mask and result caches (backend.cache)
+- the OpenAI requests-per-minute token bucket (backend.openai_client)
+- edit jobs: status, events, preview and result, so a job submitted on one
+  worker can be followed, fetched and cancelled through any other
+  (backend.jobs)
+
+Without VISUALIZER_SHARED_DB every process keeps this state to itself,
+which is right for a single worker. Per-process pools (CPU workers,
+connections) multiply with the worker count, so size them per worker
+(VISUALIZER_CPU_WORKERS, VISUALIZER_OPENAI_MAX_CONNECTIONS). /metrics
+reports the worker that answers it.
+
+Every access is a short transaction; writers wait up to BUSY_TIMEOUT for
+each other instead of failing.
+
+Running several workers (start command also in render-build.sh):
+    VISUALIZER_SHARED_DB=/var/data/visualizer/state.db \
+        gunicorn backend.main:app -k uvicorn.workers.UvicornWorker -w 4 --graceful-timeout 60
+gunicorn (in requirements.txt) replaces workers one at a time on HUP;
+uvicorn --workers 4 --timeout-graceful-shutdown 60 also works.
+On shutdown each worker finishes its open requests, then waits up to
+VISUALIZER_DRAIN_SECONDS for its jobs (backend.jobs); keep the graceful
+timeout above that.
+
+Configuration (environment variables):
+    VISUALIZER_SHARED_DB   path of the SQLite file shared by the workers
+                           (default: unset, state is per process)
+"""
+
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from backend.logs import get_logger
+
+logger = get_logger("shared")
+
+# Seconds a write waits for another process's write to finish
+BUSY_TIMEOUT = 10.0
+
+
+class SharedDB:
+    """One SQLite file, with a connection per thread (sqlite3 connections are not shared across threads)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # Readers then never block the writer, nor it them (persists in the file)
+        self.execute("PRAGMA journal_mode=WAL")
+
+    def connection(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            # Autocommit mode: transactions are opened explicitly below
+            db = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None)
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Write transaction, taking the lock up front so read-then-write cannot deadlock."""
+        db = self.connection()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        """A single statement (its own implicit transaction)."""
+        return self.connection().execute(sql, params)
+
+
+def shared_db_path() -> Optional[str]:
+    return os.getenv("VISUALIZER_SHARED_DB") or None
+
+
+# Process-wide handle (lazy loading); None when state is per process
+_shared_db = None
+
+def get_shared_db() -> Optional[SharedDB]:
+    global _shared_db
+    path = shared_db_path()
+    if _shared_db is None and path:
+        _shared_db = SharedDB(path)
+        logger.info("shared state enabled", extra={"path": path, "pid": os.getpid()})
+    return _shared_db
@@ -0,0 +1,127 @@
+"""
+Single-flight de-duplication of identical concurrent edits.
+
+A double click, or the same photo and selection submitted from several
+tabs, used to run the whole pipeline once per request: one mask and one
+model call each, for identical results. SingleFlight.run(key, compute)
+starts ``compute`` once per key; calls with the same key while it runs
+join it and all get its result (or its exception):
+
+- the computation runs as its own task, so a caller going away (a
+  cancelled job) does not fail the others; it is cancelled only when
+  every caller has gone
+- each caller keeps its own progress and preview callbacks: the stages
+  reached before it joined are replayed to it, and so is the preview if
+  one was already made
+- ``computed`` and ``coalesced`` count the runs and the calls that joined
+  one, for /health and /metrics
+
+Keys are per process: with several workers (backend.shared_state), only
+requests reaching the same worker are coalesced; the others meet in the
+shared result cache once the first render is stored.
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+ProgressCallback = Callable[[str], None]
+PreviewCallback = Callable[[bytes], None]
+
+
+class Flight:
+    """One computation in progress and the callers waiting for it."""
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.stages: List[str] = []
+        self.preview_image: Optional[bytes] = None
+        self._callers: Dict[int, Tuple[Optional[ProgressCallback], Optional[PreviewCallback]]] = {}
+        self._ids = 0
+
+    @property
+    def wants_preview(self) -> bool:
+        return any(preview is not None for _, preview in self._callers.values())
+
+    def join(self, progress: Optional[ProgressCallback], preview: Optional[PreviewCallback]) -> int:
+        if progress is not None:
+            for stage in self.stages:
+                progress(stage)
+        if preview is not None and self.preview_image is not None:
+            preview(self.preview_image)
+        self._ids += 1
+        self._callers[self._ids] = (progress, preview)
+        return self._ids
+
+    def leave(self, caller: int) -> int:
+        """Forget ``caller``; the number of callers left."""
+        self._callers.pop(caller, None)
+        return len(self._callers)
+
+    def progress(self, stage: str) -> None:
+        """The computation reached ``stage``: tell every caller."""
+        self.stages.append(stage)
+        for progress, _ in list(self._callers.values()):
+            if progress is not None:
+                progress(stage)
+
+    def preview(self, image: bytes) -> None:
+        self.preview_image = image
+        for _, preview in list(self._callers.values()):
+            if preview is not None:
+                preview(image)
+
+
+class SingleFlight:
+    def __init__(self):
+        self._flights: Dict[str, Flight] = {}
+        # Counters
+        self.computed = 0
+        self.coalesced = 0
+
+    async def run(
+        self,
+        key: str,
+        compute: Callable[[Flight], Awaitable[Any]],
+        progress: Optional[ProgressCallback] = None,
+        preview: Optional[PreviewCallback] = None,
+    ) -> Any:
+        """
+        ``compute(flight)``'s result, computed once for all concurrent calls
+        with ``key``. ``compute`` reports through ``flight.progress`` and
+        ``flight.preview``, which reach every caller's callbacks.
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = Flight()
+            caller = flight.join(progress, preview)
+            flight.task = asyncio.get_running_loop().create_task(compute(flight))
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+            self._flights[key] = flight
+            self.computed += 1
+        else:
+            caller = flight.join(progress, preview)
+            self.coalesced += 1
+
+        try:
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if flight.leave(caller) == 0 and not flight.task.done():
+                # Nobody is waiting any more; later calls start afresh
+                self._forget(key, flight)
+                flight.task.cancel()
+            raise
+        finally:
+            flight.leave(caller)
+
+    def _forget(self, key: str, flight: Flight) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def stats(self) -> Dict[str, Any]:
+        calls = self.computed + self.coalesced
+        return {
+            "in_flight": len(self._flights),
+            "computed": self.computed,
+            "coalesced": self.coalesced,
+            "coalesced_rate": round(self.coalesced / calls, 4) if calls else 0.0,
+        }
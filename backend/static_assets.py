@@ -0,0 +1,166 @@
+"""
+In-memory index of the built frontend (backend/static) for the SPA routes.
+
+The tree is walked once, at startup: every file is read, given a strong
+ETag (content hash) and a Cache-Control policy, and compressible files
+(JS, CSS, HTML, SVG, JSON, ...) are precompressed with gzip and, when the
+optional ``brotli`` package is installed, brotli. Requests are then served
+from memory with no filesystem calls:
+
+- the best encoding the client accepts (br, then gzip), with Vary
+- 304 Not Modified when If-None-Match matches
+- Vite's content-hashed files (assets/index-3f9a1c2e.js) are cached for a
+  year as immutable; index.html is always revalidated; everything else
+  (product images, favicon) is cached for an hour
+- paths that are not files fall back to index.html (client-side routing),
+  except under /assets/, where a missing file is a 404
+
+The built frontend is small (a few MB), so holding it in memory is cheap.
+A rebuilt frontend is picked up on restart.
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+from backend.logs import get_logger
+
+logger = get_logger("static")
+
+# The built frontend (render-build.sh copies frontend/dist here)
+STATIC_DIR = os.path.join(os.path.dirname(__file__), "static")
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+SHORT_LIVED = "public, max-age=3600"
+
+# Vite appends an 8-character content hash: index-3f9a1c2e.js, logo-BxT_9kQe.svg
+_HASHED_NAME = re.compile(r"-[A-Za-z0-9_-]{8,}\.[A-Za-z0-9]+$")
+
+_COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml",
+                       "application/xml", "application/manifest+json", "application/wasm")
+# Below this, headers outweigh the savings
+MIN_COMPRESS_BYTES = 1024
+
+
+@dataclass
+class StaticAsset:
+    media_type: str
+    etag: str
+    cache_control: str
+    body: bytes
+    # Content-Encoding -> precompressed body, only when smaller than ``body``
+    encoded: Dict[str, bytes] = field(default_factory=dict)
+
+    def representation(self, accept_encoding: Optional[str]) -> Tuple[Optional[str], bytes, str]:
+        """(content encoding or None, body, ETag) of the best representation for the client."""
+        accepted = _accepted_encodings(accept_encoding)
+        for encoding in ("br", "gzip"):
+            if encoding in self.encoded and encoding in accepted:
+                # A distinct strong ETag per encoding, as the bytes differ
+                return encoding, self.encoded[encoding], f'{self.etag[:-1]}-{encoding}"'
+        return None, self.body, self.etag
+
+
+def _accepted_encodings(accept_encoding: Optional[str]) -> set:
+    accepted = set()
+    for item in (accept_encoding or "").split(","):
+        coding, _, params = item.strip().partition(";")
+        q = params.replace(" ", "").lower().partition("q=")[2]
+        try:
+            if q and float(q) == 0:
+                continue
+        except ValueError:
+            pass
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+def _cache_control(relative_path: str) -> str:
+    if relative_path == "index.html":
+        return REVALIDATE
+    if relative_path.startswith("assets/") and _HASHED_NAME.search(relative_path):
+        return IMMUTABLE
+    return SHORT_LIVED
+
+
+def _compress(body: bytes, media_type: str) -> Dict[str, bytes]:
+    if len(body) < MIN_COMPRESS_BYTES or not media_type.startswith(_COMPRESSIBLE_TYPES):
+        return {}
+    encoded = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        encoded["br"] = brotli.compress(body, quality=11)
+    return {encoding: data for encoding, data in encoded.items() if len(data) < len(body)}
+
+
+def load_asset(path: str, relative_path: str) -> StaticAsset:
+    with open(path, "rb") as f:
+        body = f.read()
+    media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    if media_type.startswith("text/") or media_type == "application/javascript":
+        media_type += "; charset=utf-8"
+    return StaticAsset(
+        media_type=media_type,
+        etag='"' + hashlib.sha256(body).hexdigest()[:32] + '"',
+        cache_control=_cache_control(relative_path),
+        body=body,
+        encoded=_compress(body, media_type),
+    )
+
+
+class StaticIndex:
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.assets: Dict[str, StaticAsset] = {}
+        if not os.path.isdir(directory):
+            return
+        for root, _, files in os.walk(directory):
+            for name in files:
+                path = os.path.join(root, name)
+                relative_path = os.path.relpath(path, directory).replace(os.sep, "/")
+                self.assets[relative_path] = load_asset(path, relative_path)
+        logger.info("static files indexed", extra={
+            "files": len(self.assets),
+            "bytes": sum(len(a.body) for a in self.assets.values()),
+            "precompressed": sorted({e for a in self.assets.values() for e in a.encoded}),
+        })
+
+    @property
+    def index_html(self) -> Optional[StaticAsset]:
+        return self.assets.get("index.html")
+
+    def resolve(self, url_path: str) -> Optional[StaticAsset]:
+        """The file at ``url_path``, index.html for client-side routes, None for a 404."""
+        relative_path = url_path.lstrip("/")
+        asset = self.assets.get(relative_path)
+        if asset is not None:
+            return asset
+        if relative_path.startswith("assets/"):
+            return None
+        return self.index_html
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "files": len(self.assets),
+            "bytes": sum(len(a.body) for a in self.assets.values()),
+            "precompressed_files": sum(1 for a in self.assets.values() if a.encoded),
+        }
+
+
+# Process-wide index (built on first use; main's lifespan builds it at startup)
+_index = None
+
+def get_static_index() -> StaticIndex:
+    global _index
+    if _index is None:
+        _index = StaticIndex(STATIC_DIR)
+    return _index
@@ -0,0 +1,170 @@
+"""
+Bounded reading and validation of image uploads.
+
+Starlette spools multipart uploads (in memory up to 1 MB, then to an
+anonymous temporary file) before the endpoint runs, so the byte limit is
+enforced below it, by UploadLimitMiddleware on the raw request body: a
+Content-Length over the limit is refused before anything is read, and a
+body streamed without one (chunked) is cut off once it passes the limit.
+read_upload then pulls the spool into memory in chunks, and rejects a
+request as early as possible:
+
+- a declared size over the limit before reading anything
+- non-image payloads from the magic bytes of the first chunk
+- oversized dimensions from a header-only probe of the first chunk
+- a body that grows past the limit while reading
+
+Nothing is decoded here; later stages decode once at the resolution they
+need (see prepare_image and finish_edit).
+
+Configuration (environment variables):
+    VISUALIZER_MAX_UPLOAD_MB       largest accepted upload (default 25)
+    VISUALIZER_MAX_UPLOAD_PIXELS   largest accepted width * height (default 64 MP)
+"""
+
+import os
+from io import BytesIO
+from typing import Optional, Tuple
+
+from fastapi import HTTPException, UploadFile
+from PIL import Image, UnidentifiedImageError
+
+MB = 1024 * 1024
+CHUNK_SIZE = 1 * MB
+# Room in a request body for the form fields and multipart framing around the file
+FORM_OVERHEAD = 1 * MB
+
+# Formats the model accepts, by their leading bytes
+_SIGNATURES = {
+    b"\xff\xd8\xff": "JPEG",
+    b"\x89PNG\r\n\x1a\n": "PNG",
+}
+ALLOWED_FORMATS = ("JPEG", "PNG", "WEBP")
+
+
+class UploadRejected(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def max_upload_bytes() -> int:
+    return int(float(os.getenv("VISUALIZER_MAX_UPLOAD_MB", "25")) * MB)
+
+
+def max_upload_pixels() -> int:
+    return int(float(os.getenv("VISUALIZER_MAX_UPLOAD_PIXELS", str(64_000_000))))
+
+
+def sniff_format(head: bytes) -> Optional[str]:
+    """Image format from the first bytes of a payload, or None if it is not a supported image."""
+    for signature, fmt in _SIGNATURES.items():
+        if head.startswith(signature):
+            return fmt
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "WEBP"
+    return None
+
+
+def probe_image(data: bytes) -> Optional[Tuple[str, Tuple[int, int]]]:
+    """
+    (format, (width, height)) from the image header, without decoding pixels.
+
+    ``data`` may be a truncated prefix of the file; returns None when the
+    header is not fully contained in it.
+    """
+    try:
+        with Image.open(BytesIO(data)) as img:
+            return img.format, img.size
+    except Image.DecompressionBombError as e:
+        raise UploadRejected(413, str(e))
+    except (UnidentifiedImageError, OSError, SyntaxError):
+        return None
+
+
+def _check_dimensions(size: Tuple[int, int]) -> None:
+    width, height = size
+    if width <= 0 or height <= 0:
+        raise UploadRejected(400, "Image has no pixels.")
+    if width * height > max_upload_pixels():
+        raise UploadRejected(
+            413, f"Image is {width}x{height}; at most {max_upload_pixels() // 1_000_000} MP is supported."
+        )
+
+
+async def read_upload(file: UploadFile) -> bytes:
+    """Read an uploaded image into memory, enforcing type, byte and pixel limits."""
+    limit = max_upload_bytes()
+    if file.size is not None and file.size > limit:
+        raise UploadRejected(413, f"Upload is larger than {limit / MB:g} MB.")
+
+    buffer = bytearray()
+    probed = False
+    while True:
+        chunk = await file.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        buffer += chunk
+        if len(buffer) > limit:
+            raise UploadRejected(413, f"Upload is larger than {limit / MB:g} MB.")
+
+        if not probed:
+            if sniff_format(bytes(buffer[:16])) is None:
+                raise UploadRejected(415, f"Unsupported upload; send one of {', '.join(ALLOWED_FORMATS)}.")
+            header = probe_image(bytes(buffer))
+            if header is not None:
+                _check_dimensions(header[1])
+                probed = True
+
+    if not buffer:
+        raise UploadRejected(400, "Empty upload.")
+
+    data = bytes(buffer)
+    if not probed:
+        header = probe_image(data)
+        if header is None or header[0] not in ALLOWED_FORMATS:
+            raise UploadRejected(415, "Upload is not a readable image.")
+        _check_dimensions(header[1])
+    return data
+
+
+class UploadLimitMiddleware:
+    """
+    ASGI middleware refusing request bodies larger than the upload limit
+    (plus FORM_OVERHEAD) with 413 before they are spooled.
+
+    The check runs inside ``receive``, so the 413 is raised while the
+    endpoint parses its form and goes through the usual error handling
+    (and the other middleware) like any HTTPException.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT", "PATCH"):
+            await self.app(scope, receive, send)
+            return
+
+        limit = max_upload_bytes() + FORM_OVERHEAD
+        too_large = HTTPException(413, f"Upload is larger than {max_upload_bytes() / MB:g} MB.")
+        declared = dict(scope["headers"]).get(b"content-length")
+        if declared is not None and declared.isdigit() and int(declared) > limit:
+            async def receive_nothing():
+                raise too_large
+            await self.app(scope, receive_nothing, send)
+            return
+
+        received = 0
+
+        async def receive_limited():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise too_large
+            return message
+
+        await self.app(scope, receive_limited, send)
@@ -0,0 +1,247 @@
+"""
+Bounded worker pools for the blocking stages of the edit pipeline.
+
+The FastAPI handlers are async, but OpenAI calls, PIL decode/resize and
+JPEG/PNG encoding all block. They run here instead of on the event loop:
+
+- network-bound calls (OpenAI image edits) on a thread pool
+- CPU-bound image work on a process pool (or threads, if configured)
+
+A pipeline slot semaphore caps how many edits run at once; requests beyond
+that wait in a bounded queue and are rejected once the queue is full.
+Full-resolution renders also reserve their estimated memory from a
+per-process budget (render_memory), first come first served, so a few
+large uploads at once wait for each other instead of exhausting the box
+(see VISUALIZER_RENDER_MEMORY_MB in backend.architectural_visualizer).
+
+Configuration (environment variables):
+    VISUALIZER_IO_WORKERS      threads for network calls (default 8)
+    VISUALIZER_CPU_WORKERS     workers for image work (default: CPU count)
+    VISUALIZER_CPU_POOL        "process" (default) or "thread"
+    VISUALIZER_MAX_IN_FLIGHT   edits running concurrently (default 4)
+    VISUALIZER_MAX_QUEUE       edits allowed to wait for a slot (default 32)
+"""
+
+import asyncio
+import collections
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import Any, Callable, Deque, Dict, Optional
+
+from backend.architectural_visualizer import render_memory_budget
+from backend.metrics import span
+
+
+class PipelineBusy(Exception):
+    """Raised when the wait queue for pipeline slots is already full."""
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    if not value:
+        return default
+    try:
+        return max(1, int(value))
+    except ValueError:
+        raise ValueError(f"{name} must be an integer, got {value!r}")
+
+
+class WorkerPools:
+    def __init__(
+        self,
+        io_workers: int = 8,
+        cpu_workers: Optional[int] = None,
+        cpu_pool: str = "process",
+        max_in_flight: int = 4,
+        max_queue: int = 32,
+        render_memory: int = 0,
+    ):
+        if cpu_pool not in ("process", "thread"):
+            raise ValueError(f"cpu_pool must be 'process' or 'thread', got {cpu_pool!r}")
+
+        self.io_workers = io_workers
+        self.cpu_workers = cpu_workers or os.cpu_count() or 1
+        self.cpu_pool = cpu_pool
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        # Bytes; 0 for no limit
+        self.render_memory = render_memory
+
+        self._io_executor: Optional[Executor] = None
+        self._cpu_executor: Optional[Executor] = None
+        self._executor_lock = threading.Lock()
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._memory: Optional[asyncio.Condition] = None
+        self._memory_queue: Deque[object] = collections.deque()
+
+        # Gauges
+        self.waiting = 0
+        self.in_flight = 0
+        self.io_pending = 0
+        self.cpu_pending = 0
+        self.memory_reserved = 0
+        # Counters
+        self.completed = 0
+        self.rejected = 0
+
+    @classmethod
+    def from_env(cls) -> "WorkerPools":
+        return cls(
+            io_workers=_env_int("VISUALIZER_IO_WORKERS", 8),
+            cpu_workers=_env_int("VISUALIZER_CPU_WORKERS", os.cpu_count() or 1),
+            cpu_pool=os.getenv("VISUALIZER_CPU_POOL", "process"),
+            max_in_flight=_env_int("VISUALIZER_MAX_IN_FLIGHT", 4),
+            max_queue=_env_int("VISUALIZER_MAX_QUEUE", 32),
+            render_memory=render_memory_budget(),
+        )
+
+    # -------------------------------------------------------------------------
+    # Executors (created on first use so importing the app stays cheap)
+    # -------------------------------------------------------------------------
+
+    def _io(self) -> Executor:
+        with self._executor_lock:
+            if self._io_executor is None:
+                self._io_executor = ThreadPoolExecutor(
+                    max_workers=self.io_workers, thread_name_prefix="visualizer-io"
+                )
+            return self._io_executor
+
+    def _cpu(self) -> Executor:
+        with self._executor_lock:
+            if self._cpu_executor is None:
+                if self.cpu_pool == "process":
+                    self._cpu_executor = ProcessPoolExecutor(max_workers=self.cpu_workers)
+                else:
+                    self._cpu_executor = ThreadPoolExecutor(
+                        max_workers=self.cpu_workers, thread_name_prefix="visualizer-cpu"
+                    )
+            return self._cpu_executor
+
+    async def run_io(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Run a blocking network call on the I/O thread pool."""
+        self.io_pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._io(), partial(fn, *args, **kwargs))
+        finally:
+            self.io_pending -= 1
+
+    async def run_cpu(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """
+        Run CPU-bound image work on the CPU pool.
+
+        With the process pool, ``fn`` must be a module-level function and its
+        arguments and result picklable (bytes and tuples in practice).
+        """
+        self.cpu_pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._cpu(), partial(fn, *args, **kwargs))
+        finally:
+            self.cpu_pending -= 1
+
+    # -------------------------------------------------------------------------
+    # Concurrency limit
+    # -------------------------------------------------------------------------
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold one of ``max_in_flight`` pipeline slots for the duration of the block."""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+
+        if self._slots.locked() and self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise PipelineBusy(
+                f"{self.in_flight} edits running and {self.waiting} queued; try again shortly"
+            )
+
+        self.waiting += 1
+        try:
+            with span("queue"):
+                await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self._slots.release()
+
+    @asynccontextmanager
+    async def render_memory_reserved(self, nbytes: int):
+        """
+        Hold ``nbytes`` of the render memory budget for the duration of the
+        block, waiting (in arrival order) until that much is free. A request
+        for more than the whole budget waits until nothing else is reserved.
+        """
+        if self.render_memory <= 0:
+            yield
+            return
+        if self._memory is None:
+            self._memory = asyncio.Condition()
+        nbytes = min(nbytes, self.render_memory)
+
+        # Waiters are served in order, so a large render is not overtaken
+        # forever by a stream of small ones
+        turn = object()
+        async with self._memory:
+            self._memory_queue.append(turn)
+            try:
+                with span("memory"):
+                    await self._memory.wait_for(
+                        lambda: self._memory_queue[0] is turn
+                        and self.memory_reserved + nbytes <= self.render_memory
+                    )
+            finally:
+                self._memory_queue.remove(turn)
+                # The next in line may fit now
+                self._memory.notify_all()
+            self.memory_reserved += nbytes
+
+        try:
+            yield
+        finally:
+            async with self._memory:
+                self.memory_reserved -= nbytes
+                self._memory.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_in_flight": self.max_in_flight,
+            "in_flight": self.in_flight,
+            "queued": self.waiting,
+            "max_queue": self.max_queue,
+            "io_pending": self.io_pending,
+            "cpu_pending": self.cpu_pending,
+            "cpu_pool": self.cpu_pool,
+            "render_memory_mb": round(self.render_memory / (1024 * 1024), 1),
+            "render_memory_reserved_mb": round(self.memory_reserved / (1024 * 1024), 1),
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self) -> None:
+        with self._executor_lock:
+            for executor in (self._io_executor, self._cpu_executor):
+                if executor is not None:
+                    executor.shutdown(wait=True, cancel_futures=True)
+            self._io_executor = None
+            self._cpu_executor = None
+
+
+# Process-wide pools (lazy loading)
+_pools = None
+
+def get_worker_pools() -> WorkerPools:
+    global _pools
+    if _pools is None:
+        _pools = WorkerPools.from_env()
+    return _pools
@@ -0,0 +1,417 @@
+"""
+End-to-end benchmark of POST /edit-image against the stub OpenAI server.
+
+Starts benchmarks.stub_openai and the backend (uvicorn) as subprocesses,
+points the backend's OpenAI client at the stub through OPENAI_BASE_URL,
+then drives /edit-image at each concurrency level for each input size and
+reports:
+
+- throughput (completed requests per second) and error count
+- p50 / p95 / p99 request latency
+- peak RSS of the backend process tree (server + CPU pool workers)
+- CPU seconds per request of that tree (one total: stages are not
+  measured in CPU time)
+- the wall time each pipeline stage took per request (from the backend's
+  /metrics; summed over a request's concurrent calls, so three mask.model
+  calls of 0.5s count 1.5s). Under concurrency this includes waiting for
+  pool workers and the render memory budget, so it is not CPU time.
+
+Caches are disabled and every request uploads distinct bytes, so each one
+runs the whole pipeline. Results are written as JSON (one file per commit
+by default) and can be compared with an earlier run via --compare.
+
+RSS and CPU are read from /proc, so they are only reported on Linux.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_endpoint
+    python -m benchmarks.bench_endpoint --sizes 1 12 --concurrency 1 8 --requests 16 --latency 2
+    python -m benchmarks.bench_endpoint --compare benchmarks/results/1781443.json
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from io import BytesIO
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+import numpy as np
+from PIL import Image
+
+from benchmarks.bench_mask_binarize import size_for_megapixels
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+SELECTIONS = json.dumps({
+    "roof": {"product_name": "Classic Panel"},
+    "siding": {"product_name": "Classic Panel"},
+    "trim": {"product_name": "Corner Trim"},
+})
+
+# Backend settings that make every request do the full amount of work
+BACKEND_ENV = {
+    "OPENAI_API_KEY": "stub",
+    "VISUALIZER_MASK_CACHE_MB": "0",
+    "VISUALIZER_RESULT_CACHE_MB": "0",
+    "VISUALIZER_LOG_LEVEL": "WARNING",
+}
+
+
+# =============================================================================
+# INPUTS
+# =============================================================================
+
+def make_photo(mp: float, seed: int = 0) -> bytes:
+    """A photo-like JPEG (smooth gradients plus sensor-style noise) of ``mp`` megapixels."""
+    width, height = size_for_megapixels(mp)
+    rng = np.random.default_rng(seed)
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    x = np.linspace(0, 1, width, dtype=np.float32)[None, :]
+    rgb = np.empty((height, width, 3), dtype=np.float32)
+    rgb[..., 0] = 90 + 110 * y + 30 * x
+    rgb[..., 1] = 120 + 60 * np.sin(6 * x) * y
+    rgb[..., 2] = 200 - 150 * y
+    rgb += rng.normal(0, 6, size=(height, width, 1)).astype(np.float32)
+    buffer = BytesIO()
+    Image.fromarray(np.clip(rgb, 0, 255).astype(np.uint8)).save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def unique_upload(photo: bytes, index: int) -> bytes:
+    # Bytes after the JPEG end marker are ignored by decoders but change the
+    # image digest, so no cache or shared work can serve the request.
+    return photo + f"bench-{index}".encode()
+
+
+# =============================================================================
+# PROCESSES
+# =============================================================================
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def spawn(args: List[str], env: Optional[Dict[str, str]] = None) -> subprocess.Popen:
+    # stderr goes to a file, not a pipe nobody drains while the benchmark runs
+    return subprocess.Popen(
+        [sys.executable, "-m", *args],
+        env={**os.environ, **(env or {})},
+        stdout=subprocess.DEVNULL,
+        stderr=tempfile.TemporaryFile(),
+    )
+
+
+def wait_ready(url: str, process: subprocess.Popen, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            process.stderr.seek(0)
+            raise SystemExit(f"{url} exited during startup:\n{process.stderr.read().decode()}")
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.TransportError:
+            time.sleep(0.2)
+    raise SystemExit(f"{url} did not come up within {timeout:.0f}s")
+
+
+def process_tree(pid: int) -> List[int]:
+    """``pid`` and all its descendants (Linux /proc)."""
+    pids, frontier = [pid], [pid]
+    while frontier:
+        parent = frontier.pop()
+        try:
+            with open(f"/proc/{parent}/task/{parent}/children") as f:
+                children = [int(c) for c in f.read().split()]
+        except OSError:
+            continue
+        pids += children
+        frontier += children
+    return pids
+
+
+def tree_rss_bytes(pid: int) -> Optional[int]:
+    total = 0
+    for p in process_tree(pid):
+        try:
+            with open(f"/proc/{p}/statm") as f:
+                total += int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except OSError:
+            pass
+    return total or None
+
+
+def tree_cpu_seconds(pid: int) -> Optional[float]:
+    """User + system CPU of the live process tree (utime and stime in /proc/<pid>/stat)."""
+    ticks = 0
+    found = False
+    for p in process_tree(pid):
+        try:
+            with open(f"/proc/{p}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        ticks += int(fields[11]) + int(fields[12])
+        found = True
+    return ticks / os.sysconf("SC_CLK_TCK") if found else None
+
+
+class RssSampler:
+    """Polls the tree's RSS in a thread and keeps the peak."""
+
+    def __init__(self, pid: int, interval: float = 0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            rss = tree_rss_bytes(self.pid)
+            if rss is not None:
+                self.peak = max(self.peak or 0, rss)
+            self._stop.wait(self.interval)
+
+    def __enter__(self) -> "RssSampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+# =============================================================================
+# MEASUREMENT
+# =============================================================================
+
+_STAGE_LINE = re.compile(r'^visualizer_stage_seconds_(sum|count)\{stage="([^"]+)"\} (\S+)$')
+
+
+def stage_totals(base_url: str) -> Dict[str, Tuple[float, float]]:
+    """stage -> (wall seconds, count) from the backend's /metrics."""
+    totals: Dict[str, List[float]] = {}
+    for line in httpx.get(f"{base_url}/metrics").text.splitlines():
+        m = _STAGE_LINE.match(line)
+        if m:
+            kind, stage, value = m.groups()
+            totals.setdefault(stage, [0.0, 0.0])[kind == "count"] = float(value)
+    return {stage: (s, n) for stage, (s, n) in totals.items()}
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return float("nan")
+    rank = max(1, math.ceil(q / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+async def drive(base_url: str, photo: bytes, requests: int, concurrency: int,
+                offset: int) -> Tuple[List[float], int, float]:
+    """Send ``requests`` edits, ``concurrency`` at a time: (latencies, errors, wall seconds)."""
+    latencies: List[float] = []
+    errors = 0
+    limit = asyncio.Semaphore(concurrency)
+
+    async def one(client: httpx.AsyncClient, index: int) -> None:
+        nonlocal errors
+        async with limit:
+            start = time.perf_counter()
+            response = await client.post(
+                f"{base_url}/edit-image",
+                data={"user_selections": SELECTIONS},
+                files={"file": ("house.jpg", unique_upload(photo, index), "image/jpeg")},
+            )
+            await response.aread()
+            if response.status_code == 200:
+                latencies.append(time.perf_counter() - start)
+            else:
+                if not errors:
+                    print(f"  /edit-image answered {response.status_code}: {response.text[:200]}")
+                errors += 1
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(timeout=600.0, limits=limits) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(one(client, offset + i) for i in range(requests)))
+        return latencies, errors, time.perf_counter() - start
+
+
+def run_level(base_url: str, server_pid: int, mp: float, photo: bytes,
+              requests: int, concurrency: int, offset: int) -> Dict[str, Any]:
+    stages_before = stage_totals(base_url)
+    cpu_before = tree_cpu_seconds(server_pid)
+    with RssSampler(server_pid) as rss:
+        latencies, errors, wall = asyncio.run(drive(base_url, photo, requests, concurrency, offset))
+    cpu_after = tree_cpu_seconds(server_pid)
+    stages_after = stage_totals(base_url)
+
+    latencies.sort()
+    completed = len(latencies)
+    stages = {}
+    for stage, (seconds, count) in stages_after.items():
+        before_s, before_n = stages_before.get(stage, (0.0, 0.0))
+        if count > before_n:
+            stages[stage] = round((seconds - before_s) / max(completed, 1), 4)
+
+    cpu_per_request = None
+    if cpu_before is not None and cpu_after is not None and completed:
+        cpu_per_request = round((cpu_after - cpu_before) / completed, 4)
+
+    return {
+        "megapixels": mp,
+        "size": list(size_for_megapixels(mp)),
+        "upload_bytes": len(photo),
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": errors,
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(completed / wall, 3) if wall else 0.0,
+        "latency_seconds": {
+            "mean": round(sum(latencies) / completed, 4) if completed else None,
+            "p50": round(percentile(latencies, 50), 4),
+            "p95": round(percentile(latencies, 95), 4),
+            "p99": round(percentile(latencies, 99), 4),
+        },
+        "peak_rss_mb": round(rss.peak / 2**20, 1) if rss.peak else None,
+        "cpu_seconds_per_request": cpu_per_request,
+        "stage_wall_seconds_per_request": stages,
+    }
+
+
+# =============================================================================
+# REPORTING
+# =============================================================================
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_run(run: Dict[str, Any]) -> None:
+    lat = run["latency_seconds"]
+    rss = f"{run['peak_rss_mb']:.0f}" if run["peak_rss_mb"] else "-"
+    cpu = f"{run['cpu_seconds_per_request']:.2f}" if run["cpu_seconds_per_request"] is not None else "-"
+    print(f"{run['megapixels']:>5g} {run['concurrency']:>5} {run['throughput_rps']:>8.2f} "
+          f"{lat['p50']:>8.3f} {lat['p95']:>8.3f} {lat['p99']:>8.3f} {rss:>8} {cpu:>8} {run['errors']:>6}")
+
+
+def print_stages(run: Dict[str, Any]) -> None:
+    stages = sorted(run["stage_wall_seconds_per_request"].items(), key=lambda kv: -kv[1])
+    print("      " + ", ".join(f"{stage} {seconds * 1000:.0f}ms" for stage, seconds in stages))
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any]) -> None:
+    """Relative change of throughput and latency for runs present in both."""
+    previous = {(r["megapixels"], r["concurrency"]): r for r in baseline["runs"]}
+    print(f"\nvs {baseline['commit']}:")
+    print(f"{'MP':>5} {'conc':>5} {'rps':>8} {'p50':>8} {'p95':>8} {'rss':>8}")
+
+    def delta(new: Optional[float], old: Optional[float]) -> str:
+        if not new or not old:
+            return "-"
+        return f"{(new - old) / old * 100:+.0f}%"
+
+    for run in current["runs"]:
+        old = previous.get((run["megapixels"], run["concurrency"]))
+        if old is None:
+            continue
+        print(f"{run['megapixels']:>5g} {run['concurrency']:>5} "
+              f"{delta(run['throughput_rps'], old['throughput_rps']):>8} "
+              f"{delta(run['latency_seconds']['p50'], old['latency_seconds']['p50']):>8} "
+              f"{delta(run['latency_seconds']['p95'], old['latency_seconds']['p95']):>8} "
+              f"{delta(run['peak_rss_mb'], old['peak_rss_mb']):>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=float, nargs="+", default=[1, 12, 24],
+                        help="Input sizes in megapixels")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4],
+                        help="Concurrent requests per run")
+    parser.add_argument("--requests", type=int, default=8, help="Requests per (size, concurrency) run")
+    parser.add_argument("--latency", type=float, default=0.5, help="Stub seconds per OpenAI call")
+    parser.add_argument("--jitter", type=float, default=0.0, help="+/- seconds around --latency")
+    parser.add_argument("--cpu-pool", choices=("process", "thread"), default=None,
+                        help="VISUALIZER_CPU_POOL for the backend (default: its own default)")
+    parser.add_argument("--output", default=None,
+                        help="Result JSON path (default: benchmarks/results/<commit>.json)")
+    parser.add_argument("--compare", default=None, help="Earlier result JSON to compare against")
+    args = parser.parse_args()
+
+    stub_port, app_port = free_port(), free_port()
+    backend_env = {**BACKEND_ENV, "OPENAI_BASE_URL": f"http://127.0.0.1:{stub_port}/v1"}
+    if args.cpu_pool:
+        backend_env["VISUALIZER_CPU_POOL"] = args.cpu_pool
+
+    stub = spawn(["benchmarks.stub_openai", "--port", str(stub_port), "--latency", str(args.latency),
+                  "--jitter", str(args.jitter), "--seed", "0"])
+    server = spawn(["uvicorn", "backend.main:app", "--port", str(app_port), "--log-level", "warning"],
+                   env=backend_env)
+    base_url = f"http://127.0.0.1:{app_port}"
+    try:
+        wait_ready(f"http://127.0.0.1:{stub_port}/stats", stub)
+        wait_ready(f"{base_url}/health", server)
+
+        result = {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "config": {
+                "stub_latency": args.latency,
+                "stub_jitter": args.jitter,
+                "requests": args.requests,
+                "cpu_pool": args.cpu_pool or "default",
+                "cpu_count": os.cpu_count(),
+            },
+            "runs": [],
+        }
+
+        print(f"{'MP':>5} {'conc':>5} {'rps':>8} {'p50 s':>8} {'p95 s':>8} {'p99 s':>8} "
+              f"{'rss MB':>8} {'cpu s/r':>8} {'errors':>6}")
+        offset = 0
+        for mp in args.sizes:
+            photo = make_photo(mp)
+            # Warm-up: worker processes, imports and connections
+            run_level(base_url, server.pid, mp, photo, 1, 1, offset)
+            offset += 1
+            for concurrency in args.concurrency:
+                run = run_level(base_url, server.pid, mp, photo, args.requests, concurrency, offset)
+                offset += args.requests
+                result["runs"].append(run)
+                print_run(run)
+                print_stages(run)
+    finally:
+        for process in (server, stub):
+            process.terminate()
+            process.wait(timeout=30)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{result['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(result, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Micro-benchmark for mask binarization.
+
+Compares the original per-pixel loop from generate_and_save_mask with the
+vectorized binarize_mask path, checks both produce identical pixels and
+reports the cost per megapixel of output.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_mask_binarize
+    python -m benchmarks.bench_mask_binarize --sizes 1 12 24 --skip-legacy
+"""
+
+import argparse
+import time
+from io import BytesIO
+from typing import Tuple
+
+import numpy as np
+from PIL import Image
+
+from backend.architectural_visualizer import binarize_mask
+
+MODEL_SIZE = (1024, 1024)
+
+
+def make_model_mask(seed: int = 0) -> bytes:
+    """A noisy black/white PNG shaped like a model mask response."""
+    rng = np.random.default_rng(seed)
+    h, w = MODEL_SIZE[1], MODEL_SIZE[0]
+    rgb = rng.integers(0, 256, size=(h, w, 3), dtype=np.uint8)
+    rgb[h // 4: h // 2, :] = 255  # a solid "roof" band
+    buf = BytesIO()
+    Image.fromarray(rgb).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def legacy_binarize(mask_bytes: bytes, size: Tuple[int, int]) -> Image.Image:
+    """The pre-vectorization implementation, kept verbatim for comparison."""
+    mask_img = Image.open(BytesIO(mask_bytes)).convert("RGBA")
+    mask_img = mask_img.resize(size, Image.NEAREST)
+
+    pixels = mask_img.load()
+    for y in range(mask_img.height):
+        for x in range(mask_img.width):
+            r, g, b, a = pixels[x, y]
+            if r > 200 and g > 200 and b > 200:
+                pixels[x, y] = (255, 255, 255, 255)
+            else:
+                pixels[x, y] = (0, 0, 0, 0)
+    return mask_img
+
+
+def size_for_megapixels(mp: float) -> Tuple[int, int]:
+    # 4:3 landscape, the usual phone camera aspect
+    height = int((mp * 1_000_000 * 3 / 4) ** 0.5)
+    return (height * 4 // 3, height)
+
+
+def time_call(fn, *args, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=float, nargs="+", default=[1, 4, 12],
+                        help="Output sizes in megapixels")
+    parser.add_argument("--skip-legacy", action="store_true",
+                        help="Only time the vectorized path")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    mask_bytes = make_model_mask()
+
+    print(f"{'MP':>6} {'size':>12} {'legacy ms/MP':>14} {'vector ms/MP':>14} {'speedup':>9}")
+    for mp in args.sizes:
+        size = size_for_megapixels(mp)
+        actual_mp = size[0] * size[1] / 1_000_000
+
+        vector_s = time_call(binarize_mask, mask_bytes, size, repeat=args.repeat)
+        legacy_col, speedup_col = "-", "-"
+
+        if not args.skip_legacy:
+            expected = legacy_binarize(mask_bytes, size)
+            if expected.tobytes() != binarize_mask(mask_bytes, size).tobytes():
+                raise SystemExit(f"Output mismatch at {size}")
+            legacy_s = time_call(legacy_binarize, mask_bytes, size, repeat=1)
+            legacy_col = f"{legacy_s * 1000 / actual_mp:.1f}"
+            speedup_col = f"{legacy_s / vector_s:.0f}x"
+
+        print(f"{mp:>6g} {size[0]:>5}x{size[1]:<6} {legacy_col:>14} "
+              f"{vector_s * 1000 / actual_mp:>14.2f} {speedup_col:>9}")
+
+
+if __name__ == "__main__":
+    main()
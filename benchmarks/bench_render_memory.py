@@ -0,0 +1,150 @@
+"""
+Peak memory of the full-resolution render stages as the upload grows.
+
+For each input size, a fresh Python process decodes a synthetic photo,
+composites a canned edit onto it inside a canned mask (the stub server's
+outputs) and encodes the result, exactly as timed_finish_edit does for a
+request. The process's peak RSS during the render, above its RSS before it
+(the imports and the upload bytes), is reported, once without a budget
+(VISUALIZER_RENDER_MEMORY_MB=0) and once with the given one.
+
+Without a budget the peak grows with the input; with it, every size has
+to stay under the budget (plus --tolerance), however large the upload,
+or the run exits with status 1, so it can gate a change to the render
+path. Uploads whose render fits the budget stay at full resolution; only
+larger ones are rendered at a power-of-two scale (the "scale" column), so
+their peak moves between a quarter of the budget and the budget rather
+than being constant. tests/test_render_memory.py runs the same
+measurement as part of the test suite.
+
+RSS is read from /proc (and its high-water mark reset through
+/proc/self/clear_refs), so this only runs on Linux.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_render_memory
+    python -m benchmarks.bench_render_memory --sizes 12 24 48 --memory-mb 320 --encodings jpeg webp
+"""
+
+import argparse
+import base64
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+from backend.architectural_visualizer import image_size, prepare_image, threshold_mask, timed_finish_edit
+from backend.bitmask import BitMask
+from backend.encodings import FORMATS, OutputEncoding
+from benchmarks.bench_endpoint import make_photo
+from benchmarks.stub_openai import canned_outputs
+
+KB = 1024
+MB = 1024 * 1024
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def rss_bytes(field: str) -> int:
+    """VmRSS (current) or VmHWM (peak) of this process."""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) * KB
+    raise RuntimeError(f"{field} missing from /proc/self/status")
+
+
+def reset_peak_rss() -> None:
+    # "5" resets the high-water mark to the current RSS
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+
+
+def child(path: str, formats: List[str]) -> None:
+    """Render ``path`` once and print the measurements as JSON (runs in the subprocess)."""
+    with open(path, "rb") as f:
+        image_bytes = f.read()
+    prepared = prepare_image(image_bytes)
+    outputs = canned_outputs()
+    mask = BitMask.union(
+        threshold_mask(base64.b64decode(outputs[region]), prepared.model_size)
+        for region in ("roof", "siding", "trim")
+    )
+    edited = base64.b64decode(outputs["edit"])
+    encodings = tuple(OutputEncoding(fmt, "high").pil_args for fmt in formats)
+
+    reset_peak_rss()
+    baseline = rss_bytes("VmRSS")
+    start = time.perf_counter()
+    rendered, _ = timed_finish_edit(image_bytes, edited, mask, encodings)
+    seconds = time.perf_counter() - start
+    peak = rss_bytes("VmHWM")
+
+    print(json.dumps({
+        "original_size": image_size(image_bytes),
+        "render_size": image_size(rendered[0]),
+        "baseline_mb": baseline / MB,
+        "peak_mb": peak / MB,
+        "render_mb": (peak - baseline) / MB,
+        "seconds": seconds,
+    }))
+
+
+def measure(path: str, formats: List[str], memory_mb: Optional[float]) -> Dict[str, Any]:
+    """Render ``path`` in a fresh process under a ``memory_mb`` budget (None: no limit); the child's JSON."""
+    env = dict(os.environ)
+    env["VISUALIZER_RENDER_MEMORY_MB"] = str(memory_mb or 0)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [ROOT, env.get("PYTHONPATH")]))
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_render_memory", "--child", path, "--encodings", *formats],
+        env=env, cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=float, nargs="+", default=[6, 12, 24, 48],
+                        help="Input sizes in megapixels")
+    parser.add_argument("--encodings", nargs="+", choices=FORMATS, default=["jpeg"],
+                        help="Output formats rendered per request (as /edit-image negotiates them)")
+    parser.add_argument("--memory-mb", type=float, default=96,
+                        help="VISUALIZER_RENDER_MEMORY_MB for the budget run")
+    parser.add_argument("--tolerance", type=float, default=16,
+                        help="MB the budget run may exceed the budget by")
+    parser.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.encodings)
+        return
+
+    print(f"{'MP':>6} {'budget':>9} {'render size':>13} {'scale':>6} {'peak MB':>9} {'render MB':>10} {'s':>6}")
+    failures: List[str] = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for mp in args.sizes:
+            path = os.path.join(tmp, f"{mp:g}mp.jpg")
+            with open(path, "wb") as f:
+                f.write(make_photo(mp))
+            for memory_mb in (None, args.memory_mb):
+                run = measure(path, args.encodings, memory_mb)
+                width, height = run["render_size"]
+                scale = f"1/{round(max(run['original_size']) / max(width, height))}"
+                budget = f"{memory_mb:g}" if memory_mb else "-"
+                print(f"{mp:>6g} {budget:>9} {width:>6}x{height:<6} {scale:>6} "
+                      f"{run['peak_mb']:>9.0f} {run['render_mb']:>10.0f} {run['seconds']:>6.2f}")
+                if memory_mb is None:
+                    continue
+                if run["render_mb"] > memory_mb + args.tolerance:
+                    failures.append(f"{mp:g} MP used {run['render_mb']:.0f} MB over a {memory_mb:g} MB budget")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
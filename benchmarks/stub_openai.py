@@ -0,0 +1,126 @@
+"""
+Local stand-in for the OpenAI images.edit endpoint.
+
+Accepts the same multipart POST /v1/images/edits the SDK sends and answers
+with canned gpt-image-1 style output after a configurable delay:
+
+- mask prompts ("segmentation mask") get a black image with a white band
+  where the requested region would be
+- edit prompts get a flat recoloured image
+
+A fraction of calls can be made to fail with 429/500 to exercise retries
+and the circuit breaker.
+
+Usage (from the repository root):
+    python -m benchmarks.stub_openai --port 8100 --latency 2 --error-rate 0.1
+
+then run the backend against it:
+    OPENAI_API_KEY=stub OPENAI_BASE_URL=http://127.0.0.1:8100/v1 uvicorn backend.main:app
+"""
+
+import argparse
+import asyncio
+import base64
+import random
+import time
+from io import BytesIO
+from typing import Dict, Optional
+
+import numpy as np
+from fastapi import FastAPI, File, Form, UploadFile
+from fastapi.responses import JSONResponse
+from PIL import Image
+
+OUTPUT_SIZE = (1024, 1024)
+
+# Rows (as fractions of the height) the canned mask marks white per region
+REGION_BANDS = {
+    "roof": (0.15, 0.45),
+    "siding": (0.45, 0.85),
+    "trim": (0.44, 0.47),
+}
+
+
+def _png_b64(rgb: np.ndarray) -> str:
+    buffer = BytesIO()
+    Image.fromarray(rgb).save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+def canned_outputs() -> Dict[str, str]:
+    """Pre-encoded responses, so the stub's own CPU cost stays negligible."""
+    height, width = OUTPUT_SIZE[1], OUTPUT_SIZE[0]
+    outputs = {}
+    for region, (top, bottom) in REGION_BANDS.items():
+        rgb = np.zeros((height, width, 3), dtype=np.uint8)
+        rgb[int(top * height):int(bottom * height)] = 255
+        outputs[region] = _png_b64(rgb)
+    outputs["edit"] = _png_b64(np.full((height, width, 3), (46, 96, 62), dtype=np.uint8))
+    return outputs
+
+
+def create_app(latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+               seed: Optional[int] = None) -> FastAPI:
+    app = FastAPI()
+    outputs = canned_outputs()
+    rng = random.Random(seed)
+    app.state.calls = {"mask": 0, "edit": 0, "errors": 0}
+
+    @app.post("/v1/images/edits")
+    async def images_edit(
+        prompt: str = Form(...),
+        model: str = Form("gpt-image-1"),
+        image: UploadFile = File(...),
+        mask: Optional[UploadFile] = File(None),
+    ):
+        await image.read()
+        if mask is not None:
+            await mask.read()
+
+        await asyncio.sleep(max(0.0, latency + rng.uniform(-jitter, jitter)))
+
+        if error_rate and rng.random() < error_rate:
+            app.state.calls["errors"] += 1
+            status = rng.choice((429, 500))
+            return JSONResponse(
+                status_code=status,
+                content={"error": {"message": "stub failure", "type": "server_error", "code": None}},
+                headers={"retry-after": "0.1"} if status == 429 else None,
+            )
+
+        if "segmentation mask" in prompt:
+            app.state.calls["mask"] += 1
+            region = next((r for r in REGION_BANDS if r in prompt.lower()), "roof")
+            b64 = outputs[region]
+        else:
+            app.state.calls["edit"] += 1
+            b64 = outputs["edit"]
+        return {"created": int(time.time()), "data": [{"b64_json": b64}]}
+
+    @app.get("/stats")
+    async def stats():
+        return app.state.calls
+
+    return app
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Stub OpenAI images.edit server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds per call")
+    parser.add_argument("--jitter", type=float, default=0.0, help="+/- seconds around --latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of calls answered 429/500")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    uvicorn.run(
+        create_app(args.latency, args.jitter, args.error_rate, args.seed),
+        host=args.host, port=args.port, log_level="warning",
+    )
+
+
+if __name__ == "__main__":
+    main()
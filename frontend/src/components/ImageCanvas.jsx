@@ -1,7 +1,7 @@
 import React from 'react'
 import './ImageCanvas.css'
 
-function ImageCanvas({ houseImage, hasSubPanel, analysisResults, isAnalyzing, apiError, apiConnected, viewMode, isEditing, hasSelectedItems }) {
+function ImageCanvas({ houseImage, hasSubPanel, analysisResults, isAnalyzing, apiError, apiConnected, viewMode, isEditing, hasSelectedItems, isPreview }) {
   // Determine image state
   const isInvalidImage = analysisResults && analysisResults.valid_exterior_image === false
   const isValidAnalyzed = analysisResults && analysisResults.valid_exterior_image === true
@@ -56,7 +56,14 @@ function ImageCanvas({ houseImage, hasSubPanel, analysisResults, isAnalyzing, ap
                   <p>Select products and click View to analyze</p>
                 </div>
               )}
-              {(isAnalyzing || isEditing) && (
+              {isPreview && (
+                // Low-res result is on screen; the full-resolution one swaps in when ready
+                <div className="preview-badge">
+                  <span className="loading-spinner small">⏳</span>
+                  <span>Refining full resolution...</span>
+                </div>
+              )}
+              {(isAnalyzing || isEditing) && !isPreview && (
                 <div className="analysis-overlay">
                   <div className="loading-spinner">⏳</div>
                   <p>{isAnalyzing ? 'Analyzing image...' : 'Editing image...'}</p>
@@ -1,7 +1,7 @@
 import React from 'react';
 import './Loader.css';
 
-const Loader = ({ message }) => {
+const Loader = ({ message, progress }) => {
   const [currentMessage, setCurrentMessage] = React.useState(message);
 
   React.useEffect(() => {
@@ -52,7 +52,7 @@ const Loader = ({ message }) => {
         </div>
         <div className="loader-text">
           <h3>{currentMessage}</h3>
-          <p>AI is designing your exterior...</p>
+          <p>{progress || "AI is designing your exterior..."}</p>
         </div>
       </div>
     </div>
@@ -6,7 +6,7 @@ import DetectionResultsPanel from './DetectionResultsPanel'
 import AnalysisResultModal from './AnalysisResultModal'
 import Loader from './Loader'
 import { productData } from './ProductData'
-import { analyzeExterior, checkHealth, editImage } from '../services/api'
+import { analyzeExterior, checkHealth, editImage, EDIT_STAGE_LABELS, imageExtension } from '../services/api'
 import ConnectionStatus from './ConnectionStatus'
 import './VisualizerLayout.css'
 
@@ -22,6 +22,8 @@ function VisualizerLayout() {
   const [apiConnected, setApiConnected] = useState(false)
   const [editedImage, setEditedImage] = useState(null)
   const [isEditing, setIsEditing] = useState(false)
+  const [editStage, setEditStage] = useState(null) // Latest progress stage of the running edit job
+  const [previewImage, setPreviewImage] = useState(null) // Low-res result shown until the full one arrives
   const [viewMode, setViewMode] = useState('original') // 'original' or 'edited'
   const [showAnalysisModal, setShowAnalysisModal] = useState(false)
 
@@ -145,14 +147,29 @@ function VisualizerLayout() {
     setIsEditing(true)
     setApiError(null)
 
+    let previewUrl = null
+    const showPreview = (url) => {
+      // The instant local preview is replaced by the model's own preview
+      if (previewUrl) {
+        URL.revokeObjectURL(previewUrl)
+      }
+      previewUrl = url
+      setPreviewImage(url)
+    }
+
     try {
-      const editedImageUrl = await editImage(imageFile, currentAnalysisResults, selectedProducts)
+      const editedImageUrl = await editImage(imageFile, currentAnalysisResults, selectedProducts, setEditStage, showPreview)
       setEditedImage(editedImageUrl)
       setViewMode('edited')
     } catch (error) {
       setApiError(`Failed to edit image: ${error.message}`)
     } finally {
       setIsEditing(false)
+      setEditStage(null)
+      setPreviewImage(null)
+      if (previewUrl) {
+        URL.revokeObjectURL(previewUrl)
+      }
     }
   }
 
@@ -215,12 +232,13 @@ function VisualizerLayout() {
 
     try {
       // Get edited image (create new if not cached)
-      const editedImageUrl = editedImage || await editImage(imageFile, currentAnalysisResults, selectedProducts)
+      const editedImageUrl = editedImage || await editImage(imageFile, currentAnalysisResults, selectedProducts, setEditStage)
 
-      // Download the image
+      // Download the image, named after the format the backend actually sent
+      const imageBlob = await (await fetch(editedImageUrl)).blob()
       const link = document.createElement('a')
       link.href = editedImageUrl
-      link.download = 'edited_house_image.jpg'
+      link.download = `edited_house_image.${imageExtension(imageBlob.type)}`
       document.body.appendChild(link)
       link.click()
       document.body.removeChild(link)
@@ -233,6 +251,7 @@ function VisualizerLayout() {
       setApiError(`Failed to download image: ${error.message}`)
     } finally {
       setIsEditing(false)
+      setEditStage(null)
     }
   }
 
@@ -293,8 +312,11 @@ function VisualizerLayout() {
       <ConnectionStatus isConnected={apiConnected} />
 
       {/* 1. Loading Overlay */}
-      {(isAnalyzing || isEditing) && (
-        <Loader message={isEditing ? "Applying materials..." : "Analyzing structure..."} />
+      {(isAnalyzing || (isEditing && !previewImage)) && (
+        <Loader
+          message={isEditing ? "Applying materials..." : "Analyzing structure..."}
+          progress={isEditing && editStage ? EDIT_STAGE_LABELS[editStage] : null}
+        />
       )}
 
       <LeftCategorySidebar
@@ -380,7 +402,8 @@ function VisualizerLayout() {
       )}
 
       <ImageCanvas
-        houseImage={viewMode === 'edited' && editedImage ? editedImage : houseImage}
+        houseImage={previewImage || (viewMode === 'edited' && editedImage ? editedImage : houseImage)}
+        isPreview={!!previewImage}
         hasSubPanel={!!activeCategory}
         analysisResults={analysisResults}
         isAnalyzing={isAnalyzing}
@@ -34,17 +34,157 @@ export const checkHealth = async () => {
   }
 };
 
-export const editImage = async (imageFile, analysisResults, userSelections) => {
+// Human readable labels for the job progress stages sent by the backend
+export const EDIT_STAGE_LABELS = {
+  queued: 'Waiting in queue...',
+  upload: 'Photo uploaded...',
+  running: 'Starting edit...',
+  mask: 'Detecting roof, siding and trim...',
+  edit: 'Applying materials...',
+  composite: 'Finalizing details...',
+};
+
+export const submitEditJob = async (imageFile, analysisResults, userSelections, priority = 'normal') => {
+  const formData = new FormData();
+  formData.append('file', imageFile);
+  formData.append('analysis_results', JSON.stringify(analysisResults));
+  formData.append('user_selections', JSON.stringify(userSelections));
+  formData.append('priority', priority);
+
+  // WebP is a fraction of the JPEG's size; browsers with Data Saver on also
+  // send Save-Data, which makes the backend pick its low quality tier.
+  const response = await fetch(`${API_BASE_URL}/jobs?format=webp`, {
+    method: 'POST',
+    body: formData,
+  });
+
+  if (!response.ok) {
+    throw new Error(`API Error: ${response.status} ${response.statusText}`);
+  }
+
+  return response.json();
+};
+
+// Object URL of the job's low-resolution preview, or null if it is gone.
+const fetchEditPreview = async (job) => {
+  const response = await fetch(`${API_BASE_URL}${job.preview_url}`);
+  if (!response.ok) {
+    return null;
+  }
+  return URL.createObjectURL(await response.blob());
+};
+
+// Resolves once the job is done, calling onProgress(stage) for every
+// stage event streamed over Server-Sent Events, and onPreview(url) with
+// the low-resolution preview when the backend publishes one.
+export const waitForEditJob = (job, onProgress, onPreview) => new Promise((resolve, reject) => {
+  const events = new EventSource(`${API_BASE_URL}${job.events_url}`);
+  let finished = false;
+
+  const handle = (message) => {
+    const event = JSON.parse(message.data);
+    const stage = event.type === 'progress' ? event.stage : event.status;
+    if (onProgress && EDIT_STAGE_LABELS[stage]) {
+      onProgress(stage);
+    }
+    if (event.status === 'done') {
+      finished = true;
+      events.close();
+      resolve(job);
+    } else if (event.status === 'failed' || event.status === 'cancelled') {
+      finished = true;
+      events.close();
+      reject(new Error(event.error || `Edit ${event.status}`));
+    }
+  };
+
+  const handlePreview = async () => {
+    if (!onPreview) {
+      return;
+    }
+    const previewUrl = await fetchEditPreview(job).catch(() => null);
+    // The full result may have won the race; a late preview is not shown
+    if (previewUrl && finished) {
+      URL.revokeObjectURL(previewUrl);
+    } else if (previewUrl) {
+      onPreview(previewUrl);
+    }
+  };
+
+  events.addEventListener('status', handle);
+  events.addEventListener('progress', handle);
+  events.addEventListener('preview', handlePreview);
+  events.onerror = () => {
+    if (finished) {
+      return;
+    }
+    finished = true;
+    events.close();
+    // Nobody will fetch the result: stop the job instead of leaving it
+    // rendering (and holding a model call) on the server
+    cancelEditJob(job.job_id)
+      .catch(() => null)
+      .then(() => reject(new Error('Lost connection to the edit progress stream')));
+  };
+});
+
+// File extension for a downloaded render, from its Content-Type (jobs are
+// requested as WebP, but the backend may negotiate another format).
+const IMAGE_EXTENSIONS = {
+  'image/jpeg': 'jpg',
+  'image/webp': 'webp',
+  'image/png': 'png',
+};
+
+export const imageExtension = (mimeType) => IMAGE_EXTENSIONS[(mimeType || '').split(';')[0].trim()] || 'jpg';
+
+// Object URL of an instant, locally recoloured render (no model call), or
+// null when the backend cannot make one.
+export const renderLocalPreview = async (imageFile, userSelections) => {
+  const formData = new FormData();
+  formData.append('file', imageFile);
+  formData.append('user_selections', JSON.stringify(userSelections));
+
+  const response = await fetch(`${API_BASE_URL}/edit-image?engine=local&format=webp&quality=standard`, {
+    method: 'POST',
+    body: formData,
+  });
+  if (!response.ok) {
+    return null;
+  }
+  return URL.createObjectURL(await response.blob());
+};
+
+export const cancelEditJob = async (jobId) => {
+  await fetch(`${API_BASE_URL}/jobs/${jobId}`, { method: 'DELETE' });
+};
+
+export const editImage = async (imageFile, analysisResults, userSelections, onProgress, onPreview) => {
+  // The local preview is shown at once; the model's preview, when it
+  // comes, replaces it, and nothing is shown after the result is in.
+  let modelPreviewShown = false;
+  let finished = false;
+  const showModelPreview = (url) => {
+    modelPreviewShown = true;
+    onPreview(url);
+  };
+  if (onPreview) {
+    renderLocalPreview(imageFile, userSelections)
+      .catch(() => null)
+      .then((url) => {
+        if (url && (finished || modelPreviewShown)) {
+          URL.revokeObjectURL(url);
+        } else if (url) {
+          onPreview(url);
+        }
+      });
+  }
+
   try {
-    const formData = new FormData();
-    formData.append('file', imageFile);
-    formData.append('analysis_results', JSON.stringify(analysisResults));
-    formData.append('user_selections', JSON.stringify(userSelections));
+    const job = await submitEditJob(imageFile, analysisResults, userSelections);
+    await waitForEditJob(job, onProgress, onPreview && showModelPreview);
 
-    const response = await fetch(`${API_BASE_URL}/edit-image`, {
-      method: 'POST',
-      body: formData,
-    });
+    const response = await fetch(`${API_BASE_URL}${job.result_url}`);
 
     if (!response.ok) {
       throw new Error(`API Error: ${response.status} ${response.statusText}`);
@@ -57,6 +197,7 @@ export const editImage = async (imageFile, analysisResults, userSelections) => {
   } catch (error) {
     console.error('Image editing error:', error);
     throw error;
+  } finally {
+    finished = true;
   }
 };
-
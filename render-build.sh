@@ -1,6 +1,17 @@
 #!/usr/bin/env bash
 set -e
 
+# Start command, after this build. One process:
+#   uvicorn backend.main:app --host 0.0.0.0 --port $PORT
+# Several worker processes sharing caches, rate limit and jobs through one
+# SQLite file (backend/shared_state.py); the graceful timeout must exceed
+# VISUALIZER_DRAIN_SECONDS (default 30) so running jobs can finish:
+#   VISUALIZER_SHARED_DB=/var/data/visualizer/state.db \
+#     gunicorn backend.main:app -k uvicorn.workers.UvicornWorker \
+#       -w ${WEB_CONCURRENCY:-4} --bind 0.0.0.0:$PORT --graceful-timeout 60
+# (uvicorn --workers N with --timeout-graceful-shutdown 60 works too, but
+# cannot replace workers one at a time.)
+
 echo "Building Frontend..."
 cd frontend
 npm install
@@ -0,0 +1,132 @@
+"""
+Peak memory of the full-resolution render, and the render memory budget.
+
+The peak is measured as benchmarks.bench_render_memory does it: a fresh
+process renders a synthetic photo and reports its RSS high-water mark
+above the RSS it started the render with. Linux only (/proc).
+
+Pillow holds the whole decoded image, so at full resolution the peak
+grows with the pixel count; what the strip composite guarantees is that
+nothing beyond that grows: the peak per decoded megapixel does not rise
+with the input. Under a fixed budget the peak stays flat however large
+the upload, since larger ones are rendered at a reduced scale.
+"""
+
+import asyncio
+import os
+import tempfile
+
+import pytest
+
+from backend.workers import WorkerPools
+from benchmarks.bench_endpoint import make_photo
+from benchmarks.bench_render_memory import measure
+
+MB = 1024 * 1024
+# Allocator slack and RSS granularity
+TOLERANCE_MB = 16
+# Allowed rise of the peak per decoded megapixel from 24 to 48 MP
+PER_PIXEL_RISE = 1.10
+
+linux_only = pytest.mark.skipif(not os.path.exists("/proc/self/clear_refs"), reason="needs /proc RSS accounting")
+
+
+@pytest.fixture(scope="module")
+def photos():
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = {}
+        for mp in (12, 24, 48):
+            paths[mp] = os.path.join(tmp, f"{mp}mp.jpg")
+            with open(paths[mp], "wb") as f:
+                f.write(make_photo(mp))
+        yield paths
+
+
+def _render_megapixels(run) -> float:
+    width, height = run["render_size"]
+    return width * height / 1_000_000
+
+
+@linux_only
+@pytest.mark.parametrize("formats", [["jpeg"], ["jpeg", "webp"]])
+def test_peak_per_megapixel_does_not_rise_with_input(photos, formats):
+    runs = {mp: measure(photos[mp], formats, None) for mp in (24, 48)}
+    per_mp = {mp: run["render_mb"] / _render_megapixels(run) for mp, run in runs.items()}
+    assert per_mp[48] <= per_mp[24] * PER_PIXEL_RISE, per_mp
+
+
+@linux_only
+def test_peak_stays_flat_at_a_fixed_budget(photos):
+    # 12 MP fits 64 MB at full resolution; 24 and 48 MP are rendered at 1/2
+    budget_mb = 64
+    runs = {mp: measure(photos[mp], ["jpeg"], budget_mb) for mp in (12, 24, 48)}
+    assert tuple(runs[12]["render_size"]) == tuple(runs[12]["original_size"])
+    assert _render_megapixels(runs[48]) == pytest.approx(_render_megapixels(runs[12]), rel=0.05)
+    peaks = {mp: run["render_mb"] for mp, run in runs.items()}
+    assert max(peaks.values()) <= peaks[12] * PER_PIXEL_RISE + TOLERANCE_MB / 4, peaks
+    assert max(peaks.values()) <= budget_mb + TOLERANCE_MB, peaks
+
+
+@linux_only
+@pytest.mark.parametrize("mp, formats, budget_mb, scale", [
+    # Default budget: a 48 MP photo still renders at full resolution
+    (48, ["jpeg"], 320, 1),
+    (24, ["jpeg", "webp"], 320, 1),
+    # Only a render larger than the whole budget is reduced
+    (48, ["jpeg", "webp"], 320, 2),
+    (48, ["jpeg"], 128, 2),
+])
+def test_render_peak_within_budget(photos, mp, formats, budget_mb, scale):
+    run = measure(photos[mp], formats, budget_mb)
+    width, height = run["original_size"]
+    assert tuple(run["render_size"]) == (width // scale, height // scale)
+    assert run["render_mb"] <= budget_mb + TOLERANCE_MB
+
+
+def test_reservations_never_exceed_budget():
+    pools = WorkerPools(render_memory=100 * MB)
+    reserved = []
+
+    async def render(nbytes):
+        async with pools.render_memory_reserved(nbytes):
+            reserved.append(pools.memory_reserved)
+            await asyncio.sleep(0.01)
+
+    async def main():
+        await asyncio.gather(*(render(nbytes * MB) for nbytes in (60, 30, 60, 10, 90, 40)))
+
+    asyncio.run(main())
+    assert len(reserved) == 6
+    assert max(reserved) <= 100 * MB
+    assert pools.memory_reserved == 0
+
+
+def test_reservations_are_served_in_order():
+    pools = WorkerPools(render_memory=100 * MB)
+    started = []
+
+    async def render(name, nbytes):
+        async with pools.render_memory_reserved(nbytes * MB):
+            started.append(name)
+            await asyncio.sleep(0.01)
+
+    async def main():
+        first = asyncio.ensure_future(render("small-1", 60))
+        await asyncio.sleep(0)
+        # "large" waits for "small-1"; "small-2" would fit beside it but must not overtake
+        rest = [asyncio.ensure_future(render("large", 80)), asyncio.ensure_future(render("small-2", 20))]
+        await asyncio.gather(first, *rest)
+
+    asyncio.run(main())
+    assert started == ["small-1", "large", "small-2"]
+
+
+def test_oversized_reservation_waits_for_the_whole_budget():
+    pools = WorkerPools(render_memory=100 * MB)
+
+    async def main():
+        async with pools.render_memory_reserved(500 * MB):
+            assert pools.memory_reserved == 100 * MB
+
+    asyncio.run(main())
+    assert pools.memory_reserved == 0